@@ -0,0 +1,441 @@
+#!/usr/bin/python
+
+"""
+Benchmarks for epp library.
+
+Run as 'python bench.py [name...]' to run all (or only the named) benchmarks.
+"""
+
+import pickle
+import sys
+import timeit
+import tracemalloc
+
+import epp
+
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """ Register a benchmark function. """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def measure(func, number=5):
+    """ Return the best time of 'number' runs of 'func', in seconds. """
+    return min(timeit.repeat(func, number=1, repeat=number))
+
+
+def report(name, seconds, **extra):
+    """ Print a line describing the results of a benchmark. """
+    details = "".join(f", {key}={value}" for key, value in extra.items())
+    print(f"{name}: {seconds * 1000:.2f} ms{details}")
+
+
+#--------- benchmarks ---------#
+
+
+@benchmark
+def tokenize_numbers():
+    """ Tokenize a long list of integers and words separated by whitespace. """
+    string = " ".join(f"{i} word{i}" for i in range(20000))
+    token = epp.branch([epp.integer(), epp.alnum_word()])
+    parser = epp.many(epp.chain([token, epp.whitespace(0)]))
+    report("tokenize_numbers", measure(lambda: epp.parse(None, string, parser)))
+
+
+@benchmark
+def keyword_dispatch():
+    """ Match words against a branch of many keyword alternatives. """
+    keywords = [f"keyword{i}" for i in range(50)]
+    string = " ".join(keywords[i % 50] for i in range(5000))
+    keyword = epp.branch([epp.literal(kw + " ") for kw in reversed(keywords)]
+                         + [epp.literal(kw) for kw in keywords])
+    parser = epp.many(keyword)
+    report("keyword_dispatch", measure(lambda: epp.parse(None, string, parser)))
+
+
+@benchmark
+def multi_keywords():
+    """ Match words against 'multi' over a couple of thousand keywords. """
+    keywords = [f"kw{i}_{'x' * (i % 7)}" for i in range(2000)]
+    string = " ".join(keywords[i * 37 % 2000] for i in range(5000))
+    parser = epp.many(epp.chain([epp.multi(keywords), epp.whitespace(0)]))
+    report("multi_keywords", measure(lambda: epp.parse(None, string, parser), 1))
+
+
+@benchmark
+def statement_dispatch():
+    """
+    Match statements against a branch of alternatives starting with different
+    keywords.
+    """
+    keywords = [f"{chr(ord('a') + i % 26)}{i}" for i in range(100)]
+    statements = [epp.chain([epp.literal(kw), epp.whitespace(), epp.integer(), epp.literal(";")])
+                  for kw in keywords]
+    string = "".join(f"{keywords[i * 7 % 100]} {i};" for i in range(5000))
+    parser = epp.many(epp.branch(statements))
+    report("statement_dispatch", measure(lambda: epp.parse(None, string, parser)))
+
+
+@benchmark
+def shared_prefixes():
+    """
+    Match assignments against alternatives sharing a keyword and a name, with
+    and without 'optimize'.
+    """
+    name = epp.alpha_word()
+    ws = epp.whitespace(0)
+    ops = ["=", "+=", "-=", "*=", "/=", "%="]
+    statement = epp.branch([epp.chain([epp.literal("set"), ws, name, ws, epp.literal(op), ws,
+                                       epp.integer(), epp.literal(";")])
+                            for op in ops])
+    string = "".join(f"set x {ops[i % 6]} {i};" for i in range(5000))
+    parser = epp.many(statement)
+    optimized = epp.optimize(parser)
+    report("shared_prefixes", measure(lambda: epp.parse(None, string, parser)),
+           optimized_ms=round(measure(lambda: epp.parse(None, string, optimized)) * 1000, 2))
+
+
+@benchmark
+def recursive_expression():
+    """ Parse a long arithmetic expression with nested parentheses. """
+    def expr():
+        term = epp.branch([epp.integer(),
+                           epp.chain([epp.literal("("), epp.lazy(expr), epp.literal(")")])])
+        return epp.chain([term, epp.many(epp.chain([epp.literal("+"), term]))])
+    string = "+".join(f"({i}+({i}+{i}))" for i in range(2000))
+    parser = epp.lazy(expr)
+    report("recursive_expression", measure(lambda: epp.parse(None, string, parser)))
+
+
+@benchmark
+def left_recursion():
+    """
+    Parse a long left-associative sum written as a left-recursive lazy parser,
+    and as the usual right-recursive one.
+    """
+    def left():
+        return epp.branch([epp.chain([epp.lazy(left), epp.literal("+"), epp.integer()]),
+                           epp.integer()])
+    def right():
+        return epp.chain([epp.integer(),
+                          epp.maybe(epp.chain([epp.literal("+"), epp.lazy(right)]))])
+    # The right-recursive parser runs out of stack on much longer inputs.
+    string = "+".join(str(i) for i in range(50))
+    long_string = "+".join(str(i) for i in range(5000))
+    left_parser = epp.lazy(left)
+    right_parser = epp.lazy(right)
+    report("left_recursion", measure(lambda: epp.parse(None, string, left_parser)),
+           right_recursive_ms=round(measure(lambda: epp.parse(None, string, right_parser)) * 1000, 2),
+           long_ms=round(measure(lambda: epp.parse(None, long_string, left_parser)) * 1000, 2))
+
+
+@benchmark
+def operator_precedence():
+    """
+    Evaluate a long arithmetic expression with an 'operator_table', and with
+    the equivalent grammar made of a lazy parser for every precedence level.
+    """
+    def binary(func):
+        return lambda val, st: val.append(func(val.pop(-2), val.pop()))
+    def unary(func):
+        return lambda val, st: val.append(func(val.pop()))
+    levels = [
+        (epp.Fixity.INFIX_LEFT, {"+": binary(lambda a, b: a + b),
+                                 "-": binary(lambda a, b: a - b)}),
+        (epp.Fixity.INFIX_LEFT, {"*": binary(lambda a, b: a * b),
+                                 "%": binary(lambda a, b: a % b)}),
+        (epp.Fixity.PREFIX, {"-": unary(lambda a: -a)}),
+        (epp.Fixity.INFIX_RIGHT, {"^": binary(lambda a, b: a ** b % 1000)}),
+        (epp.Fixity.POSTFIX, {"!": unary(lambda a: a * 2)}),
+    ]
+    number = epp.chain([epp.integer(), epp.effect(lambda val, st: val.append(int(st.parsed)))])
+    def atom(top):
+        return epp.branch([number,
+                           epp.chain([epp.literal("("), epp.lazy(top), epp.literal(")")])])
+    def table():
+        return epp.operator_table(atom(table), levels)
+    def operators(ops, *rest):
+        return epp.branch([epp.chain([epp.literal(lit), *rest, epp.effect(eff)])
+                           for lit, eff in ops.items()])
+    def level(i):
+        if i == len(levels):
+            return atom(layered)
+        fixity, ops = levels[i]
+        tighter = epp.lazy(level, i + 1)
+        if fixity is epp.Fixity.INFIX_LEFT:
+            return epp.chain([tighter, epp.many(operators(ops, tighter))])
+        if fixity is epp.Fixity.INFIX_RIGHT:
+            return epp.chain([tighter, epp.maybe(operators(ops, epp.lazy(level, i)))])
+        if fixity is epp.Fixity.PREFIX:
+            return epp.branch([operators(ops, epp.lazy(level, i)), tighter])
+        return epp.chain([tighter, epp.many(operators(ops))])
+    def layered():
+        return level(0)
+    string = "+".join(f"{i}*-{i}!%7-({i}^2^3+{i})" for i in range(1, 500))
+    table_parser = epp.lazy(table)
+    layered_parser = epp.lazy(layered)
+    assert epp.parse(epp.SRList(), string, table_parser)[0] == \
+        epp.parse(epp.SRList(), string, layered_parser)[0]
+    report("operator_precedence",
+           measure(lambda: epp.parse(epp.SRList(), string, table_parser)),
+           layered_ms=round(measure(lambda: epp.parse(epp.SRList(), string, layered_parser)) * 1000, 2))
+
+
+@benchmark
+def compiled_grammar():
+    """
+    Parse a long JSON-like document into Python values with effects, as is
+    and compiled with 'compile', and the same document with a defect at the
+    end.
+    """
+    mark = object()
+    def push(func):
+        return epp.effect(lambda val, st: val.append(func(st.parsed)))
+    def close(func):
+        def close_eff(val, st):
+            start = len(val) - 1
+            while val[start] is not mark:
+                start -= 1
+            items = val[start + 1:]
+            del val[start:]
+            return val.append(func(items))
+        return epp.effect(close_eff)
+    ws = epp.whitespace(0)
+    def items(item):
+        return epp.maybe(epp.chain([item, epp.many(epp.chain([ws, epp.literal(","), ws, item]))]))
+    def value():
+        string = epp.chain([epp.literal('"'), epp.many(epp.cond_char(lambda char: char != '"')),
+                            push(str), epp.literal('"')])
+        pair = epp.chain([string, ws, epp.literal(":"), ws, epp.lazy(value)])
+        opening = epp.effect(lambda val, st: val.append(mark))
+        return epp.branch([
+            epp.chain([epp.integer(), push(int)]),
+            string,
+            epp.chain([epp.literal("["), opening, ws, items(epp.lazy(value)), ws, epp.literal("]"),
+                       close(list)]),
+            epp.chain([epp.literal("{"), opening, ws, items(pair), ws, epp.literal("}"),
+                       close(lambda items: dict(zip(items[::2], items[1::2])))]),
+            epp.chain([epp.literal("true"), push(lambda parsed: True)])])
+    string = "[" + ", ".join(f'{{"id": {i}, "name": "item{i}", "tags": ["a", {i}], "ok": true}}'
+                             for i in range(3000)) + "]"
+    parser = epp.lazy(value)
+    compiled = epp.compile(parser)
+    assert epp.parse(epp.SRList(), string, parser)[0] == \
+        epp.parse(epp.SRList(), string, compiled)[0]
+    failing = string[:-1] + "}"
+    expected = epp.parse(epp.SRList(), failing, parser, verbose=True)
+    output = epp.parse(epp.SRList(), failing, compiled, verbose=True)
+    assert (output.code, output.state) == (expected.code, expected.state)
+    report("compiled_grammar", measure(lambda: epp.parse(epp.SRList(), string, parser), 3),
+           compiled_ms=round(measure(lambda: epp.parse(epp.SRList(), string, compiled)) * 1000, 2),
+           failing_ms=round(measure(lambda: epp.parse(epp.SRList(), failing, parser), 3) * 1000, 2),
+           compiled_failing_ms=round(
+               measure(lambda: epp.parse(epp.SRList(), failing, compiled)) * 1000, 2))
+
+
+@benchmark
+def deep_nesting():
+    """
+    Parse a long expression with nested parentheses as is and with
+    'iterative', and a deeply nested one with 'iterative' only.
+    """
+    def expr():
+        term = epp.branch([epp.integer(),
+                           epp.chain([epp.literal("("), epp.lazy(expr), epp.literal(")")])])
+        return epp.chain([term, epp.many(epp.chain([epp.literal("+"), term]))])
+    string = "+".join(f"({i}+({i}+{i}))" for i in range(2000))
+    deep = "(" * 20000 + "1" + ")" * 20000
+    parser = epp.lazy(expr)
+    iterative = epp.iterative(parser)
+    assert epp.parse(None, deep, iterative)[1].left == ""
+    report("deep_nesting", measure(lambda: epp.parse(None, string, parser)),
+           iterative_ms=round(measure(lambda: epp.parse(None, string, iterative)) * 1000, 2),
+           deep_ms=round(measure(lambda: epp.parse(None, deep, iterative), 3) * 1000, 2))
+
+
+@benchmark
+def malformed_input():
+    """
+    Fail to parse an expression with unclosed parentheses, with and without
+    commit points after the opening ones.
+    """
+    def grammar(cut):
+        def expr():
+            opening = [epp.literal("("), epp.commit()] if cut else [epp.literal("(")]
+            term = epp.branch([epp.integer(),
+                               epp.chain(opening + [epp.lazy(expr), epp.literal(")")])])
+            return epp.branch([epp.chain([term, epp.literal("+"), epp.lazy(expr)]),
+                               epp.chain([term, epp.literal("-"), epp.lazy(expr)]),
+                               term])
+        return epp.lazy(expr)
+    string = "(" * 10 + "1+2"
+    plain = grammar(False)
+    committing = grammar(True)
+    report("malformed_input", measure(lambda: epp.parse(None, string, plain), 1),
+           commit_ms=round(measure(lambda: epp.parse(None, string, committing)) * 1000, 2))
+
+
+@benchmark
+def many_effects():
+    """ Collect a value for every token of a long input, tracking peak memory. """
+    string = " ".join(str(i) for i in range(100000))
+    push = epp.effect(lambda val, st: val.append(int(st.parsed)) or val)
+    number = epp.chain([epp.integer(), push], combine=False)
+    parser = epp.many(epp.chain([epp.many(epp.chain([number, epp.whitespace(0)]), 0, 100)]))
+    tracemalloc.start()
+    epp.parse([], string, parser)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    report("many_effects", measure(lambda: epp.parse([], string, parser), 3),
+           peak_kib=peak // 1024)
+
+
+@benchmark
+def eager_records():
+    """
+    Sum the values of a long list of records, tracking peak memory with and
+    without applying effects eagerly.
+    """
+    string = "".join(f"key{i}={i};" for i in range(100000))
+    add = epp.effect(lambda val, st: val + int(st.parsed))
+    record = epp.chain([epp.alnum_word(), epp.literal("="), epp.integer(), add,
+                        epp.literal(";")])
+    parser = epp.many(record)
+    peaks = []
+    for eager in [False, True]:
+        tracemalloc.start()
+        epp.parse(0, string, parser, eager=eager)
+        peaks.append(tracemalloc.get_traced_memory()[1] // 1024)
+        tracemalloc.stop()
+    report("eager_records", measure(lambda: epp.parse(0, string, parser, eager=True), 3),
+           lazy_ms=round(measure(lambda: epp.parse(0, string, parser), 3) * 1000, 2),
+           peak_kib=peaks[0], eager_peak_kib=peaks[1])
+
+
+@benchmark
+def long_repetition():
+    """ Repeat a non-trivial parser over a long input, tracking peak memory. """
+    string = "ab" * 50000
+    parser = epp.many(epp.chain([epp.literal("a"), epp.literal("b")]))
+    tracemalloc.start()
+    epp.parse(None, string, parser)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    report("long_repetition", measure(lambda: epp.parse(None, string, parser)),
+           peak_kib=peak // 1024)
+
+
+@benchmark
+def generated_grammar():
+    """
+    Build a grammar of many alternatives made of the same small parsers,
+    tracking the memory it takes, and parse with it in packrat mode.
+    """
+    def build():
+        """ Return a branch of a couple of thousand generated alternatives. """
+        return epp.branch([epp.chain([epp.literal(","), epp.maybe(epp.white_char()),
+                                      epp.integer(), epp.literal(f"k{i};")])
+                           for i in range(2000)])
+    tracemalloc.start()
+    parser = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    string = ", 12k1999;"
+    cache = epp.PackratCache()
+    epp.parse(None, string, parser, packrat=cache)
+    report("generated_grammar", measure(build, 3), size_kib=size // 1024,
+           hit_ratio=round(cache.hit_ratio, 3))
+
+
+@benchmark
+def pickled_grammar():
+    """
+    Build a grammar over a big keyword table, then load it from its pickled
+    form instead.
+    """
+    def build():
+        """ Return a parser of a list of statements starting with keywords. """
+        keywords = sorted({f"{word}{i}" for word in ["let", "set", "get"] for i in range(3000)})
+        statement = epp.chain([epp.multi(keywords), epp.whitespace(), epp.integer(),
+                               epp.literal(";")])
+        return epp.many(epp.chain([statement, epp.whitespace(0, True)]))
+    data = epp.dumps(build())
+    # The grammar is gone, so loading it builds it again.
+    report("pickled_grammar", measure(lambda: pickle.loads(data), 3),
+           build_ms=round(measure(build, 3) * 1000, 2), size_kib=len(data) // 1024)
+
+
+@benchmark
+def nested_lookahead():
+    """
+    Parse nested parentheses with a greedy parser on every level, counting
+    calls of the lazy generator and restarts of the whole parse.
+    """
+    counts = {"generator_calls": 0, "runs": 0}
+    def expr():
+        counts["generator_calls"] += 1
+        return epp.chain([epp.literal("("), epp.maybe(epp.lazy(expr)),
+                          epp.greedy(epp.many(epp.alpha())), epp.literal(")")])
+    string = "(" * 50 + "a)" * 50
+    top = epp.lazy(expr)
+    def counted(state):
+        counts["runs"] += 1
+        return top(state)
+    epp.parse(None, string, counted)
+    restarts = counts["runs"] - 1
+    generator_calls = counts["generator_calls"]
+    report("nested_lookahead", measure(lambda: epp.parse(None, string, top)),
+           restarts=restarts, generator_calls=generator_calls)
+
+
+@benchmark
+def greedy_backtracking():
+    """
+    Backtrack over a long greedy run of letters, both to a successful split and
+    through all of the splits to a failure.
+    """
+    string = "a" * 2000 + "ab"
+    parser = epp.chain([epp.greedy(epp.many(epp.alpha())), epp.literal("ab")])
+    failing = epp.chain([epp.greedy(epp.many(epp.alpha())), epp.literal("b!")])
+    report("greedy_backtracking", measure(lambda: epp.parse(None, string, parser)),
+           failing_ms=round(measure(lambda: epp.parse(None, string, failing)) * 1000, 2))
+
+
+@benchmark
+def lookahead_combinations():
+    """
+    Fail to split a line into three dash-separated greedy fields, after
+    trying all the ways to do so.
+    """
+    string = "ab-" * 40
+    field = epp.greedy(epp.many(epp.any_char()))
+    dash = epp.literal("-")
+    parser = epp.chain([field, dash, field, dash, field, epp.literal("!")])
+    report("lookahead_combinations", measure(lambda: epp.parse(None, string, parser), 1))
+
+
+@benchmark
+def hostile_lookahead():
+    """
+    Fail to match two greedy runs, each followed by a literal, on input that
+    has the first literal everywhere but the second one nowhere.
+    """
+    string = "x" * 2000
+    anything = epp.greedy(epp.many(epp.any_char()))
+    parser = epp.chain([anything, epp.literal("x"), anything, epp.literal("y"),
+                        epp.many(epp.digit())])
+    report("hostile_lookahead", measure(lambda: epp.parse(None, string, parser), 1))
+
+
+def main(names):
+    """ Run the benchmarks with the given names, or all of them. """
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
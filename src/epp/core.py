@@ -12,12 +12,35 @@ failure.
 If a ParsingEnd exception is thrown by a parser, parsing ends prematurely, but
 successfully.
 
+Parsers may also provide a quiet form of themselves as their 'quiet' attribute:
+a callable that returns the ParsingFailure instead of raising it. Built-in
+parsers all do, and combinators prefer quiet forms of their parsers, since
+returning a failure is much cheaper than raising and catching it. See 'quiet'
+and 'loud'.
+
+Built-in parsers that register no effects and perform no lookahead also have a
+cursor-scanning form, 'scan_cursor', which works on a mutable cursor instead of
+State objects and only reports whether it has succeeded. Combinators made only
+of such parsers have one as well, so that they run without allocating a State
+per parser. See 'get_scan'.
+
+Combinators also have a stepwise form, 'steps', which yields the parsers they
+run instead of calling them, so that 'iterative' can run whole grammars with an
+explicit stack. See 'get_steps'.
+
 """
 
 
-from collections import deque, namedtuple
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
 import enum
+import functools
+import io
 import itertools as it
+import pickle
+import threading
+import weakref
 
 
 import epp.errors as error
@@ -162,16 +185,52 @@ class ParsingFailure(Exception):
     """
     An exception of this type should be thrown if parsing fails.
 
-    The constructor takes three arguments: the state that has caused a parser
-    to fail, the error message and an optional code which (in predefined
-    parsers) is used to tell apart the reasons for the failure within the same
-    parser.
+    The constructor takes the state that has caused a parser to fail, the error
+    message and an optional code which (in predefined parsers) is used to tell
+    apart the reasons for the failure within the same parser.
+
+    Failures are often created only to be discarded by a branch or a 'maybe',
+    so the message can be deferred: if any arguments follow the code, the
+    message is treated as a template for 'str.format' and is only formatted
+    with these arguments when it is actually needed. 'left_preview' can be used
+    to defer slicing the input as well.
+
+    A failure is 'committed' if it happened after a commit point (see
+    'commit'): such failures are not recovered from by branches, repeats and
+    the like.
     """
 
-    def __init__(self, failed_state, text, code=0):
-        super().__init__(text)
+    committed = False
+
+    def __init__(self, failed_state, text, code=0, *args):
+        super().__init__()
         self.code = code
         self.state = failed_state
+        self.template = text
+        self.template_args = args
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.message!r})"
+
+    def __str__(self):
+        return self.message
+
+    @property
+    def args(self):
+        """ Return the formatted message as the only exception argument. """
+        return (self.message,)
+
+    @args.setter
+    def args(self, value):
+        self.template = value[0] if value else ""
+        self.template_args = ()
+
+    @property
+    def message(self):
+        """ Return the error message, formatting it if necessary. """
+        if self.template_args:
+            return self.template.format(*self.template_args)
+        return self.template
 
 
 class ParsingEnd(Exception):
@@ -191,7 +250,101 @@ class Lookahead(enum.Enum):
     RELUCTANT = enum.auto()
 
 
-def parse(seed, state_or_string, parser, verbose=False):
+class PackratCache():
+    """
+    A bounded memoization table used by 'parse' in packrat mode.
+
+    While a cache is active, the outcome of every parser run by a chain or a
+    branch - either the resulting State or the ParsingFailure it has raised -
+    is remembered, keyed by the parser itself and by both windows of the State
+    it was given. If the same parser is run on the same windows again, the
+    remembered outcome is reused instead of running the parser. The 'parsed'
+    window is part of the key because some parsers (effects, for example) pass
+    it on to their output.
+
+    At most 'maxsize' outcomes are kept, the least recently used ones are
+    evicted first. Outcomes are only valid for a single input string, so the
+    table is cleared whenever the cache is used on a different one.
+
+    'hits' and 'misses' attributes count lookups that did and did not find a
+    remembered outcome respectively, and can be used to judge whether packrat
+    mode is worth it for a given grammar. They are never reset automatically.
+
+    Raise ValueError if 'maxsize' is not positive.
+    """
+
+    def __init__(self, maxsize=65536):
+        if maxsize <= 0:
+            raise ValueError("Non-positive cache size")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.string = None
+        self.table = OrderedDict()
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def hit_ratio(self):
+        """
+        Return the ratio of lookups that found a remembered outcome, or 0 if
+        there were no lookups yet.
+        """
+        total = self.hits + self.misses
+        if total == 0:
+            return 0
+        return self.hits / total
+
+    def clear(self):
+        """ Forget all remembered outcomes, but keep the counters. """
+        self.table.clear()
+        self.string = None
+
+    def run(self, parser, state):
+        """
+        Run 'parser' on 'state', or reuse the remembered outcome of a previous
+        run on the same windows.
+
+        Follow the quiet calling convention: return the ParsingFailure instead
+        of raising it.
+        """
+        key, outcome = self.lookup(parser, state)
+        if outcome is None:
+            outcome = _run_quiet(parser, state)
+            self.store(key, outcome)
+        return outcome
+
+    def lookup(self, parser, state):
+        """
+        Return a tuple of the key of running 'parser' on 'state' and the
+        remembered outcome of the run, or None if there's none.
+        """
+        if state.string is not self.string:
+            self.table.clear()
+            self.string = state.string
+        key = (parser, state.left_start, state.left_end, state.parsed_start,
+               state.parsed_end)
+        table = self.table
+        try:
+            outcome = table[key]
+        except KeyError:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        table.move_to_end(key)
+        return key, outcome
+
+    def store(self, key, outcome):
+        """ Remember an outcome, evicting the oldest one if necessary. """
+        table = self.table
+        table[key] = outcome
+        if len(table) > self.maxsize:
+            table.popitem(last=False)
+
+
+def parse(seed, state_or_string, parser, verbose=False, packrat=None,
+          eager=False):
     """
     Run a given parser on a given state object or a string, then apply combined
     chain or parser's effects to 'seed' and return a tuple
@@ -199,32 +352,103 @@ def parse(seed, state_or_string, parser, verbose=False):
 
     On failure, return None unless 'verbose' is truthy, in which case return
     the ParsingFailure exception that has terminated the parsing process.
+
+    If 'packrat' is a PackratCache, run in packrat mode, reusing outcomes of
+    parsers that are run on the same input more than once (see PackratCache).
+
+    If 'eager' is truthy (and not in packrat mode), effects are applied to the
+    seed and forgotten as soon as nothing can undo them anymore, rather than
+    when the whole parser has succeeded: after every iteration of a repeat run
+    by 'parse' itself (or by branches and lazy parsers it runs in turn) and at
+    commit points of such chains that are not all-or-nothing (see 'commit').
+    This keeps the memory used by effects of long repetitions bounded. The
+    seed may then be changed by the effects even if parsing fails.
     """
     if isinstance(state_or_string, str):
         state = State(state_or_string)
     else:
         state = state_or_string
-    while True:
+    context = _CONTEXT
+    outer_packrat = context.packrat
+    outer_sink = context.sink
+    outer_anchor = context.anchor
+    context.packrat = packrat
+    context.sink = None
+    context.anchor = None
+    context.parsing += 1
+    if eager and packrat is None:
+        context.sink = _EffectSink(seed)
+        context.anchor = (parser, state, True)
+    try:
+        after = _run_quiet(parser, state)
+        if isinstance(after, ParsingFailure):
+            raise after
+        if context.sink is not None:
+            seed = context.sink.value
+        if after.effect is not None:
+            return after.effect(seed, after), after
+        return seed, after
+    except ParsingFailure as failure:
+        if verbose:
+            return failure
+        return None
+    except ParsingEnd as end:
+        if context.sink is not None:
+            seed = context.sink.value
+        if end.state.effect is not None:
+            return end.state.effect(seed, end.state), end.state
+        return seed, end.state
+    finally:
+        context.packrat = outer_packrat
+        context.sink = outer_sink
+        context.anchor = outer_anchor
+        context.parsing -= 1
+
+
+def interned(constructor):
+    """
+    Return a version of the parser constructor 'constructor' that returns the
+    same parser when called again with equal arguments of the same types,
+    passed the same way, for as long as that parser is in use. Equal parsers
+    built all over a grammar then share a single object, and so they share the
+    entries of a PackratCache, too. Arguments like parsers and functions are
+    equal only to themselves; calls with unhashable arguments, like lists,
+    always build a new parser.
+
+    Built-in constructors are interned, other than 'lazy' and 'uncached_lazy'
+    (lazy parsers share the parsers they build instead, see 'lazy'). The
+    parsers they return are shared, so they should not be modified; the
+    original constructor is the '__wrapped__' attribute of the interned one.
+
+    The parsers also remember the call that has built them, so that they can
+    be pickled (see 'dumps').
+    """
+    @functools.wraps(constructor)
+    def interned_constructor(*args, **kwargs):
+        key = _interning_key(constructor, args, kwargs)
+        if key is None:
+            return _set_recipe(constructor(*args, **kwargs),
+                               interned_constructor, args, kwargs)
+        with _INTERNED_LOCK:
+            parser = _INTERNED.get(key)
+        if parser is not None:
+            return parser
+        # Build outside of the lock, as constructors call each other.
+        parser = _set_recipe(constructor(*args, **kwargs),
+                             interned_constructor, args, kwargs)
         try:
-            after = parser(state)
-            if after.effect is not None:
-                return after.effect(seed, after), after
-            return seed, after
-        except ParsingFailure as failure:
-            if verbose:
-                return failure
-            return None
-        except ParsingEnd as end:
-            if end.state.effect is not None:
-                return end.state.effect(seed, end.state), end.state
-            return seed, end.state
-        except _GainedLookahead:
-            continue
+            with _INTERNED_LOCK:
+                return _INTERNED.setdefault(key, parser)
+        except TypeError:
+            # Not weakly referenceable.
+            return parser
+    return interned_constructor
 
 
 #--------- core parsers generators ---------#
 
 
+@interned
 def branch(funcs, save_iterator=True, strictly_one=False):
     """
     Create a parser that will try given parsers in order and return the state
@@ -243,11 +467,18 @@ def branch(funcs, save_iterator=True, strictly_one=False):
 
     Note that branches inherit lookahead from the first parser inside them that
     has the capability, which in turn can influence also the parsers that do
-    not perform lookahead normally.
+    not perform lookahead normally. The mode is determined without running the
+    branch, unless 'funcs' is a one-shot iterator: such branches only know
+    about the parsers they have already tried.
+
+    Unless 'funcs' is a one-shot iterator, the branch only tries the parsers
+    that can match the next character of the input, as told by their
+    'first_chars' (see 'get_first_chars').
     """
     return _Branch(funcs, save_iterator, strictly_one)
 
 
+@interned
 def catch(parser, exception_types, on_thrown=None, on_not_thrown=None):
     """
     Return a parser that runs 'parser' and catches exceptions of any of types
@@ -269,12 +500,11 @@ def catch(parser, exception_types, on_thrown=None, on_not_thrown=None):
     caught in this manner.
     """
     exception_types = tuple(exception_types)
+    quiet_parser = quiet(parser)
     def catch_body(state):
         """ Try to catch an exception thrown by another parser. """
         try:
-            if on_not_thrown is None:
-                return parser(state)
-            return on_not_thrown(parser(state))
+            after = quiet_parser(state)
         except ParsingFailure as failure:
             raise failure
         except ParsingEnd as end:
@@ -285,9 +515,13 @@ def catch(parser, exception_types, on_thrown=None, on_not_thrown=None):
                     return on_thrown(state, exc)
                 return state
             raise exc
-    return catch_body
+        if on_not_thrown is None or isinstance(after, ParsingFailure):
+            return after
+        return on_not_thrown(after)
+    return loud(catch_body)
 
 
+@interned
 def chain(funcs, combine=True, stop_on_failure=False, all_or_nothing=True,
           save_iterator=True):
     """
@@ -319,11 +553,39 @@ def chain(funcs, combine=True, stop_on_failure=False, all_or_nothing=True,
     iterable, like a list or a deque, or if you've used 'reuse_iter'.
 
     Note that chains inherit lookahead mode from the first parser inside them
-    that has the capability.
+    that has the capability. The mode is determined without running the chain,
+    unless 'funcs' is a one-shot iterator: such chains only know about the
+    parsers they have already run.
+
+    If all the parsers only match runs of characters (literals, single
+    character parsers and 'many' over them) and 'funcs' is not a one-shot
+    iterator, the chain stops backtracking after a few attempts and finds its
+    outcome in a single pass over the input instead, in time proportional to
+    the length of the input whatever the input is.
     """
     return _Chain(funcs, combine, stop_on_failure, all_or_nothing, save_iterator)
 
 
+def commit():
+    """
+    Return a commit point (a cut): a parser that consumes nothing, but, when
+    run by a chain, commits the chain to the way it has parsed the input so
+    far.
+
+    If a parser that follows a commit point in the chain fails, the chain's
+    failure is committed: enclosing branches don't try their other
+    alternatives, repeats and 'maybe' don't recover from it, and chains with
+    'stop_on_failure' don't turn it into a stop - it goes all the way up to
+    'parse'. The chain won't backtrack over the parsers before the commit
+    point either, and forgets everything it has kept to be able to.
+
+    A commit point only works as an element of a chain; outside of one it does
+    nothing.
+    """
+    return _COMMIT
+
+
+@interned
 def effect(eff):
     """
     Register an effect in the chain. The argument should be a callable of two
@@ -342,30 +604,52 @@ def effect(eff):
     def effect_(state):
         """ Register an effect. """
         return state._replace(effect=eff)
-    return effect_
+    res = loud(effect_)
+    res.first_chars = (_no_char, True)
+    res.registered_effect = eff
+    return res
 
 
+@interned
 def fail():
     """ Return a parser that always fails. """
     def fail_body(state):
         """ Fail immediately. """
-        raise ParsingFailure(state, "'fail' parser has been reached", error.FailError.FAILED)
-    return fail_body
+        return ParsingFailure(state, "'fail' parser has been reached",
+                              error.FailError.FAILED)
+    res = loud(fail_body)
+    res.scan_cursor = lambda cursor: False
+    res.first_chars = (_no_char, False)
+    return res
 
 
+@interned
 def identity():
     """ Return a parser that passes state unchanged. """
-    return lambda state: state._replace()
+    res = loud(lambda state: state._replace())
+    res.scan_cursor = lambda cursor: True
+    res.first_chars = (_no_char, True)
+    return res
 
 
 def lazy(generator, *args, **kwargs):
     """
     Make 'generator' lazy. It will only be called when it's time to actually
     parse a string. Useful for recursive parsers.
+
+    The parser 'generator' returns is built once and reused afterwards, both
+    by this and any other lazy parser with the same generator and arguments
+    (provided the arguments are hashable). If 'generator' depends on some
+    external state and has to be called every time, use 'uncached_lazy'
+    instead.
+
+    The parser may be left-recursive: the outcome of a run that recurses on
+    the same input is grown one step at a time for as long as it gets longer.
     """
-    return _Lazy(generator, args, kwargs)
+    return _Lazy(generator, args, kwargs, _lazy_cell(generator, args, kwargs))
 
 
+@interned
 def modify_error(parser, error_transformer):
     """
     Return a parser that will run 'parser' and, if it fails, modifies raised
@@ -373,24 +657,97 @@ def modify_error(parser, error_transformer):
     should be a callable of a single argument, and should return an exception)
     and re-raising its return value.
     """
+    quiet_parser = quiet(parser)
+    def modify(after):
+        """ Modify the error of a failed outcome. """
+        if isinstance(after, ParsingFailure):
+            modified = error_transformer(after)
+            if not isinstance(modified, ParsingFailure):
+                raise modified
+            if after.committed:
+                modified = _committed(modified)
+            return modified
+        return after
     def modify_error_msg_body(state):
         """ Modify error message. """
-        try:
-            return parser(state)
-        except ParsingFailure as failure:
-            raise error_transformer(failure)
-    return copy_lookahead(parser, modify_error_msg_body)
+        return modify(quiet_parser(state))
+    def modify_error_steps(state):
+        """ Modify error message, running the parser stepwise. """
+        return modify((yield parser, state))
+    res = copy_scan(parser,
+                    copy_lookahead(parser, loud(modify_error_msg_body)))
+    _copy_descriptions(parser, res)
+    res.succeeds_like = parser
+    if get_steps(parser) is not None:
+        res.steps = modify_error_steps
+    return res
 
 
+@interned
 def noconsume(parser):
     """ Return a version of 'parser' that doesn't consume input. """
+    quiet_parser = quiet(parser)
+    def rewound(output, state):
+        """ Move the outcome of parsing 'state' back to its start. """
+        if isinstance(output, ParsingFailure):
+            return output
+        return output._replace(effect=output.effect, left_start=state.left_start)
     def noconsume_body(state):
         """ Parse without consuming input. """
-        output = parser(state)
-        return output._replace(effect=output.effect, left_start=state.left_start)
-    return noconsume_body
+        return rewound(quiet_parser(state), state)
+    def noconsume_steps(state):
+        """ Parse stepwise without consuming input. """
+        return rewound((yield parser, state), state)
+    res = loud(noconsume_body)
+    if get_steps(parser) is not None:
+        res.steps = noconsume_steps
+    first_chars = get_first_chars(parser)
+    if first_chars is not None:
+        res.first_chars = first_chars
+    scan = get_scan(parser)
+    if scan is not None:
+        def noconsume_scan(cursor):
+            """ Scan without consuming input. """
+            left_start = cursor.left_start
+            if not scan(cursor):
+                return False
+            cursor.left_start = left_start
+            return True
+        res.scan_cursor = noconsume_scan
+    return res
+
+
+@interned
+def repeat(parser, min_hits=0, max_hits=0, combine=True):
+    """
+    Return a parser that will run 'parser' on input repeatedly until it fails.
 
+    If 'min_hits' is above zero, fail if 'parser' was run successfully less
+    than 'min_hits' times.
 
+    If 'max_hits' is above zero, stop after 'parser' was run successfully
+    'max_hits' times. Otherwise, also stop after a successful run that
+    consumed no input, as running the parser again would change nothing.
+
+    If 'combine' is truthy, set 'parsed' of the resulting state object to
+    concatenation of individually matched strings, otherwise set it to the last
+    matched string.
+
+    Unlike a chain, the resulting parser runs in constant memory (not counting
+    the effects it collects). It inherits lookahead mode from 'parser'.
+
+    Raise ValueError if 'max_hits' is above zero and is less than 'min_hits'.
+    """
+    if min_hits < 0:
+        min_hits = 0
+    if max_hits < 0:
+        max_hits = 0
+    if max_hits > 0 and max_hits < min_hits:
+        raise ValueError("'max_hits' is less than 'min_hits'")
+    return _Repeat(parser, min_hits, max_hits, combine)
+
+
+@interned
 def stop(discard=False):
     """
     Return a parser that stops parsing immediately.
@@ -404,10 +761,11 @@ def stop(discard=False):
             state = state._replace(parsed_start=state.left_start,
                                    parsed_end=state.left_start)
         raise ParsingEnd(state._replace())
-    return stop_body
+    return loud(stop_body)
 
 
-def subparse(seed, parser, absorber):
+@interned
+def subparse(seed, parser, absorber, packrat=None):
     """
     Create a parser that will run 'parser' (via 'parse') on the current input
     and given seed value, and then register an effect incorporating subchain's
@@ -419,18 +777,24 @@ def subparse(seed, parser, absorber):
     succesful.
 
     If parser fails, so does 'subparse'.
+
+    If 'packrat' is a PackratCache, the subparser runs in packrat mode using
+    it. Otherwise it shares the cache of the enclosing 'parse' call, if any.
     """
     def absorb_inner(state):
         """ Absorb results of another parser into the chain. """
-        output = parse(seed, state, parser)
+        cache = _CONTEXT.packrat if packrat is None else packrat
+        output = parse(seed, state, parser, packrat=cache)
         if output is None:
-            raise ParsingFailure(state, "Subparsing failed", error.SubparseError.FAILED)
+            return ParsingFailure(state, "Subparsing failed",
+                                  error.SubparseError.FAILED)
         value, after = output
         after = after._replace(effect=lambda val, st: absorber(val, state, value, after))
         return after
-    return absorb_inner
+    return loud(absorb_inner)
 
 
+@interned
 def test(testfn):
     """
     Return a parser that succeeds consuming no input if testfn(state) returns a
@@ -442,27 +806,141 @@ def test(testfn):
         """ State testing function. """
         if testfn(state):
             return state._replace(parsed_start=state.left_start, parsed_end=state.left_start)
-        raise ParsingFailure(state,
-                             f"Function {testfn} returned a falsey value on '{state.left[0:20]}'",
-                             error.TestError.FAILED)
-    return test_body
+        return ParsingFailure(state,
+                              "Function {} returned a falsey value on '{}'",
+                              error.TestError.FAILED,
+                              testfn,
+                              left_preview(state))
+    return loud(test_body)
+
+
+def uncached_lazy(generator, *args, **kwargs):
+    """
+    Like 'lazy', but call 'generator' every time the resulting parser is run,
+    instead of reusing the parser it has built.
+    """
+    return _Lazy(generator, args, kwargs, None)
 
 
 #--------- helper things ---------#
 
 
+def compile(parser):
+    """
+    Return a parser that parses just like 'parser', with the same effects and
+    failing with the same errors, but runs generated Python code specialized
+    for it instead of the combinators it's made of. The code is available as
+    'source' attribute of the returned parser.
+
+    Every chain, branch, repeat and lazily built parser 'parser' is made of
+    becomes a function working on positions in the input, with literals,
+    single-character parsers, 'many' over them, effects, 'maybe' and
+    'modify_error' wrappers inlined, and chains nested into chains merged.
+    Parsers with lookahead, chains with commit points or 'stop_on_failure'
+    set, strict branches, and any other parsers are run as usual, given and
+    returning State objects.
+
+    On failure, the parser that has failed in the first place is run again, on
+    the input it has failed on, to report the failure, unless it is a branch,
+    whose failure is reported right away. The runs that stop
+    parsing or meet a committed failure or left recursion are found out by
+    running 'parser' itself, and so is packrat mode.
+    """
+    return _set_recipe(_Compiled(parser), compile, (parser,), {})
+
+
 def copy_lookahead(from_parser, to):
     """
     Copy lookahead mode from 'from_parser' to 'to' and return the modified
-    parser.
+    parser. A parser built by an interned constructor (see 'interned') may be
+    shared, so it is left intact, and a greedy or a reluctant version of it is
+    returned instead; so is a parser that can't be modified.
     """
-    try:
-        to.lookahead = from_parser.lookahead
-    except AttributeError:
-        pass
+    lookahead = get_lookahead(from_parser)
+    if lookahead is None:
+        return to
+    if not _shared(to):
+        try:
+            to.lookahead = lookahead
+            return to
+        except AttributeError:
+            pass
+    if lookahead is Lookahead.GREEDY:
+        return greedy(to)
+    return reluctant(to)
+
+
+def copy_scan(from_parser, to):
+    """
+    Copy the cursor-scanning form of 'from_parser' (see 'get_scan') to 'to'
+    and return the modified parser. Only do this for parsers that behave just
+    like 'from_parser' on success. A parser built by an interned constructor
+    (see 'interned') may be shared, so it is left intact, and a new parser
+    running it, with the scanning form, is returned instead.
+    """
+    scan = get_scan(from_parser)
+    if scan is None:
+        return to
+    if _shared(to):
+        res = copy_lookahead(to, loud(quiet(to)))
+        _copy_descriptions(to, res)
+        res.scan_cursor = scan
+        return _set_recipe(res, copy_scan, (from_parser, to), {})
+    to.scan_cursor = scan
     return to
 
 
+def dump(parser, file, protocol=None):
+    """
+    Write the pickled representation of 'parser' to 'file', a file object
+    open for writing in binary mode, using the given pickle protocol. See
+    'dumps'.
+    """
+    _GrammarPickler(file, protocol).dump(parser)
+
+
+def dumps(parser, protocol=None):
+    """
+    Return the pickled representation of 'parser' as a bytes object, using the
+    given pickle protocol. Load it back with 'pickle.loads' (or, if written
+    to a file with 'dump', with 'pickle.load').
+
+    Built-in parsers, and the ones built by any other interned constructors
+    (see 'interned'), are pickled as the calls that have built them, with
+    their arguments pickled in turn. Loading such a parser calls its
+    constructor again, so the code that has put the grammar together doesn't
+    have to run, and an equal parser that is already built is reused. Lazy
+    parsers are pickled as their generators and arguments, and parsers made
+    by 'greedy', 'reluctant', 'optimize', 'compile' and 'iterative' as the
+    parsers they were made from, so the code of compiled parsers is generated
+    again on loading.
+
+    Anything else is pickled by 'pickle' as usual: functions, including lazy
+    parsers' generators, effects and parsers not built by constructors, are
+    pickled by their qualified names, so they have to be defined at the top
+    level of a module, and chains and branches over one-shot iterators can't
+    be pickled at all. Grammars referring to themselves other than through
+    lazy parsers can't be pickled either.
+    """
+    buffer = io.BytesIO()
+    dump(parser, buffer, protocol)
+    return buffer.getvalue()
+
+
+def get_first_chars(parser):
+    """
+    Return a description of the characters the parser's match may start with:
+    a tuple (test, nullable), where 'test' is a predicate on a single
+    character. Return None if the parser doesn't describe them.
+
+    If the parser consumes any input, the first character it consumes passes
+    'test'. Unless 'nullable' is truthy, the parser also only ever succeeds if
+    there is some input left and its first character passes 'test'.
+    Branches use this to skip the alternatives that can't match.
+    """
+    return getattr(parser, "first_chars", None)
+
+
 def get_lookahead(parser):
     """
     Return lookahead mode of the parser or None if it doesn't perform lookahead.
@@ -473,6 +951,43 @@ def get_lookahead(parser):
         return None
 
 
+def get_scan(parser):
+    """
+    Return the cursor-scanning form of the parser, or None if it doesn't have
+    one.
+
+    The scanning form is a callable taking a cursor - a mutable object with
+    the same 'string', 'left_start', 'left_end', 'parsed_start' and
+    'parsed_end' fields as State objects - and returning True after updating
+    the cursor like the parser would update the State on success, or False
+    (leaving the cursor in any state) where the parser would fail. Only
+    parsers that never register effects, perform no lookahead and don't stop
+    parsing can have one.
+    """
+    context = _CONTEXT
+    outer = context.lowest_assumption
+    scan, final = _resolve_scan(lambda: _get_scan(parser))
+    if final:
+        return scan
+    # Having no scanning form relies on nothing.
+    context.lowest_assumption = outer
+    return None
+
+
+def get_steps(parser):
+    """
+    Return the stepwise form of the parser, or None if it doesn't have one.
+
+    The stepwise form is a generator function taking a State. Rather than
+    running the parsers inside it, it yields them to its caller as
+    (parser, state) tuples and is sent their outcomes back - a State or a
+    ParsingFailure, while a ParsingEnd a parser raises is thrown into it - and
+    finally returns its own outcome, following the quiet calling convention.
+    See 'iterative'.
+    """
+    return getattr(parser, "steps", None)
+
+
 def greedy(parser):
     """ Return a greedy version of 'parser'. """
     try:
@@ -480,14 +995,15 @@ def greedy(parser):
             return parser
     except AttributeError:
         pass
-    res = lambda state: parser(state)
+    res = loud(quiet(parser))
     res.lookahead = Lookahead.GREEDY
-    return res
+    _copy_descriptions(parser, res)
+    return _set_recipe(res, greedy, (parser,), {})
 
 
 def has_lookahead(parser):
     """ Return True if the parser has the ability to perform lookahead. """
-    return hasattr(parser, "lookahead")
+    return get_lookahead(parser) is not None
 
 
 def is_greedy(parser):
@@ -506,9 +1022,103 @@ def is_reluctant(parser):
         return False
 
 
+def iterative(parser):
+    """
+    Return a parser that parses just like 'parser', with the same effects and
+    failures, but runs the parsers it's made of with an explicit stack rather
+    than by calling them in turn, so that the depth of nesting in the input is
+    only limited by memory, not by the recursion limit.
+
+    Parsers having a stepwise form (see 'get_steps') are run that way: chains,
+    branches and repeats over parsers that have one, lazy parsers, and
+    'modify_error', 'noconsume' and 'maybe' over such parsers. Other parsers,
+    as well as chains, branches and repeats that perform lookahead, are run
+    as usual, and so is everything inside them.
+
+    Since running parsers with a stack is slower, 'parser' is first run as
+    usual, and only run again with a stack if it runs out of Python stack -
+    unless effects are applied eagerly (see 'parse'), in which case the
+    stack is always used.
+    """
+    return _set_recipe(_Iterative(parser), iterative, (parser,), {})
+
+
+def left_preview(state, length=20):
+    """
+    Return an object standing for the first 'length' characters of the 'left'
+    window of 'state' in ParsingFailure message templates. The input is only
+    sliced when the object is formatted, either as a string or, with '!r'
+    conversion, as its representation.
+    """
+    return _LeftPreview(state, length)
+
+
+def loud(quiet_parser):
+    """
+    Return a parser that runs 'quiet_parser' - a parser following the quiet
+    calling convention, that is returning a ParsingFailure instead of raising
+    it - and raises the failures it returns.
+
+    The returned parser has 'quiet_parser' as its 'quiet' attribute, so that
+    combinators can still use the cheaper convention.
+    """
+    def loud_body(state):
+        """ Raise failures returned by a quiet parser. """
+        after = quiet_parser(state)
+        if isinstance(after, ParsingFailure):
+            raise after
+        return after
+    loud_body.quiet = quiet_parser
+    return loud_body
+
+
 def no_lookahead(parser):
     """ Return True if the parser performs no lookahead. """
-    return not hasattr(parser, "lookahead")
+    return get_lookahead(parser) is None
+
+
+def optimize(parser):
+    """
+    Return a parser that parses just like 'parser', with the same effects and
+    failing with the same error codes, but does less work. 'parser' itself is
+    left intact.
+
+    The following rewrites are made in the chains, branches and repeats
+    'parser' is made of (parsers built by lazy generators and parsers wrapped
+    into other parsers are left alone):
+    * chains nested into chains are merged into them;
+    * adjacent literals in a chain are fused into a single one;
+    * adjacent alternatives of a branch that are chains starting with the
+      same parsers become a chain of these parsers followed by a branch over
+      the rest of the alternatives, so that the common part is only parsed
+      once (alternatives are compared as they were before fusing literals).
+
+    A rewrite is only made where it can't change the outcome of parsing, other
+    than the 'parsed' window of the states failures are reported with.
+    Chains and branches over one-shot iterators are not rewritten.
+    """
+    return _set_recipe(_optimize(parser, {}), optimize, (parser,), {})
+
+
+def quiet(parser):
+    """
+    Return the quiet form of 'parser': a callable that returns the
+    ParsingFailure instead of raising it.
+
+    If the parser provides its own quiet form via 'quiet' attribute, return
+    it, otherwise return an adapter catching the failures 'parser' raises.
+    """
+    try:
+        return parser.quiet
+    except AttributeError:
+        pass
+    def quiet_body(state):
+        """ Return the failure raised by a parser instead of raising it. """
+        try:
+            return parser(state)
+        except ParsingFailure as failure:
+            return failure
+    return quiet_body
 
 
 def reluctant(parser):
@@ -518,9 +1128,10 @@ def reluctant(parser):
             return parser
     except AttributeError:
         pass
-    res = lambda state: parser(state)
+    res = loud(quiet(parser))
     res.lookahead = Lookahead.RELUCTANT
-    return res
+    _copy_descriptions(parser, res)
+    return _set_recipe(res, reluctant, (parser,), {})
 
 
 def reuse_iter(generator, *args, **kwargs):
@@ -528,502 +1139,3106 @@ def reuse_iter(generator, *args, **kwargs):
     Make an iterable that will call 'generator(*args, **kwargs)' when iterated
     over and use the return value as an iterator.
     """
-    class Res():
-        """ A reusable iterator container. """
-        def __iter__(self):
-            return generator(*args, **kwargs)
-    return Res()
+    return _ReusableIterator(generator, args, kwargs)
+
+
+def seal(parser):
+    """
+    Seal the chains and branches 'parser' is made of, and return 'parser'.
+
+    A sealed combinator keeps its parsers as a tuple, rather than iterating
+    over the iterable it was given on every run. Chains and branches saving
+    their iterators (see 'chain' and 'branch') are sealed on their own as
+    soon as they run out of parsers; 'seal' does it right away, for all of
+    them. Chains and branches over one-shot iterators are only sealed on
+    their own, as their iterators may never run out.
+
+    The parsers inside repeats and 'modify_error' and 'maybe' wrappers are
+    sealed too, and so are the parsers built by lazy parsers (other than
+    uncached ones), which are built for that. Changes made to the iterables
+    of sealed combinators are not seen by them.
+    """
+    seen = set()
+    pending = [parser]
+    while pending:
+        current = pending.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        if isinstance(current, (_Branch, _Chain)):
+            current.seal()
+            if current.funcs is not None:
+                pending.extend(current.funcs)
+        elif isinstance(current, (_Compiled, _Iterative, _Repeat)):
+            pending.append(current.parser)
+        elif isinstance(current, _Lazy):
+            if current.cell is not None:
+                pending.append(current.build())
+        else:
+            for name in ("succeeds_like", "optional_parser"):
+                inner = getattr(current, name, None)
+                if inner is not None:
+                    pending.append(inner)
+    return parser
 
 
 #--------- private helper things ---------#
 
 
-def _chain_effects(effect_points):
-    """ Chain effects saved in 'states' together into a single effect. """
-    def chained_effects(value, state):
-        """ A chain of effects. """
-        for (s, _) in effect_points:
-            value = s.effect(value, s)
-        return value
-    return chained_effects
+class _Context(threading.local):
+    """
+    Per-thread settings of the innermost running 'parse' call, and bookkeeping
+    of lookahead resolution.
+    """
 
+    def __init__(self):
+        super().__init__()
+        self.packrat = None
+        # The sink of an eager 'parse' call, and the parser anchored to it
+        # (see _EffectSink).
+        self.sink = None
+        self.anchor = None
+        # The innermost runs of lazy parsers in progress, by their rules (see
+        # _Seed).
+        self.seeds = {}
+        # Number of 'parse' calls and compilations in progress: lazy parsers
+        # aren't built to find out their lookahead modes or scanning forms
+        # outside of them.
+        self.parsing = 0
+        # Lookahead modes assumed for parsers while they are being worked out,
+        # by their keys (see _resolve_lookahead), and the keys of the
+        # assumptions the innermost mode being worked out relies on (or
+        # _DEFERRED for unbuilt lazy parsers), if any.
+        self.resolving = {}
+        self.assumed_modes = None
+        self.building = set()
+        # Depths of parsers assumed to have a scanning form while it's being
+        # found out, the outermost of such assumptions relied upon, and forms
+        # found relying on them, with the depth of the outermost one.
+        self.assumed_scans = {}
+        self.lowest_assumption = _NO_ASSUMPTION
+        self.provisional_scans = {}
 
-def _overrestricted(parser):
-    """ Return True if a parser is maximally restricted. """
-    # isinstance may not be idiomatic, but it's safer than relying on parsers
-    # not having a particular method.
-    if not isinstance(parser, _RestrictedParser):
-        return True
-    return parser.overrestricted()
 
+# No assumptions about scanning forms were relied upon.
+_NO_ASSUMPTION = float("inf")
 
-def _reset(parser):
-    """ Reset restrictions on a parser. """
-    if not isinstance(parser, _RestrictedParser):
-        return
-    parser.reset()
 
+# The parser is still being built, and its scanning form is unknown until it
+# is.
+_BUILDING = -1
 
-def _reset_chain(parsers, start_at):
-    """ Reset all restricted parsers to the right of 'start_at'. """
-    length = len(parsers)
-    for i in range(start_at + 1, length):
-        _reset(parsers[i])
 
+# The parser is yet to be built, which doesn't happen before the first parse,
+# and its lookahead mode and scanning form are unknown until then.
+_DEFERRED = -2
 
-def _restrict(parser, state):
-    """
-    Return a restricted version of a parser.
-    A no-op when used on a parser that performs no lookahead.
-    """
-    if get_lookahead(parser) is None:
-        return parser
-    return _RestrictedParser(parser, state)
 
+_CONTEXT = _Context()
 
-def _restrict_more(parser):
-    """
-    Further restrict a parser. A no-op when used on a parser that performs no
-    lookahead.
-    """
-    if not isinstance(parser, _RestrictedParser):
-        return
-    parser.restrict_more()
 
+# Lookahead mode of a combinator that is yet to be determined.
+_UNRESOLVED = object()
 
-def _shift(parsers, from_pos):
-    """
-    Propagate restrictions' change from 'from_pos' to the left end of a parser
-    chain.
 
-    Return the index of the last parser affected or None if all restriction
-    combinations were tried.
-    """
-    while from_pos >= 0:
-        p = parsers[from_pos]
-        _restrict_more(p)
-        if _overrestricted(p):
-            from_pos -= 1
-            continue
-        return from_pos
-    return None
+# A chain has run out of attempts to backtrack.
+_OUT_OF_BUDGET = object()
 
 
-def _partial_parse(state, parser, at):
-    """ Parse using only a portion of the input (namely, up to 'at'). """
-    use, do_not = state.split(at)
-    after = parser(use)
-    after = after._replace(effect=after.effect, left_end=do_not.left_end)
-    return after
+# The commit point (see 'commit'), which chains recognize by identity. It has
+# no 'first_chars', as the parsers after it may fail on any character, and
+# branches have to try the alternatives reaching it to find that out.
+_COMMIT = loud(lambda state: state._replace())
+_COMMIT.recipe = (commit, (), {})
 
 
-def _try_chain(parsers, from_pos, num_prelookahead, effect_points):
+class _LazyCell():
     """
-    Try to parse the state the first parser in the chain remembers.
-
-    Return a tuple (state, index of the first parser to fail).
-    In case of failure, 'state' will be None.
+    A parser built by a lazy parser's generator, shared among lazy parsers with
+    the same generator and arguments.
     """
-    state = parsers[from_pos].state_before
-    new_effect_points = deque()
-    pre = num_prelookahead
-    drop_effects_after = effect_points.find(lambda point: point[1] >= from_pos + pre)
-    i = len(parsers)
-    for i, parser in enumerate(parsers):
-        try:
-            parser.state_before = state
-            state = parser(state)
-            if state.effect is not None:
-                new_effect_points.append((state, i))
-        except ParsingFailure:
-            return (None, i)
-        except ParsingEnd as end:
-            if drop_effects_after is not None:
-                effect_points.drop(len(effect_points) - drop_effects_after)
-            effect_points.extend(new_effect_points)
-            raise end
-    if drop_effects_after is not None:
-        effect_points.drop(len(effect_points) - drop_effects_after)
-    effect_points.extend(new_effect_points)
-    return state, i
 
+    __slots__ = ["left_recursive", "parser", "scan_mode", "__weakref__"]
 
-class _Branch():
-    """ A parser trying several alternative parsers. """
-
-    def __init__(self, funcs, save_iterator, strictly_one):
-        self.successful = deque() if strictly_one else None
-        if save_iterator:
-            self.saved = deque()
-            self.parsers = iter(funcs)
-        else:
-            self.saved = None
-            self.parsers = funcs
-        self.saved_length = -1
-        self.iterator = None
+    def __init__(self):
+        self.left_recursive = False
+        self.parser = None
+        self.scan_mode = _UNRESOLVED
 
-    def __call__(self, state):
-        return self.parse(state)
 
-    #--------- helper things ---------#
+# Cells of lazy parsers, by the keys of their generators and arguments (see
+# '_interning_key').
+_LAZY_CELLS = weakref.WeakValueDictionary()
+_LAZY_CELLS_LOCK = threading.Lock()
 
-    def getnext(self):
-        """
-        Get the next pair of (index, parser).
-        Return None as both index and parser if there are no parsers left.
-        """
-        try:
-            return next(self.iterator)
-        except StopIteration:
-            return None, None
-
-    def prep_iterator(self):
-        """ Prepare the iterator with parsers and their indices. """
-        if self.saved is None:
-            self.iterator = enumerate(self.parsers)
-            self.saved_length = -1
-        else:
-            copy = self.saved.copy()
-            self.iterator = enumerate(it.chain(copy, self.parsers))
-            self.saved_length = len(self.saved)
+# Parsers built by interned constructors, by the keys of the constructors and
+# their arguments (see 'interned').
+_INTERNED = weakref.WeakValueDictionary()
+_INTERNED_LOCK = threading.Lock()
 
-    #--------- main method ---------#
 
-    def parse(self, state):
-        """ Parse the state using this branching point. """
-        self.prep_iterator()
-        if self.successful is not None:
-            self.successful.clear()
-        i, parser = self.getnext()
-        empty = i is None
-        while parser is not None:
-            if no_lookahead(self) and has_lookahead(parser):
-                copy_lookahead(parser, self)
-                raise _GainedLookahead
-            if i >= self.saved_length and self.saved is not None:
-                self.saved.append(parser)
-            try:
-                after = parser(state)
-                if self.successful is None:
-                    return after
-                self.successful.append(after)
-                i, parser = self.getnext()
-            except ParsingEnd as end:
-                return end.state
-            except ParsingFailure:
-                i, parser = self.getnext()
-            except _GainedLookahead:
-                if no_lookahead(self):
-                    copy_lookahead(parser, self)
-                    raise
-                continue
-        length = 0 if self.successful is None else len(self.successful)
-        if empty:
-            raise ParsingFailure(
-                state,
-                "Empty branching point",
-                error.BranchError.EMPTY)
-        if length == 0:
-            raise ParsingFailure(
-                state,
-                "All parsers in a branching point have failed",
-                error.BranchError.ALL_FAILED)
-        if length > 1:
-            raise ParsingFailure(
-                state,
-                "More than one parser succeeded in strict mode",
-                error.BranchError.MORE_THAN_ONE_SUCCEEDED)
-        return self.successful[0]
+# Characters whose entries a _Dispatch table keeps: Latin-1 ones.
+_DISPATCHED_CHARS = 256
 
 
-class _CachedAppender():
+def _interning_key(func, args, kwargs):
     """
-    A class that tries to combine efficient appending of deques and fast
-    indexing of lists.
+    Return the key telling apart calls of 'func' with the given arguments by
+    their types and values, or None if the arguments are not hashable.
     """
+    try:
+        key = (func,
+               tuple((type(arg), arg) for arg in args),
+               frozenset((name, type(arg), arg)
+                         for name, arg in kwargs.items()))
+        hash(key)
+    except TypeError:
+        return None
+    return key
 
-    def __init__(self):
-        self.changed = False
-        self.deque = deque()
-        self.list = []
-        self.empty = True
-
-    def __getitem__(self, index):
-        if self.empty:
-            raise IndexError("Indexing into an empty appender")
-        if self.changed:
-            self.update()
-        return self.list[index]
 
-    def __iter__(self):
-        return iter(self.deque)
+def _shared(parser):
+    """
+    Return True if 'parser' has been built by an interned constructor, and so
+    may be shared (see 'interned').
+    """
+    recipe = getattr(parser, "recipe", None)
+    if recipe is None:
+        return False
+    constructor, args, kwargs = recipe
+    wrapped = getattr(constructor, "__wrapped__", None)
+    if wrapped is None:
+        return False
+    key = _interning_key(wrapped, args, kwargs)
+    if key is None:
+        return False
+    with _INTERNED_LOCK:
+        return _INTERNED.get(key) is parser
+
+
+def _lazy_cell(generator, args, kwargs):
+    """
+    Return the cell shared by lazy parsers with the given generator and
+    arguments. Return a cell private to a single lazy parser if the arguments
+    are not hashable.
+    """
+    key = _interning_key(generator, args, kwargs)
+    if key is None:
+        return _LazyCell()
+    with _LAZY_CELLS_LOCK:
+        cell = _LAZY_CELLS.get(key)
+        if cell is None:
+            cell = _LazyCell()
+            _LAZY_CELLS[key] = cell
+    return cell
+
+
+class _LeftPreview():
+    """ A lazily computed slice of the start of a State's 'left' window. """
+
+    __slots__ = ["state", "length"]
+
+    def __init__(self, state, length):
+        self.state = state
+        self.length = length
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __str__(self):
+        state = self.state
+        end = min(state.left_end, state.left_start + self.length)
+        return state.string[state.left_start:end]
+
+
+class _Cursor():
+    """ A mutable counterpart of State, used by cursor-scanning parsers. """
+
+    __slots__ = ["string", "left_start", "left_end", "parsed_start",
+                 "parsed_end"]
+
+    def __init__(self, state):
+        self.load(state)
+
+    def load(self, state):
+        """ Move the cursor to the position of a State. """
+        self.string = state.string
+        self.left_start = state.left_start
+        self.left_end = state.left_end
+        self.parsed_start = state.parsed_start
+        self.parsed_end = state.parsed_end
+
+    def state(self):
+        """ Return a State object at cursor's position. """
+        return tuple.__new__(State, (self.string, None, self.left_start,
+                                     self.left_end, self.parsed_start,
+                                     self.parsed_end))
+
+
+def _get_scan(parser):
+    """
+    Return the cursor-scanning form of the parser, which may rely on
+    assumptions made while finding out the forms of enclosing parsers.
+    """
+    scan = getattr(parser, "scan_cursor", None)
+    if scan is None or get_lookahead(parser) is not None:
+        return None
+    return scan
+
+
+def _resolve_scan(find, key=None):
+    """
+    Call 'find' to find out a cursor-scanning form. Return a tuple of the form
+    and a flag telling if it's final, that is doesn't rely on assumptions about
+    parsers whose forms are still being found out.
+
+    If 'key' is not None, it identifies the parser whose form is being found.
+    A recursive attempt to find it is assumed to succeed and returns
+    _UNRESOLVED in place of the form.
+    """
+    context = _CONTEXT
+    depth = _NO_ASSUMPTION
+    if key is not None:
+        assumed = context.assumed_scans
+        depth = assumed.get(key)
+        if depth is not None:
+            context.lowest_assumption = min(context.lowest_assumption, depth)
+            return _UNRESOLVED, False
+        provisional = context.provisional_scans.get(key)
+        if provisional is not None:
+            context.lowest_assumption = min(context.lowest_assumption,
+                                            provisional[1])
+            return provisional[0], False
+        depth = len(assumed)
+        assumed[key] = depth
+    outer = context.lowest_assumption
+    context.lowest_assumption = _NO_ASSUMPTION
+    try:
+        scan = find()
+    finally:
+        used = context.lowest_assumption
+        context.lowest_assumption = outer
+        if key is not None:
+            del assumed[key]
+            _forget_provisional_scans(context, depth)
+    if scan is None:
+        if key is not None:
+            # Forms found assuming this one exists are wrong.
+            context.provisional_scans.clear()
+        return None, True
+    if used >= depth:
+        return scan, True
+    context.lowest_assumption = min(outer, used)
+    if key is not None and used != _DEFERRED:
+        # Forms relying on unbuilt parsers would never be forgotten.
+        context.provisional_scans[key] = (scan, used)
+    return scan, False
+
+
+def _forget_provisional_scans(context, depth):
+    """
+    Forget provisional scanning forms relying on the assumption made at
+    'depth' or deeper, which no longer holds.
+    """
+    provisional = context.provisional_scans
+    if provisional:
+        for key in [key for key, (_, used) in provisional.items()
+                    if used >= depth]:
+            del provisional[key]
+
+
+def _run_quiet(parser, state):
+    """
+    Run 'parser' on 'state' using the quiet calling convention, without
+    building an adapter for parsers that don't have a quiet form.
+    """
+    try:
+        quiet_parser = parser.quiet
+    except AttributeError:
+        try:
+            return parser(state)
+        except ParsingFailure as failure:
+            return failure
+    return quiet_parser(state)
+
+
+def _find_scans(parsers):
+    """
+    Return a tuple of scanning forms of the parsers, or None if some of them
+    don't have one.
+    """
+    scans = []
+    for parser in parsers:
+        scan = _get_scan(parser)
+        if scan is None:
+            return None
+        scans.append(scan)
+    return tuple(scans)
+
+
+def _anchored(parser, state):
+    """
+    Return whether 'parser', about to be run on 'state', is settled, or None
+    if it's not anchored (see _EffectSink).
+    """
+    context = _CONTEXT
+    anchor = context.anchor
+    if anchor is None or anchor[0] is not parser or anchor[1] is not state:
+        return None
+    context.anchor = None
+    return anchor[2]
+
+
+def _committed(failure):
+    """
+    Return a committed copy of 'failure' (see 'commit'), or the failure itself
+    if it already is.
+    """
+    if failure.committed:
+        return failure
+    # Failures may be shared (say, by a packrat cache), so they are not
+    # modified in place.
+    committed = type(failure).__new__(type(failure))
+    committed.__dict__.update(failure.__dict__)
+    committed.committed = True
+    return committed
+
+
+def _anchored_steps(parser, state, settled):
+    """
+    Run 'parser' on 'state' stepwise (see 'get_steps'), anchored to the sink
+    (see _EffectSink), and settled if 'settled' is true.
+    """
+    context = _CONTEXT
+    context.anchor = (parser, state, settled)
+    after = yield parser, state
+    context.anchor = None
+    return after
+
+
+def _packrat_steps(packrat, parser, state):
+    """
+    Run 'parser' on 'state' stepwise (see 'get_steps') like packrat.run does.
+    """
+    key, outcome = packrat.lookup(parser, state)
+    if outcome is None:
+        outcome = yield parser, state
+        packrat.store(key, outcome)
+    return outcome
+
+
+def _run_recursively(run):
+    """
+    Run a stepwise form in progress (see 'get_steps') to its end, running the
+    parsers it yields right away, on the Python stack. Return its outcome.
+    """
+    try:
+        request = next(run)
+        while True:
+            parser, state = request
+            try:
+                outcome = _run_quiet(parser, state)
+            except BaseException as exception:
+                # Pass it on to the form, as if it was raised by the parser.
+                request = run.throw(exception)
+            else:
+                request = run.send(outcome)
+    except StopIteration as returned:
+        return returned.value
+
+
+def _run_stepwise(steps, state):
+    """
+    Run the stepwise form of a parser (see 'get_steps') on 'state', and the
+    parsers it yields, keeping the forms in progress on a stack. Return the
+    outcome, following the quiet calling convention.
+    """
+    stack = []
+    run = steps(state)
+    outcome = None
+    raised = None
+    while True:
+        try:
+            if raised is None:
+                request = run.send(outcome)
+            else:
+                exception, raised = raised, None
+                request = run.throw(exception)
+        except StopIteration as returned:
+            if not stack:
+                return returned.value
+            outcome = returned.value
+            run = stack.pop()
+            continue
+        except BaseException as exception:
+            # Pass it on to the form that has yielded the parser, as if it was
+            # raised by the parser.
+            if not stack:
+                raise
+            raised = exception
+            run = stack.pop()
+            continue
+        parser, state = request
+        steps = get_steps(parser)
+        if steps is None:
+            try:
+                outcome = _run_quiet(parser, state)
+            except BaseException as exception:
+                raised = exception
+            continue
+        stack.append(run)
+        run = steps(state)
+        outcome = None
+
+
+def _call_uncompiled(quiet_parser, string, left_start, left_end, parsed_start,
+                     parsed_end, tape):
+    """
+    Run a parser that isn't compiled from compiled code (see _Compiler),
+    recording its effect to 'tape'. Return the positions of the resulting
+    State, or None on failure.
+    """
+    after = quiet_parser(tuple.__new__(
+        State, (string, None, left_start, left_end, parsed_start, parsed_end)))
+    if isinstance(after, ParsingFailure):
+        if after.committed:
+            raise _CompiledFallback()
+        return None
+    if after.string is not string or after.left_end != left_end:
+        raise _CompiledFallback()
+    if after.effect is not None:
+        tape.record(after, len(tape))
+    return after.left_start, after.parsed_start, after.parsed_end
+
+
+def _copy_descriptions(from_parser, to):
+    """
+    Give 'to' the 'match_ends' method (see _RestrictedParser), the 'char_runs'
+    description (see _CharNFA) and the 'first_chars' description (see
+    get_first_chars) of 'from_parser', if it has them.
+    """
+    match_ends = getattr(from_parser, "match_ends", None)
+    if match_ends is not None:
+        to.match_ends = match_ends
+    char_runs = getattr(from_parser, "char_runs", None)
+    if char_runs is not None:
+        to.char_runs = char_runs
+    first_chars = get_first_chars(from_parser)
+    if first_chars is not None:
+        to.first_chars = first_chars
+
+
+def _first_chars_of_chain(parsers):
+    """
+    Return the 'first_chars' description of a chain of 'parsers', or None if
+    it can't be found out.
+    """
+    tests = []
+    for parser in parsers:
+        first_chars = get_first_chars(parser)
+        if first_chars is None:
+            return None
+        test, nullable = first_chars
+        tests.append(test)
+        if not nullable:
+            return _any_char_test(tests), False
+    return _any_char_test(tests), True
+
+
+def _any_char_test(tests):
+    """ Return a test passed by characters passing any of the 'tests'. """
+    tests = tuple(tests)
+    if len(tests) == 1:
+        return tests[0]
+    return lambda char: any(test(char) for test in tests)
+
+
+def _any_steps(parsers):
+    """
+    Return True if some of the parsers have a stepwise form (see
+    'get_steps'), False if none of them has or they are a one-shot iterator.
+    """
+    if parsers is None:
+        return False
+    return any(get_steps(parser) is not None for parser in parsers)
+
+
+def _no_char(char):
+    """ A test no character passes. """
+    return False
+
+
+def _optimize(parser, done):
+    """
+    Optimize a parser (see 'optimize'), reusing the results for the parsers
+    in 'done', a dictionary from ids of parsers to the parsers and their
+    optimized versions.
+    """
+    key = id(parser)
+    if key in done:
+        return done[key][1]
+    # A parser containing itself is left as it is inside itself.
+    done[key] = (parser, parser)
+    if isinstance(parser, _Chain) and parser.funcs is not None:
+        result = _optimize_chain(parser, done)
+    elif isinstance(parser, _Branch) and parser.funcs is not None:
+        result = _optimize_branch(parser, done)
+    elif isinstance(parser, _Repeat):
+        inner = _optimize(parser.parser, done)
+        result = parser
+        if inner is not parser.parser:
+            result = _Repeat(inner, parser.min_hits, parser.max_hits,
+                             parser.combine)
+    else:
+        result = parser
+    done[key] = (parser, result)
+    return result
+
+
+def _optimize_branch(branch, done):
+    """ Optimize a branch and its alternatives. """
+    parsers = [_optimize(parser, done) for parser in branch.funcs]
+    if not branch.strictly_one:
+        parsers = _factor_alternatives(parsers)
+    res = _Branch(parsers, False, branch.strictly_one)
+    res.catch_end = branch.catch_end
+    return res
+
+
+def _optimize_chain(chain, done):
+    """ Optimize a chain and its parsers. """
+    parsers = [_optimize(parser, done) for parser in chain.funcs]
+    if not chain.stop_on_failure:
+        if chain.all_or_nothing:
+            parsers = _flatten_chains(chain, parsers)
+        parsers = _fuse_literals(chain, parsers)
+    return _Chain(parsers, chain.combine, chain.stop_on_failure,
+                  chain.all_or_nothing, False)
+
+
+def _factor_alternatives(parsers):
+    """
+    Replace runs of alternatives of a branch that are chains starting with the
+    same parsers with single alternatives parsing the common part only once.
+    Literals fused in the alternatives are split back into the literals they
+    were fused from, so that their common start is factored out, too.
+    """
+    elements = [_unfused(parser.funcs) if _factorable(parser) else None
+                for parser in parsers]
+    factored = []
+    i = 0
+    while i < len(parsers):
+        head = parsers[i]
+        j = i + 1
+        if elements[i] is not None:
+            key = _parser_key(elements[i][0])
+            while (j < len(parsers) and elements[j] is not None
+                   and parsers[j].combine == head.combine
+                   and parsers[j].all_or_nothing == head.all_or_nothing
+                   and _parser_key(elements[j][0]) == key):
+                j += 1
+        if j - i < 2:
+            factored.append(head)
+        else:
+            factored.append(_factor(parsers[i:j], elements[i:j]))
+        i = j
+    return factored
+
+
+def _factorable(parser):
+    """
+    Return True if a branch alternative is a chain that can have its leading
+    parsers factored out.
+    """
+    return (isinstance(parser, _Chain) and isinstance(parser.funcs, list)
+            and parser.funcs and parser.funcs[0] is not _COMMIT
+            and not parser.stop_on_failure
+            and _known_without_lookahead(parser))
+
+
+def _factor(alternatives, elements):
+    """
+    Return a chain of the parsers all of the 'alternatives' (chains with the
+    same settings, made of the lists of parsers in 'elements') start with,
+    followed by a branch over the rest of them. Adjacent literals are fused
+    in the chains made.
+    """
+    common = 1
+    # A commit point would commit the factored alternatives to just one of
+    # them.
+    while (all(len(parsers) > common for parsers in elements)
+           and elements[0][common] is not _COMMIT):
+        key = _parser_key(elements[0][common])
+        if any(_parser_key(parsers[common]) != key for parsers in elements):
+            break
+        common += 1
+    combine = alternatives[0].combine
+    all_or_nothing = alternatives[0].all_or_nothing
+    rest = _Branch(
+        _factor_alternatives([
+            _fused_chain(parsers[common:], combine, all_or_nothing)
+            for parsers in elements]),
+        False, False)
+    # An all-or-nothing chain stopped inside would have made the whole
+    # alternative not parse anything, so the chain below has to see the stop.
+    rest.catch_end = not all_or_nothing
+    return _fused_chain(elements[0][:common] + [rest], combine, all_or_nothing)
+
+
+def _fused_chain(parsers, combine, all_or_nothing):
+    """
+    Return a chain of 'parsers' (built by 'optimize'), fusing adjacent
+    literals among them.
+    """
+    chain = _Chain(parsers, combine, False, all_or_nothing, False)
+    fused = _fuse_literals(chain, parsers)
+    if len(fused) == len(parsers):
+        return chain
+    return _Chain(fused, combine, False, all_or_nothing, False)
+
+
+def _unfused(parsers):
+    """
+    Return the list of chain's 'parsers' with the literals fused by 'optimize'
+    split back into the literals they were fused from.
+    """
+    split = []
+    for parser in parsers:
+        split.extend(getattr(parser, "literal_parts", (parser,)))
+    return split
+
+
+def _flatten_chains(chain, parsers):
+    """
+    Merge the parsers of chains nested into an all-or-nothing chain into the
+    list of its 'parsers'.
+    """
+    flat = []
+    for i, parser in enumerate(parsers):
+        if (isinstance(parser, _Chain) and isinstance(parser.funcs, list)
+                and parser.funcs and not parser.stop_on_failure
+                and _known_without_lookahead(parser)
+                and (not parser.combine or _parsed_hidden(chain, parsers, i))
+                and not any(inner is _COMMIT for inner in parser.funcs)):
+            flat.extend(parser.funcs)
+        else:
+            flat.append(parser)
+    return flat
+
+
+def _fuse_literals(chain, parsers):
+    """ Fuse runs of adjacent literals in the list of chain's 'parsers'. """
+    fused = []
+    run = []
+    for i, parser in enumerate(parsers):
+        if getattr(parser, "literal_string", None) is None:
+            fused.append(parser)
+            continue
+        run.append(parser)
+        following = parsers[i + 1] if i + 1 < len(parsers) else None
+        if getattr(following, "literal_string", None) is not None:
+            continue
+        if len(run) > 1 and _parsed_hidden(chain, parsers, i):
+            fused.append(_fused_literal(run))
+        else:
+            fused.extend(run)
+        run = []
+    return fused
+
+
+def _fused_literal(parts):
+    """
+    Return a parser matching the literals of 'parts' at once, and failing
+    like they would if run in turn.
+    """
+    lit = "".join(part.literal_string for part in parts)
+    length = len(lit)
+    quiet_parts = [quiet(part) for part in parts]
+    def fused_literal_body(state):
+        """ Match several literals at once. """
+        if state.string.startswith(lit, state.left_start, state.left_end):
+            return state.consume(length)
+        # Let the literals themselves report the failure.
+        for quiet_part in quiet_parts:
+            state = quiet_part(state)
+            if isinstance(state, ParsingFailure):
+                break
+        return state
+    def fused_literal_scan(cursor):
+        """ Match several literals at once on a cursor. """
+        pos = cursor.left_start
+        if not cursor.string.startswith(lit, pos, cursor.left_end):
+            return False
+        cursor.parsed_start = pos
+        cursor.left_start = cursor.parsed_end = pos + length
+        return True
+    res = loud(fused_literal_body)
+    res.scan_cursor = fused_literal_scan
+    res.literal_string = lit
+    res.literal_parts = tuple(_unfused(parts))
+    res.char_runs = tuple(run for part in parts for run in part.char_runs)
+    first_chars = _first_chars_of_chain(parts)
+    if first_chars is not None:
+        res.first_chars = first_chars
+    return res
+
+
+def _parsed_hidden(chain, parsers, i):
+    """
+    Return True if the 'parsed' window of the state output by the 'i'th of
+    chain's 'parsers' can't affect the outcome of the chain: either the next
+    parser replaces it, or it's the last one and the chain combines the
+    windows.
+    """
+    if i + 1 == len(parsers):
+        return chain.combine
+    return getattr(parsers[i + 1], "char_runs", None) is not None
+
+
+def _parser_key(parser):
+    """
+    Return an object telling apart parsers that behave differently when
+    factoring alternatives out.
+    """
+    lit = getattr(parser, "literal_string", None)
+    return parser if lit is None else lit
+
+
+def _first_lookahead(parsers):
+    """
+    Return lookahead mode of the first parser in 'parsers' that has one, or
+    None if none of them do.
+    """
+    for parser in parsers:
+        lookahead = get_lookahead(parser)
+        if lookahead is not None:
+            return lookahead
+    return None
+
+
+def _produced_lookahead(parsers):
+    """
+    Return lookahead mode of the first parser that has one among those a
+    one-shot iterable of parsers has produced so far, or None.
+    """
+    if isinstance(parsers, _SavingIterable):
+        parsers = parsers.saved
+    elif not isinstance(parsers, tuple):
+        return None
+    return _first_lookahead(parsers)
+
+
+def _known_without_lookahead(parser):
+    """
+    Return True if 'parser' has no lookahead, even once the lazy parsers in it
+    are built.
+    """
+    context = _CONTEXT
+    outer = context.assumed_modes
+    used = context.assumed_modes = set()
+    try:
+        mode = get_lookahead(parser)
+    finally:
+        context.assumed_modes = outer
+    return mode is None and not used
+
+
+def _resolve_lookahead(key, find):
+    """
+    Call 'find' to work out a lookahead mode. Return a tuple of the mode and a
+    flag telling if it's settled, that is doesn't rely on lazy parsers that
+    are yet to be built or on modes still being worked out around it.
+
+    'key' identifies the parser whose mode is being worked out. A recursive
+    attempt to work it out returns the mode assumed so far, starting with
+    none, and 'find' is called again until the assumption holds.
+    """
+    context = _CONTEXT
+    resolving = context.resolving
+    if key in resolving:
+        context.assumed_modes.add(key)
+        return resolving[key], False
+    resolving[key] = None
+    outer = context.assumed_modes
+    used = set()
+    try:
+        # There are only so many modes to assume.
+        for _ in range(len(Lookahead) + 1):
+            used = context.assumed_modes = set()
+            mode = find()
+            if key not in used or mode is resolving[key]:
+                break
+            resolving[key] = mode
+    finally:
+        del resolving[key]
+        used.discard(key)
+        context.assumed_modes = outer
+        if outer is not None:
+            outer |= used
+    return mode, not used
+
+
+def _indented(lines):
+    """ Return lines of generated code indented one level deeper. """
+    return ["    " + line for line in lines]
+
+
+def _negated(cond):
+    """ Return the negation of a condition in generated code. """
+    if cond.endswith(" is not None"):
+        return cond[:-len(" is not None")] + " is None"
+    return f"not ({cond})"
+
+
+def _one_shot(iterable):
+    """ Return True if 'iterable' can only be iterated over once. """
+    return iter(iterable) is iterable
+
+
+def _overrestricted(parser):
+    """ Return True if a parser is maximally restricted. """
+    # isinstance may not be idiomatic, but it's safer than relying on parsers
+    # not having a particular method.
+    if not isinstance(parser, _RestrictedParser):
+        return True
+    return parser.overrestricted()
+
+
+def _rebuild(constructor, args, kwargs):
+    """ Build a parser again when unpickling it (see 'dumps'). """
+    return constructor(*args, **kwargs)
+
+
+def _reset(parser):
+    """ Reset restrictions on a parser. """
+    if not isinstance(parser, _RestrictedParser):
+        return
+    parser.reset()
+
+
+def _reset_chain(parsers, start_at):
+    """ Reset all restricted parsers to the right of 'start_at'. """
+    length = len(parsers)
+    for i in range(start_at + 1, length):
+        _reset(parsers[i])
+
+
+def _restrict(parser, state):
+    """
+    Return a restricted version of a parser.
+    A no-op when used on a parser that performs no lookahead.
+    """
+    if get_lookahead(parser) is None:
+        return parser
+    return _RestrictedParser(parser, state)
+
+
+def _restrict_more(parser):
+    """
+    Further restrict a parser. A no-op when used on a parser that performs no
+    lookahead.
+    """
+    if not isinstance(parser, _RestrictedParser):
+        return
+    parser.restrict_more()
+
+
+def _scan_all(combinator, find):
+    """
+    Find the scanning forms of the parsers of a chain or a branch using
+    'find', and save them to its 'scans' attribute if they are final. Return
+    the forms, or _UNRESOLVED if the combinator contains itself and is assumed
+    to have them.
+    """
+    scans, final = _resolve_scan(find, combinator)
+    if final:
+        combinator.scans = scans
+    return scans
+
+
+def _set_recipe(parser, constructor, args, kwargs):
+    """
+    Remember that 'parser' has been built by calling 'constructor' with the
+    given arguments (see 'dumps'), unless it is one of the arguments, and
+    return 'parser'. Constructors built on other constructors override the
+    calls the parsers remember, as the arguments of the inner calls may not
+    be pickleable.
+    """
+    if any(arg is parser for arg in it.chain(args, kwargs.values())):
+        return parser
+    try:
+        parser.recipe = (constructor, args, kwargs)
+    except AttributeError:
+        pass
+    return parser
+
+
+def _shift(parsers, from_pos):
+    """
+    Propagate restrictions' change from 'from_pos' to the left end of a parser
+    chain.
+
+    Return the index of the last parser affected or None if all restriction
+    combinations were tried.
+    """
+    while from_pos >= 0:
+        p = parsers[from_pos]
+        _restrict_more(p)
+        if _overrestricted(p):
+            from_pos -= 1
+            continue
+        return from_pos
+    return None
+
+
+def _partial_parse(state, parser, at):
+    """ Parse using only a portion of the input (namely, up to 'at'). """
+    use, do_not = state.split(at)
+    after = _run_quiet(parser, use)
+    if isinstance(after, ParsingFailure):
+        return after
+    after = after._replace(effect=after.effect, left_end=do_not.left_end)
+    return after
+
+
+def _try_chain(frame, from_pos):
+    """
+    Try to parse the state the parser at 'from_pos' in frame's lookahead chain
+    remembers, continuing up to the end of the lookahead chain.
+
+    Return a tuple (state, index of the first parser to fail).
+    In case of failure, 'state' will be None, unless the failure is committed,
+    in which case it's the failure itself.
+    """
+    parsers = frame.lookahead_chain
+    memo = frame.memo
+    pre = frame.num_prelookahead_parsers
+    state = parsers[from_pos].state_before
+    if frame.tape is not None:
+        frame.tape.truncate(from_pos + pre)
+    i = len(parsers)
+    for i in range(from_pos, len(parsers)):
+        parser = parsers[i]
+        key = (i, state.left_start, state.left_end, state.parsed_start,
+               state.parsed_end)
+        if isinstance(parser, _RestrictedParser):
+            if i != from_pos and key in memo:
+                # All the outcomes of the parser have already been tried on
+                # this input, so the one of the previous parser is useless.
+                return (None, i - 1)
+            state = _run_quiet(parser, state)
+        else:
+            after = memo.get(key)
+            if after is None:
+                after = _run_quiet(parser, state)
+                memo[key] = after
+            state = after
+        if isinstance(state, ParsingFailure):
+            return (state if state.committed else None, i)
+        if state.effect is not None:
+            frame.record(state, pre + i)
+    return state, i
+
+
+class _Branch():
+    """ A parser trying several alternative parsers. """
+
+    def __init__(self, funcs, save_iterator, strictly_one):
+        self.strictly_one = strictly_one
+        # Whether a ParsingEnd raised by an alternative ends the branch
+        # successfully, rather than passing through it.
+        self.catch_end = True
+        if _one_shot(funcs):
+            self.funcs = None
+            self.lookahead_mode = None
+        else:
+            self.funcs = funcs
+            self.lookahead_mode = _UNRESOLVED
+        self.scans = _UNRESOLVED
+        self.first = _UNRESOLVED
+        self.stepwise = _UNRESOLVED
+        self.table = _UNRESOLVED
+        self.scan_table = _UNRESOLVED
+        if save_iterator:
+            self.parsers = _SavingIterable(funcs, self.sealed)
+        else:
+            self.parsers = funcs
+
+    def __call__(self, state):
+        after = self.parse(state)
+        if isinstance(after, ParsingFailure):
+            raise after
+        return after
+
+    def quiet(self, state):
+        """ Parse the state, returning a ParsingFailure, not raising it. """
+        return self.parse(state)
+
+    def seal(self):
+        """
+        Keep the parsers as a tuple from now on, unless they come from a
+        one-shot iterator (see 'seal').
+        """
+        if self.funcs is not None and type(self.parsers) is not tuple:
+            self.sealed(tuple(self.parsers))
+
+    def sealed(self, parsers):
+        """ Keep 'parsers', all the parsers of the branch, as a tuple. """
+        self.parsers = parsers
+        if self.funcs is not None:
+            self.funcs = parsers
+
+    @property
+    def dispatch(self):
+        """
+        The table of parsers to try on every next character (see _Dispatch),
+        or None if all of them have to be tried anyway.
+        """
+        table = self.table
+        if table is _UNRESOLVED:
+            table = None
+            if self.funcs is not None:
+                table = _Dispatch.build(tuple(self.parsers))
+            self.table = table
+        return table
+
+    def scan_dispatch(self, scans):
+        """
+        Return the dispatch table over the scanning forms of the parsers, or
+        None if all of them have to be tried anyway or the forms are not
+        final yet.
+        """
+        table = self.scan_table
+        if table is _UNRESOLVED:
+            if scans is not self.scans:
+                return None
+            table = self.dispatch
+            if table is not None:
+                table = table.over(scans)
+            self.scan_table = table
+        return table
+
+    @property
+    def first_chars(self):
+        """
+        Characters the branch's match may start with, if all of its parsers
+        describe them (see 'get_first_chars').
+        """
+        first = self.first
+        if first is _UNRESOLVED:
+            # Guard against branches containing themselves.
+            self.first = None
+            first = None
+            if self.funcs is not None:
+                firsts = [get_first_chars(parser) for parser in self.parsers]
+                if None not in firsts:
+                    first = (_any_char_test(test for test, _ in firsts),
+                             any(nullable for _, nullable in firsts))
+            self.first = first
+        return first
+
+    @property
+    def lookahead(self):
+        """ Lookahead mode of the first parser in the branch that has one. """
+        mode = self.lookahead_mode
+        if mode is _UNRESOLVED:
+            mode, settled = _resolve_lookahead(
+                id(self), lambda: _first_lookahead(self.parsers))
+            if settled:
+                self.lookahead_mode = mode
+        elif self.funcs is None:
+            mode, _ = _resolve_lookahead(
+                id(self), lambda: _produced_lookahead(self.parsers))
+        return mode
+
+    @property
+    def scan_cursor(self):
+        """
+        Cursor-scanning form of the branch, if all of its parsers have one.
+        """
+        scans = self.scans
+        if scans is _UNRESOLVED:
+            scans = _scan_all(self, self.find_scans)
+        return None if scans is None else self.scan_branch
+
+    @property
+    def steps(self):
+        """ Stepwise form of the branch, if some of its parsers have one. """
+        stepwise = self.stepwise
+        if stepwise is _UNRESOLVED:
+            # Guard against branches containing themselves.
+            self.stepwise = False
+            stepwise = _any_steps(self.parsers)
+            self.stepwise = stepwise
+        return self.step_branch if stepwise else None
+
+    def find_scans(self):
+        """ Return a tuple of scanning forms of the parsers, or None. """
+        if (self.funcs is None or self.strictly_one
+                or self.lookahead is not None):
+            return None
+        return _find_scans(self.parsers)
+
+    def scan_branch(self, cursor):
+        """ Scan the cursor with the first parser that succeeds. """
+        scans = self.scans
+        if scans is _UNRESOLVED:
+            scans = _scan_all(self, self.find_scans)
+        left_start = cursor.left_start
+        parsed_start = cursor.parsed_start
+        parsed_end = cursor.parsed_end
+        dispatch = self.scan_table
+        if dispatch is _UNRESOLVED:
+            dispatch = self.scan_dispatch(scans)
+        if dispatch is not None:
+            scans = dispatch.select(cursor)
+        for scan in scans:
+            if scan(cursor):
+                return True
+            cursor.left_start = left_start
+            cursor.parsed_start = parsed_start
+            cursor.parsed_end = parsed_end
+        return False
+
+    #--------- main method ---------#
+
+    def parse(self, state):
+        """
+        Parse the state using this branching point. Return a ParsingFailure on
+        failure.
+        """
+        packrat = _CONTEXT.packrat
+        if packrat is None and self.scan_cursor is not None:
+            cursor = _Cursor(state)
+            if self.scan_branch(cursor):
+                return cursor.state()
+            return self.failure(state, not self.scans, 0)
+        return _run_recursively(self.alternatives(state, False))
+
+    def step_branch(self, state):
+        """
+        Parse the state like 'parse' does, yielding the parsers that have a
+        stepwise form to the caller (see 'get_steps'). Branches with lookahead
+        are parsed as usual.
+        """
+        if self.lookahead is not None:
+            return self.parse(state)
+        return (yield from self.alternatives(state, True))
+
+    def alternatives(self, state, stepping):
+        """
+        Try the parsers on the state one by one, yielding them to the caller
+        (see 'get_steps'), and return the outcome. Parsers with a scanning form
+        are scanned instead, unless 'stepping' is true and they have a stepwise
+        form, too.
+        """
+        packrat = _CONTEXT.packrat
+        successful = [] if self.strictly_one else None
+        anchored = (successful is None and _CONTEXT.sink is not None
+                    and _anchored(self, state) is not None)
+        cursor = None
+        dispatch = self.table
+        if dispatch is _UNRESOLVED:
+            dispatch = self.dispatch
+        if dispatch is None:
+            parsers = self.parsers
+            empty = True
+        else:
+            parsers = dispatch.select(state)
+            empty = False
+        for parser in parsers:
+            empty = False
+            scan = None
+            if packrat is None and (not stepping or get_steps(parser) is None):
+                scan = _get_scan(parser)
+            if scan is not None:
+                if cursor is None:
+                    cursor = _Cursor(state)
+                else:
+                    cursor.load(state)
+                if not scan(cursor):
+                    continue
+                after = cursor.state()
+            else:
+                try:
+                    if packrat is not None:
+                        after = yield from _packrat_steps(packrat, parser,
+                                                          state)
+                    elif anchored:
+                        after = yield from _anchored_steps(parser, state,
+                                                           False)
+                    else:
+                        after = yield parser, state
+                except ParsingEnd as end:
+                    if not self.catch_end:
+                        raise
+                    return end.state
+                if isinstance(after, ParsingFailure):
+                    if after.committed:
+                        return after
+                    continue
+            if successful is None:
+                return after
+            successful.append(after)
+        if successful is not None and len(successful) == 1:
+            return successful[0]
+        return self.failure(state, empty,
+                            0 if successful is None else len(successful))
+
+    def restricted_outcomes(self, state):
+        """
+        Yield the outcomes of a branch that isn't strict to try one at a time
+        when a chain backtracks over it (see _RestrictedParser): those of the
+        first alternative that succeeds, which are the outcomes on portions of
+        the input if the alternative has lookahead, and its only outcome
+        otherwise. Alternatives without lookahead are never restricted.
+        """
+        dispatch = self.table
+        if dispatch is _UNRESOLVED:
+            dispatch = self.dispatch
+        parsers = self.parsers if dispatch is None else dispatch.select(state)
+        for parser in parsers:
+            if get_lookahead(parser) is not None:
+                found = False
+                for after in _RestrictedParser(parser, state).enumerate(state):
+                    found = True
+                    yield after
+                if found:
+                    return
+                continue
+            try:
+                after = _run_quiet(parser, state)
+            except ParsingEnd as end:
+                if not self.catch_end:
+                    raise
+                yield end.state
+                return
+            if isinstance(after, ParsingFailure):
+                if after.committed:
+                    return
+                continue
+            yield after
+            return
+
+    def all_failed(self, state):
+        """
+        Return the failure of the branch on a state none of its parsers has
+        succeeded on.
+        """
+        return self.failure(state, next(iter(self.parsers), None) is None, 0)
+
+    def failure(self, state, empty, length):
+        """
+        Return the failure of a branch that has found 'length' successful
+        parsers among its (possibly 'empty') list of alternatives.
+        """
+        if empty:
+            return ParsingFailure(
+                state,
+                "Empty branching point",
+                error.BranchError.EMPTY)
+        if length == 0:
+            return ParsingFailure(
+                state,
+                "All parsers in a branching point have failed",
+                error.BranchError.ALL_FAILED)
+        if length > 1:
+            return ParsingFailure(
+                state,
+                "More than one parser succeeded in strict mode",
+                error.BranchError.MORE_THAN_ONE_SUCCEEDED)
+
+
+class _Chain():
+    """
+    A chain of parsers.
+    """
+
+    # Chains that can be simulated by an automaton (see _CharNFA) switch to it
+    # after this many unsuccessful attempts to backtrack.
+    BACKTRACKING_BUDGET = 32
+
+    def __init__(self, funcs, combine, stop_on_failure, all_or_nothing, save_iterator):
+        self.combine = combine
+        self.stop_on_failure = stop_on_failure
+        self.all_or_nothing = all_or_nothing
+        if _one_shot(funcs):
+            self.funcs = None
+            self.lookahead_mode = None
+        else:
+            self.funcs = funcs
+            self.lookahead_mode = _UNRESOLVED
+        self.scans = _UNRESOLVED
+        self.nfa = _UNRESOLVED
+        self.first = _UNRESOLVED
+        self.stepwise = _UNRESOLVED
+        if save_iterator:
+            self.parsers = _SavingIterable(funcs, self.sealed)
+        else:
+            self.parsers = funcs
+
+    def __call__(self, state):
+        after = self.quiet(state)
+        if isinstance(after, ParsingFailure):
+            raise after
+        return after
+
+    def quiet(self, state):
+        """ Parse the state, returning a ParsingFailure, not raising it. """
+        if _CONTEXT.packrat is None and self.scan_cursor is not None:
+            cursor = _Cursor(state)
+            if self.scan_chain(cursor):
+                return cursor.state()
+            # Run the chain normally to find out how exactly it fails.
+        nfa = self.char_nfa
+        if nfa is None:
+            frame = _ChainFrame(state)
+            if _CONTEXT.sink is not None:
+                frame.settled = self.anchored(state)
+            return self.parse(frame)
+        frame = _ChainFrame(state)
+        frame.budget = self.BACKTRACKING_BUDGET
+        after = self.parse(frame)
+        if after is _OUT_OF_BUDGET:
+            return self.simulate(nfa, state)
+        return after
+
+    def anchored(self, state):
+        """
+        Return whether the chain, about to be run on 'state', is settled, or
+        None if it's not anchored (see _EffectSink). All-or-nothing chains
+        are never anchored, as a stop inside them undoes the effects of the
+        parsers they have already run.
+        """
+        settled = _anchored(self, state)
+        if self.all_or_nothing and not self.stop_on_failure:
+            return None
+        return settled
+
+    def seal(self):
+        """
+        Keep the parsers as a tuple from now on, unless they come from a
+        one-shot iterator (see 'seal').
+        """
+        if self.funcs is not None and type(self.parsers) is not tuple:
+            self.sealed(tuple(self.parsers))
+
+    def sealed(self, parsers):
+        """ Keep 'parsers', all the parsers of the chain, as a tuple. """
+        self.parsers = parsers
+        if self.funcs is not None:
+            self.funcs = parsers
+
+    @property
+    def char_nfa(self):
+        """
+        The automaton simulating the chain (see _CharNFA), or None if the
+        chain performs no lookahead or some of its parsers can't be compiled.
+        """
+        nfa = self.nfa
+        if nfa is _UNRESOLVED:
+            nfa = None
+            if (self.funcs is not None and not self.stop_on_failure
+                    and self.lookahead is not None):
+                nfa = _CharNFA.compile(list(self.parsers))
+            self.nfa = nfa
+        return nfa
+
+    @property
+    def first_chars(self):
+        """
+        Characters the chain's match may start with, if its parsers describe
+        them (see 'get_first_chars').
+        """
+        first = self.first
+        if first is _UNRESOLVED:
+            # Guard against chains containing themselves.
+            self.first = None
+            first = None
+            if self.funcs is not None and not self.stop_on_failure:
+                first = _first_chars_of_chain(self.parsers)
+            self.first = first
+        return first
+
+    @property
+    def lookahead(self):
+        """ Lookahead mode of the first parser in the chain that has one. """
+        mode = self.lookahead_mode
+        if mode is _UNRESOLVED:
+            mode, settled = _resolve_lookahead(
+                id(self), lambda: _first_lookahead(self.parsers))
+            if settled:
+                self.lookahead_mode = mode
+        elif self.funcs is None:
+            mode, _ = _resolve_lookahead(
+                id(self), lambda: _produced_lookahead(self.parsers))
+        return mode
+
+    @property
+    def scan_cursor(self):
+        """
+        Cursor-scanning form of the chain, if all of its parsers have one.
+        """
+        scans = self.scans
+        if scans is _UNRESOLVED:
+            scans = _scan_all(self, self.find_scans)
+        return None if scans is None else self.scan_chain
+
+    @property
+    def steps(self):
+        """ Stepwise form of the chain, if some of its parsers have one. """
+        stepwise = self.stepwise
+        if stepwise is _UNRESOLVED:
+            # Guard against chains containing themselves.
+            self.stepwise = False
+            stepwise = _any_steps(self.parsers)
+            self.stepwise = stepwise
+        return self.step_chain if stepwise else None
+
+    def find_scans(self):
+        """ Return a tuple of scanning forms of the parsers, or None. """
+        if self.funcs is None or self.lookahead is not None:
+            return None
+        return _find_scans(self.parsers)
+
+    def scan_chain(self, cursor):
+        """ Scan the cursor with the parsers in turn. """
+        scans = self.scans
+        if scans is _UNRESOLVED:
+            scans = _scan_all(self, self.find_scans)
+        start = cursor.left_start
+        if self.stop_on_failure:
+            for scan in scans:
+                left_start = cursor.left_start
+                parsed_start = cursor.parsed_start
+                parsed_end = cursor.parsed_end
+                if not scan(cursor):
+                    cursor.left_start = left_start
+                    cursor.parsed_start = parsed_start
+                    cursor.parsed_end = parsed_end
+                    break
+        else:
+            for scan in scans:
+                if not scan(cursor):
+                    return False
+        if self.combine:
+            cursor.parsed_start = start
+        return True
+
+    def prep_output_state(self, frame, early):
+        """ Prepare output state: combine 'parsed's and effects. """
+        if early and self.all_or_nothing and not self.stop_on_failure:
+            return frame.first_state
+        state = frame.state
+        if self.combine:
+            state = state._replace(parsed_start=frame.first_state.left_start)
+        if frame.tape is None:
+            return state._replace()
+        return state._replace(effect=frame.tape)
+
+    def prep_end_exception(self, end, frame):
+        """
+        Prepare ParsingEnd exception: attach a prepared output state to it.
+        """
+        end.state = self.prep_output_state(frame, True)
+        return end
+
+    def normal_loop(self, frame, indexed_parsers, stepping):
+        """
+        Normal parsing routine - just chain the parsers, yielding them to the
+        caller (see 'get_steps'). Return a ParsingFailure if one of the parsers
+        fails.
+
+        Until lookahead is met, runs of parsers that have a scanning form are
+        scanned on a single cursor, and 'frame.state' is only updated before
+        the next parser without one. If 'stepping' is true, parsers that have
+        a stepwise form are yielded instead.
+        """
+        scanning = _CONTEXT.packrat is None
+        cursor = None
+        for i, parser in indexed_parsers:
+            if (scanning and frame.lookahead_chain is None
+                    and (not stepping or get_steps(parser) is None)):
+                scan = _get_scan(parser)
+                if scan is not None:
+                    if cursor is None:
+                        cursor = _Cursor(frame.state)
+                    left_start = cursor.left_start
+                    parsed_start = cursor.parsed_start
+                    parsed_end = cursor.parsed_end
+                    if scan(cursor):
+                        frame.num_prelookahead_parsers += 1
+                        continue
+                    # Let the parser itself report the failure.
+                    cursor.left_start = left_start
+                    cursor.parsed_start = parsed_start
+                    cursor.parsed_end = parsed_end
+            if cursor is not None:
+                frame.state = cursor.state()
+                cursor = None
+            after = yield from self.parse_one(frame, parser, i)
+            if isinstance(after, ParsingFailure):
+                return after
+            frame.state = after
+        if cursor is not None:
+            frame.state = cursor.state()
+        return self.prep_output_state(frame, False)
+
+    def start_backtracking(self, frame, indexed_parsers):
+        """ Start backtracking, then continue with normal parsing. """
+        lookahead_chain = frame.lookahead_chain
+        frame.memo = {}
+        start_from = len(lookahead_chain) - 1
+        while True:
+            if frame.budget is not None:
+                if frame.budget == 0:
+                    return _OUT_OF_BUDGET
+                frame.budget -= 1
+            pos = _shift(lookahead_chain, start_from)
+            frame.mark_exhausted(-1 if pos is None else pos, start_from)
+            if pos is None:
+                failure = ParsingFailure(
+                    frame.state,
+                    "No combination of inputs allows successful parsing",
+                    error.ChainError.LOOKAHEAD_FAILED)
+                failure.committed = frame.committed
+                return failure
+            _reset_chain(lookahead_chain, pos)
+            after, failed = _try_chain(frame, pos)
+            if after is None:
+                start_from = failed
+                continue
+            if isinstance(after, ParsingFailure):
+                return after
+            frame.state = after
+            try:
+                after = _run_recursively(
+                    self.normal_loop(frame, indexed_parsers, False))
+            except ParsingEnd as end:
+                raise self.prep_end_exception(end, frame)
+            if not isinstance(after, ParsingFailure) or after.committed:
+                return after
+            if frame.lookahead_chain is not lookahead_chain:
+                # A commit point has been reached, only the parsers after it
+                # may be backtracked over.
+                if frame.lookahead_chain is None:
+                    return _committed(after)
+                return self.start_backtracking(frame, indexed_parsers)
+            start_from = len(lookahead_chain) - 1
+
+    def parse(self, frame):
+        """
+        Try to parse the initial state of the frame. Return a ParsingFailure on
+        failure.
+        """
+        indexed_parsers = enumerate(self.parsers)
+        try:
+            after = _run_recursively(
+                self.normal_loop(frame, indexed_parsers, False))
+        except ParsingEnd as end:
+            raise self.prep_end_exception(end, frame)
+        if not isinstance(after, ParsingFailure) or after.committed:
+            return after
+        if frame.lookahead_chain is None or self.stop_on_failure:
+            return self.failed(frame, after)
+        return self.start_backtracking(frame, indexed_parsers)
+
+    def step_chain(self, state):
+        """
+        Parse the state like 'quiet' does, yielding the parsers that have a
+        stepwise form to the caller (see 'get_steps'). Chains with lookahead
+        are parsed as usual.
+        """
+        if self.lookahead is not None:
+            return self.quiet(state)
+        frame = _ChainFrame(state)
+        if _CONTEXT.sink is not None:
+            frame.settled = self.anchored(state)
+        try:
+            after = yield from self.normal_loop(
+                frame, enumerate(self.parsers), True)
+        except ParsingEnd as end:
+            raise self.prep_end_exception(end, frame)
+        if not isinstance(after, ParsingFailure) or after.committed:
+            return after
+        return self.failed(frame, after)
+
+    def failed(self, frame, failure):
+        """
+        Return the outcome of a chain in which a parser has failed, without
+        committing, and there's nothing left to backtrack over.
+        """
+        if frame.committed:
+            return _committed(failure)
+        if self.stop_on_failure:
+            return self.prep_output_state(frame, True)
+        return failure
+
+    def simulate(self, nfa, state):
+        """
+        Parse the state with the automaton compiled from the chain, with the
+        same outcome as backtracking would have. Return a ParsingFailure on
+        failure.
+        """
+        string = state.string
+        start = state.left_start
+        end = state.left_end
+        ends, furthest = nfa.run(string, start, end, len(nfa.nodes))
+        if ends is not None:
+            frame = _ChainFrame(state)
+            frame.state = nfa.replay(state, ends, len(nfa.parsers))
+            return self.prep_output_state(frame, False)
+        # Backtracking reports the state in which the furthest failing parser
+        # was first reached.
+        failed = nfa.completed[furthest]
+        ends, _ = nfa.run(string, start, end, nfa.bounds[failed][0])
+        return ParsingFailure(
+            nfa.replay(state, ends, failed),
+            "No combination of inputs allows successful parsing",
+            error.ChainError.LOOKAHEAD_FAILED)
+
+    def parse_one(self, frame, parser, index):
+        """
+        Parse using a single parser, yielding it to the caller (see
+        'get_steps'). Return the resulting state or a ParsingFailure.
+        """
+        state = frame.state
+        if parser is _COMMIT:
+            frame.commit(index)
+            if frame.settled is not None:
+                frame.flush()
+            return state._replace()
+        lookahead = get_lookahead(parser)
+        if lookahead is not None and frame.lookahead_chain is None:
+            frame.lookahead_chain = []
+        if frame.lookahead_chain is None:
+            frame.num_prelookahead_parsers += 1
+            packrat = _CONTEXT.packrat
+            if packrat is not None:
+                after = yield from _packrat_steps(packrat, parser, state)
+            else:
+                after = yield parser, state
+        else:
+            parser = _restrict(parser, state)
+            frame.lookahead_chain.append(parser)
+            after = yield parser, state
+        if isinstance(after, ParsingFailure):
+            return after
+        if after.effect is not None:
+            frame.record(after, index)
+        return after
 
-    def __setitem__(self, key, value):
-        self.deque[key] = value
-        self.list[key] = value
 
-    def __len__(self):
-        if self.changed:
-            return len(self.deque)
-        return len(self.list)
-
-    def append(self, item):
-        """ Add an element to the right side of the underlying deque. """
-        self.deque.append(item)
-        self.changed = True
-        self.empty = False
-
-    def drop(self, num):
-        """ Drop 'num' elements from the right end. """
-        for _ in range(num):
-            self.deque.pop()
-            self.changed = True
-        try:
-            _ = self.deque[0]
-        except IndexError:
-            self.empty = True
-
-    def extend(self, iterable):
-        """ Append all elements of an iterable. """
-        for item in iterable:
-            self.deque.append(item)
-            self.changed = True
-            self.empty = False
-
-    def find(self, pred):
-        """
-        Return the index of an element such that 'pred(element)' returns True
-        or None if no such element was found.
-        """
-        self.update()
-        for i, val in enumerate(self.deque):
-            if pred(val):
-                return i
-        return None
+class _ChainFrame():
+    """ State of a single run of a chain. """
 
-    def update(self):
-        """ Syncronize the underlying list with the deque. """
-        self.list = list(self.deque)
-        self.changed = False
+    __slots__ = ["budget", "committed", "first_state", "lookahead_chain",
+                 "memo", "num_prelookahead_parsers", "settled", "state",
+                 "tape"]
 
+    def __init__(self, state):
+        # The number of attempts to backtrack left, or None if unlimited.
+        self.budget = None
+        # Whether a commit point has been reached.
+        self.committed = False
+        self.first_state = state
+        self.lookahead_chain = None
+        # Outcomes of the parsers in the lookahead chain during backtracking,
+        # by (position, input window). Restricted parsers are only listed once
+        # they have run out of outcomes on the input, with None.
+        self.memo = None
+        self.num_prelookahead_parsers = 0
+        # Whether the chain is settled, or None if it's not anchored (see
+        # _EffectSink).
+        self.settled = None
+        self.state = state
+        self.tape = None
 
-class _Chain():
+    def commit(self, index):
+        """
+        Commit to the outcomes of the parsers before the 'index'th one, which
+        is a commit point: drop the lookahead chain, so that backtracking never
+        goes back past it.
+        """
+        self.committed = True
+        self.lookahead_chain = None
+        self.memo = None
+        self.num_prelookahead_parsers = index + 1
+        if self.settled is not None:
+            self.settled = True
+
+    def flush(self):
+        """ Apply the recorded effects to the sink, and forget them. """
+        if self.tape is not None:
+            _CONTEXT.sink.apply(self.tape)
+            self.tape = None
+
+    def mark_exhausted(self, last_kept, last_exhausted):
+        """
+        Remember that restricted parsers in the lookahead chain after
+        'last_kept' and up to 'last_exhausted' have run out of outcomes on
+        their current inputs.
+        """
+        lookahead_chain = self.lookahead_chain
+        for i in range(last_kept + 1, last_exhausted + 1):
+            parser = lookahead_chain[i]
+            state = (parser.state_before
+                     if isinstance(parser, _RestrictedParser) else None)
+            if state is not None:
+                self.memo[(i, state.left_start, state.left_end,
+                           state.parsed_start, state.parsed_end)] = None
+
+    def record(self, state, index):
+        """ Record the effect of 'state' made by the 'index'th parser. """
+        if self.tape is None:
+            self.tape = _EffectTape(state.string)
+        self.tape.record(state, index)
+
+
+class _CharNFA():
     """
-    A chain of parsers.
+    A chain of parsers matching runs of characters, compiled to a
+    nondeterministic automaton.
+
+    Parsers describe themselves to the compiler with a 'char_runs' attribute:
+    a tuple of (test, min_hits, max_hits) triples, each standing for a run of
+    characters passing 'test', at least 'min_hits' and, if 'max_hits' is above
+    zero, at most 'max_hits' long. The parser matches the runs one after
+    another, each as long as possible. A parser with lookahead may only have a
+    single run, unless all of its runs have a fixed length.
+
+    Every run becomes a node of the automaton. The automaton is run by
+    simulating all of its threads in lockstep, one input character at a time,
+    keeping at most one thread per node and run length: the one that
+    backtracking would have tried first. This finds the same match that
+    backtracking through the outcomes of the parsers would, but takes time
+    proportional to the length of the input times the number of nodes, and
+    never more than that.
     """
 
-    STATE = "state"
+    __slots__ = ["bounds", "completed", "nodes", "parsers"]
+
+    def __init__(self, parsers, nodes, bounds):
+        self.parsers = parsers
+        # (test, min_hits, max_hits, lookahead) for every run, where lookahead
+        # is None for runs that are never shortened.
+        self.nodes = nodes
+        # The first node of every parser and the one after its last node.
+        self.bounds = bounds
+        # The number of parsers done with by the time a thread reaches a node.
+        self.completed = [sum(1 for _, after in bounds if after <= node)
+                          for node in range(len(nodes) + 1)]
+
+    @staticmethod
+    def compile(parsers):
+        """
+        Return the automaton for a chain of 'parsers', or None if some of them
+        can't be compiled or none of them have lookahead.
+        """
+        nodes = []
+        bounds = []
+        any_lookahead = False
+        for parser in parsers:
+            runs = getattr(parser, "char_runs", None)
+            if runs is None:
+                return None
+            lookahead = get_lookahead(parser)
+            any_lookahead = any_lookahead or lookahead is not None
+            if all(max_hits > 0 and min_hits == max_hits
+                   for _, min_hits, max_hits in runs):
+                # There is only one outcome to try.
+                lookahead = None
+            elif lookahead is not None and len(runs) != 1:
+                return None
+            start = len(nodes)
+            nodes.extend((test, min_hits, max_hits, lookahead)
+                         for test, min_hits, max_hits in runs)
+            bounds.append((start, len(nodes)))
+        if not any_lookahead:
+            return None
+        return _CharNFA(tuple(parsers), tuple(nodes), tuple(bounds))
 
-    def __init__(self, funcs, combine, stop_on_failure, all_or_nothing, save_iterator):
-        self.combine = combine
-        self.stop_on_failure = stop_on_failure
-        self.all_or_nothing = all_or_nothing
-        if save_iterator:
-            self.parsers = iter(funcs)
-            self.saved_parsers = deque()
-        else:
-            self.parsers = funcs
-            self.saved_parsers = None
-        self.effect_points = None
-        self.first_state = None
-        self.lookahead_chain = None
-        self.num_prelookahead_parsers = 0
+    def replay(self, state, ends, num_parsers):
+        """
+        Run the first 'num_parsers' parsers on 'state' in turn, taking the
+        outcome ending where 'ends' (the end positions of the runs) tell for
+        those with lookahead, and return the resulting state.
+        """
+        parsers = self.parsers[:num_parsers]
+        for parser, (first, after) in zip(parsers, self.bounds):
+            if get_lookahead(parser) is None:
+                state = _run_quiet(parser, state)
+                continue
+            end = ends[after - 1] if after > first else state.left_start
+            for outcome in _RestrictedParser(parser, state).enumerate(state):
+                if outcome.left_start == end:
+                    break
+            state = outcome
+        return state
+
+    def run(self, string, start, end, num_nodes):
+        """
+        Match 'string[start:end]' against the first 'num_nodes' nodes. Return
+        a tuple (end positions of the runs, furthest node reached); the end
+        positions are None if there's no match.
+        """
+        nodes = self.nodes
+        reluctant_mode = Lookahead.RELUCTANT
+        furthest = 0
+        matched = False
+        match = None
+        pos = start
+        # Threads are (node, run length, linked end positions of the runs
+        # passed so far), in the order backtracking would try them.
+        seeds = [(0, 0, None)]
+        while seeds:
+            char = string[pos] if pos < end else None
+            threads = []
+            seen = set()
+            stack = seeds[::-1]
+            while stack:
+                thread = stack.pop()
+                node, hits, trail = thread
+                if node < 0:
+                    # A postponed reluctant thread.
+                    threads.append((~node, hits, trail))
+                    continue
+                if node > furthest:
+                    furthest = node
+                if node == num_nodes:
+                    if node not in seen:
+                        seen.add(node)
+                        threads.append(thread)
+                    continue
+                test, min_hits, max_hits, lookahead = nodes[node]
+                key = (node, hits if max_hits > 0 else min(hits, min_hits))
+                if key in seen:
+                    continue
+                seen.add(key)
+                more = (char is not None and (max_hits == 0 or hits < max_hits)
+                        and test(char))
+                if lookahead is reluctant_mode:
+                    if more:
+                        # Only try it after everything leaving the run here.
+                        stack.append((~node, hits, trail))
+                elif more:
+                    threads.append(thread)
+                if hits >= min_hits and (lookahead is not None or not more):
+                    stack.append((node + 1, 0, (pos, trail)))
+            seeds = []
+            for node, hits, trail in threads:
+                if node == num_nodes:
+                    # Threads after this one would be tried later, so are of
+                    # no use.
+                    matched = True
+                    match = trail
+                    break
+                seeds.append((node, hits + 1, trail))
+            pos += 1
+        if not matched:
+            return None, furthest
+        ends = []
+        while match is not None:
+            ends.append(match[0])
+            match = match[1]
+        ends.reverse()
+        return ends, furthest
+
+
+class _Compiled():
+    """ A parser compiled to Python code (see 'compile'). """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.quiet_parser = quiet(parser)
+        self.build()
+        _copy_descriptions(parser, self)
 
     def __call__(self, state):
-        self.reset(state)
-        return self.parse()
+        after = self.quiet(state)
+        if isinstance(after, ParsingFailure):
+            raise after
+        return after
 
-    def prep_output_state(self, state, early):
-        """ Prepare output state: combine 'parsed's and effects. """
-        if early and self.all_or_nothing and not self.stop_on_failure:
-            return self.first_state
-        if self.combine:
-            state = state._replace(parsed_start=self.first_state.left_start)
-        state = state._replace(effect=_chain_effects(self.effect_points))
-        return state
+    def build(self):
+        """ Generate and load the code of the parser. """
+        compiler = _Compiler()
+        # The compiler builds lazy parsers anyway.
+        context = _CONTEXT
+        context.parsing += 1
+        try:
+            self.entry = compiler.compile(self.parser)
+            # Whether the entry rule fails the way the parser itself does,
+            # which it doesn't if the parser is a wrapper.
+            self.exact = (compiler.unwrap(self.parser, False)
+                          is compiler.unwrap(self.parser))
+        finally:
+            context.parsing -= 1
+        self.source = compiler.source
+        self.cells = compiler.cells
+
+    def quiet(self, state):
+        """ Parse the state, returning a ParsingFailure, not raising it. """
+        if _CONTEXT.packrat is not None:
+            return self.quiet_parser(state)
+        string = state.string
+        tape = _EffectTape(string)
+        try:
+            outcome = self.entry(string, state.left_start, state.left_end,
+                                 state.parsed_start, state.parsed_end, tape)
+        except (_CompiledFallback, ParsingEnd):
+            return self.quiet_parser(state)
+        except RecursionError:
+            # Either the input is nested too deep, in which case the parser
+            # itself fails the same way, or some lazy parser has turned out to
+            # be left-recursive, and has to be left to itself from now on.
+            after = self.quiet_parser(state)
+            if any(cell.left_recursive for cell in self.cells):
+                self.build()
+            return after
+        if outcome is None:
+            # Let the parser that has failed report the failure, running it on
+            # the same input again.
+            if not self.exact:
+                return self.quiet_parser(state)
+            parser, left_start, parsed_start, parsed_end = tape.failed
+            state = tuple.__new__(State, (string, None, left_start,
+                                          state.left_end, parsed_start,
+                                          parsed_end))
+            if isinstance(parser, _Branch):
+                # None of the alternatives has succeeded.
+                return parser.all_failed(state)
+            return _run_quiet(parser, state)
+        left_start, parsed_start, parsed_end = outcome
+        return tuple.__new__(State, (string, tape if tape.effects else None,
+                                     left_start, state.left_end, parsed_start,
+                                     parsed_end))
+
+
+class _CompiledFallback(Exception):
+    """
+    Raised by compiled code when the outcome of a run has to be found out by
+    the original parser (see 'compile').
+    """
+
+
+class _Compiler():
+    """
+    The code generator behind 'compile'.
+
+    Every compiled chain, branch and repeat becomes a function (a rule) taking
+    the input string, the 'left' and 'parsed' windows as four positions and an
+    _EffectTape to record effects to. On success, a rule returns a tuple of
+    the new 'left_start', 'parsed_start' and 'parsed_end' (a rule never
+    changes 'left_end'); on failure, it returns None, leaving the tape as it
+    was.
+
+    Parsers inside rules are compiled to steps (see _Step). Besides the
+    combinators, parsers describe themselves to the compiler with the
+    following attributes:
+    * 'literal_string' - the string the parser matches;
+    * 'char_class' - the class of the single character the parser matches
+      (see 'parsers._CharClass');
+    * 'char_many' - a tuple (char_class, min_hits, max_hits, combine) for a
+      'many' over a single-character parser;
+    * 'registered_effect' - the effect registered by an 'effect' parser;
+    * 'optional_parser' - the parser made optional by 'maybe';
+    * 'succeeds_like' - a parser that behaves the same way on success.
+    """
 
-    def prep_end_exception(self, end, state):
+    def __init__(self):
+        # Cells of the lazy parsers compiled to rules.
+        self.cells = []
+        self.constants = {}
+        # Chains being merged into the rule that's being generated.
+        self.inlined = set()
+        self.lines = []
+        self.namespace = {"call": _call_uncompiled}
+        self.num_locals = 0
+        self.pending = []
+        self.rules = {}
+        self.source = None
+
+    def compile(self, parser):
+        """ Compile a parser, returning its entry rule. """
+        entry = self.rule(self.unwrap(parser))
+        while self.pending:
+            name, parser = self.pending.pop()
+            self.generate(name, parser)
+        self.source = "\n".join(self.lines)
+        exec(self.source, self.namespace)
+        return self.namespace[entry]
+
+    def compilable(self, parser):
         """
-        Prepare ParsingEnd exception: attach a prepared output state to it.
+        Return True if a parser without lookahead is compiled to a rule of its
+        own.
         """
-        end.state = self.prep_output_state(state, True)
-        return end
+        if isinstance(parser, _Chain):
+            return (parser.funcs is not None and not parser.stop_on_failure
+                    and not any(inner is _COMMIT for inner in parser.funcs))
+        if isinstance(parser, _Branch):
+            return parser.funcs is not None and not parser.strictly_one
+        return isinstance(parser, _Repeat)
+
+    def constant(self, obj):
+        """ Return the name of an object in the namespace of the code. """
+        key = id(obj)
+        if key not in self.constants:
+            name = f"c{len(self.constants)}"
+            self.constants[key] = (obj, name)
+            self.namespace[name] = obj
+        return self.constants[key][1]
+
+    def failure(self, parser):
+        """
+        Return the lines failing the rule, as 'parser' has failed at the
+        current positions. The lines that run later overwrite the failure, so
+        a failed run of the entry rule leaves the parser that has failed in the
+        first place, which reports the failure (see _Compiled). Lazy parsers
+        fail the way the parsers they build do, so those are given instead.
+        """
+        return [f"fx.failed = ({self.constant(parser)}, pos, ps, pe)",
+                "return None"]
+
+    def generate(self, name, parser):
+        """ Generate the function of a rule. """
+        body = []
+        compilable = get_lookahead(parser) is None and self.compilable(parser)
+        if compilable and isinstance(parser, _Chain):
+            if self.inline_chain(parser, body, False):
+                body.insert(0, "n = len(fx.effects)")
+            body.append("return pos, ps, pe")
+        elif compilable and isinstance(parser, _Branch):
+            self.branch_body(parser, body)
+        elif compilable:
+            self.repeat_body(parser, body)
+        else:
+            step = self.step(parser)
+            body.extend(step.pre)
+            if step.cond is not None:
+                body.append(f"if {_negated(step.cond)}:")
+                body.extend(_indented(self.failure(parser)))
+            body.extend(step.update)
+            body.append("return pos, ps, pe")
+        self.lines.append(f"def {name}(s, pos, end, ps, pe, fx):")
+        self.lines.extend(_indented(body))
+        self.lines.append("")
+
+    def branch_body(self, branch, body):
+        """ Generate the body of a branch's rule. """
+        for parser in branch.funcs:
+            step = self.step(parser)
+            body.extend(step.pre)
+            if step.cond is None:
+                body.extend(step.update)
+                body.append("return pos, ps, pe")
+                return
+            body.append(f"if {step.cond}:")
+            body.extend(_indented(step.update + ["return pos, ps, pe"]))
+        body.extend(self.failure(branch))
+
+    def inline_chain(self, chain, body, recording):
+        """
+        Generate the code of a chain into the body of a rule, merging chains
+        nested into it. 'recording' tells whether the parsers before it in the
+        rule may have recorded effects; return whether they or the chain may
+        have.
+        """
+        start = None
+        if chain.combine:
+            start = f"start{self.num_locals}"
+            self.num_locals += 1
+            body.append(f"{start} = pos")
+        self.inlined.add(id(chain))
+        for original in chain.funcs:
+            parser = self.unwrap(original)
+            # Chains behind wrappers are not merged, as the wrappers may fail
+            # differently.
+            if (isinstance(parser, _Chain) and id(parser) not in self.inlined
+                    and get_lookahead(parser) is None
+                    and self.compilable(parser)
+                    and self.unwrap(original, False) is parser):
+                recording = self.inline_chain(parser, body, recording)
+                continue
+            step = self.step(parser)
+            body.extend(step.pre)
+            if step.cond is not None:
+                body.append(f"if {_negated(step.cond)}:")
+                if recording:
+                    body.append("    fx.truncate(n)")
+                # A chain fails the way the parser has.
+                body.extend(_indented(
+                    self.failure(self.unwrap(original, False))))
+            body.extend(step.update)
+            recording = recording or step.records
+        self.inlined.discard(id(chain))
+        if start is not None:
+            body.append(f"ps = {start}")
+        return recording
+
+    def repeat_body(self, repeat, body):
+        """ Generate the body of a repeat's rule. """
+        min_hits = repeat.min_hits
+        max_hits = repeat.max_hits
+        step = self.step(repeat.parser)
+        if min_hits > 0 and step.records:
+            body.append("n = len(fx.effects)")
+        body.append("start = pos")
+        body.append("hits = 0")
+        body.append("while True:" if max_hits == 0
+                    else f"while hits < {max_hits}:")
+        loop = list(step.pre)
+        if step.cond is not None:
+            loop.extend([f"if {_negated(step.cond)}:", "    break"])
+        if max_hits == 0:
+            loop.append("old = pos")
+        loop.extend(step.update)
+        loop.append("hits += 1")
+        if max_hits == 0:
+            # Running the parser again would change nothing.
+            stuck = ("pos == old" if min_hits == 0
+                     else f"pos == old and hits >= {min_hits}")
+            loop.extend([f"if {stuck}:", "    break"])
+        body.extend(_indented(loop))
+        if min_hits > 0:
+            body.append(f"if hits < {min_hits}:")
+            if step.records:
+                body.append("    fx.truncate(n)")
+            # A repeat fails the way the parser has on its last run.
+            body.extend(_indented(
+                self.failure(self.unwrap(repeat.parser, False))))
+        if repeat.combine:
+            body.append("ps = start")
+        body.append("return pos, ps, pe")
+
+    def rule(self, parser):
+        """
+        Return the name of the rule a parser is compiled to, generating it
+        later if it's new.
+        """
+        key = id(parser)
+        if key not in self.rules:
+            name = f"rule{len(self.rules)}"
+            self.rules[key] = (parser, name)
+            self.pending.append((name, parser))
+        return self.rules[key][1]
+
+    def step(self, parser):
+        """ Return the step a parser is compiled to. """
+        parser = self.unwrap(parser)
+        if get_lookahead(parser) is not None:
+            return self.uncompiled(parser)
+        lit = getattr(parser, "literal_string", None)
+        if lit is not None:
+            if not lit:
+                return _Step([], None, ["ps = pe = pos"], False)
+            return _Step([], f"s.startswith({lit!r}, pos, end)",
+                         ["ps = pos", f"pe = pos = pos + {len(lit)}"], False)
+        char_class = getattr(parser, "char_class", None)
+        if char_class is not None:
+            test = self.constant(char_class.test)
+            return _Step([], f"pos < end and {test}(s[pos])",
+                         ["ps = pos", "pe = pos = pos + 1"], False)
+        char_many = getattr(parser, "char_many", None)
+        if char_many is not None:
+            return self.char_many_step(*char_many)
+        eff = getattr(parser, "registered_effect", None)
+        if eff is not None:
+            record = f"fx.append({self.constant(eff)}, pos, end, ps, pe)"
+            return _Step([], None, [record], True)
+        optional = getattr(parser, "optional_parser", None)
+        if optional is not None:
+            step = self.step(optional)
+            if step.cond is None:
+                return step
+            update = ([f"if {step.cond}:"] + _indented(step.update)
+                      + ["else:", "    ps = pe = pos"])
+            return _Step(step.pre, None, update, step.records)
+        if self.compilable(parser):
+            return _Step([f"r = {self.rule(parser)}(s, pos, end, ps, pe, fx)"],
+                         "r is not None", ["pos, ps, pe = r"], True)
+        return self.uncompiled(parser)
+
+    def char_many_step(self, char_class, min_hits, max_hits, combine):
+        """ Return the step of a 'many' over a single-character parser. """
+        pre = []
+        limit = "end"
+        if max_hits > 0:
+            pre.append(f"limit = min(end, pos + {max_hits})")
+            limit = "limit"
+        if char_class.run is not None:
+            run = self.constant(char_class.run)
+            pre.append(f"q = {run}(s, pos, {limit}).end()")
+        else:
+            test = self.constant(char_class.test)
+            pre.extend(["q = pos",
+                        f"while q < {limit} and {test}(s[q]):",
+                        "    q += 1"])
+        cond = None if min_hits == 0 else f"q - pos >= {min_hits}"
+        if combine:
+            update = ["if q != pos:", "    pe = q", "ps = pos", "pos = q"]
+        else:
+            update = ["if q != pos:", "    ps = q - 1", "    pe = pos = q"]
+        return _Step(pre, cond, update, False)
 
-    def reset(self, state):
-        """ Reset the state of the chain. """
-        self.effect_points = _CachedAppender()
-        self.first_state = state
-        self.lookahead_chain = None
-        self.num_prelookahead_parsers = 0
+    def uncompiled(self, parser):
+        """ Return the step running a parser as usual. """
+        quiet_parser = self.constant(quiet(parser))
+        return _Step([f"r = call({quiet_parser}, s, pos, end, ps, pe, fx)"],
+                     "r is not None", ["pos, ps, pe = r"], True)
+
+    def unwrap(self, parser, wrappers=True):
+        """
+        Return the parser to compile in place of a parser: the parser built by
+        a lazy one, or the one a wrapper behaves like on success, unless
+        'wrappers' is false.
+        """
+        seen = set()
+        while id(parser) not in seen:
+            seen.add(id(parser))
+            inner = getattr(parser, "succeeds_like", None)
+            if inner is not None:
+                if not wrappers:
+                    break
+                parser = inner
+                continue
+            if not isinstance(parser, _Lazy) or parser.cell is None:
+                break
+            cell = parser.cell
+            if cell.left_recursive:
+                break
+            inner = parser.build()
+            if cell not in self.cells:
+                self.cells.append(cell)
+            parser = inner
+        return parser
+
+
+class _Dispatch():
+    """
+    A table of the parsers of a branch (or of their scanning forms) worth
+    trying on every next character of the input: those that can match it
+    according to their 'first_chars' (see 'get_first_chars'), in their
+    original order. The entry for a Latin-1 character (or the end of input) is
+    made when it is first met; the items for other characters are selected
+    anew every time, so that the table stays small whatever the input.
+    """
+
+    __slots__ = ["items", "table", "tests"]
 
-    def indexed_parsers(self):
-        """ Return an iterator of (index, parser) in the chain. """
-        if self.saved_parsers is None:
-            return enumerate(self.parsers)
-        # deques' iterators throw if the deque is modified during traversal.
-        # Hence, copy
-        saved = self.saved_parsers.copy()
-        return enumerate(it.chain(saved, self.parsers))
+    def __init__(self, items, tests):
+        self.items = items
+        # None for the parsers that have to be tried on any character.
+        self.tests = tests
+        # Items to try, by the code of the next character, or at the end of
+        # input after them, or None if not selected yet.
+        self.table = [None] * (_DISPATCHED_CHARS + 1)
 
-    def maybe_save(self, index, num_saved, parser):
+    @staticmethod
+    def build(parsers):
         """
-        Save the parser if it wasn't yet saved and if the chain is configured
-        to save parsers.
+        Return the table for a branch of 'parsers', or None if none of them can
+        be skipped.
+        """
+        tests = []
+        for parser in parsers:
+            first_chars = get_first_chars(parser)
+            if first_chars is None or first_chars[1]:
+                tests.append(None)
+            else:
+                tests.append(first_chars[0])
+        if all(test is None for test in tests):
+            return None
+        return _Dispatch(parsers, tuple(tests))
 
-        Return True if the parser was saved, False otherwise.
+    def over(self, items):
         """
-        if num_saved >= 0 and index >= num_saved:
-            self.saved_parsers.append(parser)
-            return True
-        return False
+        Return a table with the same tests, selecting among 'items' instead.
+        """
+        return _Dispatch(items, self.tests)
+
+    def select(self, state):
+        """ Return a tuple of items to try on a State (or a cursor). """
+        pos = state.left_start
+        if pos < state.left_end:
+            char = state.string[pos]
+            code = ord(char)
+            if code >= _DISPATCHED_CHARS:
+                return self.choose(char)
+        else:
+            char = None
+            code = _DISPATCHED_CHARS
+        chosen = self.table[code]
+        if chosen is None:
+            chosen = self.table[code] = self.choose(char)
+        return chosen
+
+    def choose(self, char):
+        """
+        Return a tuple of items to try on a character, or at the end of input
+        if 'char' is None.
+        """
+        if char is None:
+            return tuple(item for item, test in zip(self.items, self.tests)
+                         if test is None)
+        return tuple(item for item, test in zip(self.items, self.tests)
+                     if test is None or test(char))
+
+
+class _EffectSink():
+    """
+    The value an eager 'parse' call applies effects to as soon as nothing can
+    undo them.
+
+    To find out when that is, combinators tell the parsers they run whether
+    they are anchored or settled, via the context. A parser is anchored if,
+    once it succeeds or stops parsing, its effects are sure to be applied or
+    the whole parse fails; it is settled if, in addition, its own failure
+    fails the whole parse. The parser run by 'parse' is settled. Branches and
+    lazy parsers that are anchored anchor the parsers they run whenever their
+    results can't be undone by the combinator itself. Chains and repeats don't,
+    as they drop the effects of a parser that stops parsing. Instead, anchored
+    chains that are not all-or-nothing apply their effects at commit points,
+    and anchored repeats - their effects of completed iterations, as soon as
+    they can't fail (or their failure would fail the parse).
+    """
+
+    __slots__ = ["value"]
+
+    def __init__(self, value):
+        self.value = value
+
+    def apply(self, eff):
+        """ Apply an effect tape to the value. """
+        self.value = eff(self.value)
 
-    def drop_retried_parser(self, did_save, pos):
+
+class _EffectTape():
+    """
+    A flat record of effects registered by parsers in a chain (or a repeat),
+    in order. For every effect it keeps the callable, the windows of the State
+    it was registered with and the index of the parser that registered it.
+
+    A tape is an effect itself: calling it applies recorded effects in turn.
+    Effects of smaller nested tapes are copied into the tape; larger ones are
+    referred to instead, and all are replayed in a single iterative pass.
+    """
+
+    # 'failed' is only set by compiled code (see _Compiler) when it fails.
+    __slots__ = ["effects", "failed", "indices", "string", "strings",
+                 "windows"]
+
+    # Tapes with at most this many effects are copied into enclosing tapes.
+    SPLICE_LIMIT = 32
+
+    def __init__(self, string):
+        self.effects = []
+        self.indices = array("q")
+        self.string = string
+        # Strings of the recorded States, by position, where they differ from
+        # 'string'.
+        self.strings = None
+        self.windows = array("q")
+
+    def __call__(self, value, state=None):
+        new_state = tuple.__new__
+        stack = [(self, 0)]
+        while stack:
+            tape, start = stack.pop()
+            effects = tape.effects
+            windows = tape.windows
+            string = tape.string
+            strings = tape.strings
+            for i in range(start, len(effects)):
+                eff = effects[i]
+                if type(eff) is _EffectTape:
+                    stack.append((tape, i + 1))
+                    stack.append((eff, 0))
+                    break
+                if strings is not None:
+                    string = strings.get(i, tape.string)
+                w = 4 * i
+                value = eff(value, new_state(State, (
+                    string, eff, windows[w], windows[w + 1], windows[w + 2],
+                    windows[w + 3])))
+        return value
+
+    def __len__(self):
+        return len(self.effects)
+
+    def append(self, eff, left_start, left_end, parsed_start, parsed_end):
         """
-        Drop the retried parser from saved parsers. Also drop its effect, if
-        any.
+        Record an effect registered with a State of the tape's string with the
+        given windows, made by a parser after all the others.
         """
-        if did_save:
-            self.saved_parsers.pop()
-        drop_effects_after = self.effect_points.find(lambda point: point[1] >= pos)
-        if drop_effects_after is not None:
-            self.effect_points.drop(len(self.effect_points) - drop_effects_after)
+        self.effects.append(eff)
+        self.windows.extend((left_start, left_end, parsed_start, parsed_end))
+        self.indices.append(len(self.indices))
+
+    def record(self, state, index):
+        """ Record the effect of 'state', made by 'index'th parser. """
+        eff = state.effect
+        if (type(eff) is _EffectTape and eff.string is self.string
+                and eff.strings is None
+                and len(eff.effects) <= self.SPLICE_LIMIT):
+            self.effects.extend(eff.effects)
+            self.windows.extend(eff.windows)
+            self.indices.extend(it.repeat(index, len(eff.effects)))
+            return
+        if state.string is not self.string:
+            if self.strings is None:
+                self.strings = {}
+            self.strings[len(self.effects)] = state.string
+        self.effects.append(eff)
+        self.windows.extend((state.left_start, state.left_end,
+                             state.parsed_start, state.parsed_end))
+        self.indices.append(index)
+
+    def truncate(self, index):
+        """ Drop the effects made by parsers at 'index' and after it. """
+        keep = bisect_left(self.indices, index)
+        if keep == len(self.effects):
+            return
+        del self.effects[keep:]
+        del self.indices[keep:]
+        del self.windows[4 * keep:]
+        if self.strings is not None:
+            for pos in [pos for pos in self.strings if pos >= keep]:
+                del self.strings[pos]
+
+
+class _GrammarPickler(pickle.Pickler):
+    """
+    A pickler saving parsers that remember the calls that have built them as
+    these calls (see 'dumps').
+    """
 
-    def normal_loop(self, state_wrapper, indexed_parsers):
-        """ Normal parsing routine - just chain the parsers. """
-        num_saved = -1 if self.saved_parsers is None else len(self.saved_parsers)
-        for i, parser in indexed_parsers:
-            did_save = self.maybe_save(i, num_saved, parser)
-            state_wrapper[self.STATE] = self.parse_one(
-                state_wrapper[self.STATE], parser, i, did_save)
-        return self.prep_output_state(state_wrapper[self.STATE], False)
+    def reducer_override(self, obj):
+        if isinstance(obj, type):
+            return NotImplemented
+        recipe = getattr(obj, "recipe", None)
+        if recipe is None:
+            return NotImplemented
+        if recipe[0] in (branch, chain) and obj.funcs is None:
+            # The iterator may have been advanced by running the parser.
+            raise pickle.PicklingError(
+                "Can't pickle chains and branches over one-shot iterators")
+        return _rebuild, recipe
 
-    def start_backtracking(self, state_wrapper, indexed_parsers):
-        """ Start backtracking, then continue with normal parsing. """
-        start_from = len(self.lookahead_chain) - 1
-        while True:
-            pos = _shift(self.lookahead_chain, start_from)
-            if pos is None:
-                raise ParsingFailure(
-                    state_wrapper[self.STATE],
-                    "No combination of inputs allows successful parsing",
-                    error.ChainError.LOOKAHEAD_FAILED)
-            _reset_chain(self.lookahead_chain, pos)
-            pre = self.num_prelookahead_parsers
-            after, failed = _try_chain(self.lookahead_chain, pos, pre, self.effect_points)
-            if after is None:
-                start_from = failed
-                continue
-            state_wrapper[self.STATE] = after
-            try:
-                return self.normal_loop(state_wrapper, indexed_parsers)
-            except ParsingEnd as end:
-                raise self.prep_end_exception(end, state_wrapper[self.STATE])
-            except ParsingFailure:
-                start_from = len(self.lookahead_chain) - 1
-                continue
 
-    def parse(self):
-        """ Try to parse the initial state. """
-        try:
-            indexed_parsers = self.indexed_parsers()
-            state_wrapper = {self.STATE: self.first_state}
-            return self.normal_loop(state_wrapper, indexed_parsers)
-        except ParsingEnd as end:
-            raise self.prep_end_exception(end, state_wrapper[self.STATE])
-        except ParsingFailure as failure:
-            if self.stop_on_failure:
-                return self.prep_output_state(state_wrapper[self.STATE], True)
-            if self.lookahead_chain is None:
-                raise failure
-            return self.start_backtracking(state_wrapper, indexed_parsers)
-
-    def parse_one(self, state, parser, index, did_save):
-        """ Parse using a single parser. Return the resulting state. """
-        while True:
-            parser_has_lookahead = has_lookahead(parser)
-            if no_lookahead(self) and parser_has_lookahead:
-                copy_lookahead(parser, self)
-                raise _GainedLookahead
-            if self.lookahead_chain is None and parser_has_lookahead:
-                self.lookahead_chain = _CachedAppender()
-            if self.lookahead_chain is None:
-                self.num_prelookahead_parsers += 1
-            else:
-                parser = _restrict(parser, state)
-                self.lookahead_chain.append(parser)
+class _Iterative():
+    """ A parser run with an explicit stack (see 'iterative'). """
+
+    def __init__(self, parser):
+        self.parser = parser
+        _copy_descriptions(parser, self)
+
+    def __call__(self, state):
+        after = self.quiet(state)
+        if isinstance(after, ParsingFailure):
+            raise after
+        return after
+
+    @property
+    def lookahead(self):
+        """ Lookahead mode of the parser. """
+        return get_lookahead(self.parser)
+
+    def quiet(self, state):
+        """ Parse the state, returning a ParsingFailure, not raising it. """
+        parser = self.parser
+        context = _CONTEXT
+        steps = get_steps(parser)
+        if context.sink is None:
+            if steps is None:
+                return _run_quiet(parser, state)
+            # Input that isn't nested too deep is parsed faster as usual, and
+            # no effects are applied until the parsing is over.
             try:
-                after = parser(state)
-            except _GainedLookahead:
-                if no_lookahead(self):
-                    copy_lookahead(parser, self)
-                    raise
-                self.drop_retried_parser(did_save, index)
-                continue
-            if after.effect is not None:
-                self.effect_points.append((after, index))
-            return after
+                return _run_quiet(parser, state)
+            except RecursionError:
+                return _run_stepwise(steps, state)
+        settled = _anchored(self, state)
+        if settled is not None:
+            context.anchor = (parser, state, settled)
+        if steps is None:
+            after = _run_quiet(parser, state)
+        else:
+            after = _run_stepwise(steps, state)
+        if settled is not None:
+            context.anchor = None
+        return after
 
 
 class _Lazy():
     """ A lazy parser generator. """
 
-    def __init__(self, generator, args, kwargs):
+    def __init__(self, generator, args, kwargs, cell):
         self.generator = generator
         self.args = args
         self.kwargs = kwargs
-        self.saved_parser = None
+        self.cell = cell
+        # Whether the parser has turned out to be left-recursive, if it's not
+        # cached (otherwise the cell tells).
+        self.left_recursive = False
+        self.lookahead_mode = _UNRESOLVED
 
     def __call__(self, state):
-        if self.saved_parser is not None:
-            p = self.saved_parser
-            self.saved_parser = None
-            return p(state)
-        p = self.generator(*self.args, **self.kwargs)
+        after = self.quiet(state)
+        if isinstance(after, ParsingFailure):
+            raise after
+        return after
+
+    def quiet(self, state):
+        """ Parse the state, returning a ParsingFailure, not raising it. """
+        return _run_recursively(self.step_lazy(state))
+
+    @property
+    def steps(self):
+        """ Stepwise form of the lazy parser. """
+        return self.step_lazy
+
+    def step_lazy(self, state):
+        """
+        Parse the state like 'quiet' does, yielding the generated parser to the
+        caller (see 'get_steps').
+        """
+        context = _CONTEXT
+        rule = self if self.cell is None else self.cell
+        seeds = context.seeds
+        outer = seeds.get(rule)
+        if outer is not None and outer.matches(state):
+            return self.recurse(outer, state)
+        seed = _Seed(state)
+        seeds[rule] = seed
+        try:
+            return (yield from self.grow(context, rule, seed, state))
+        finally:
+            if outer is None:
+                del seeds[rule]
+            else:
+                seeds[rule] = outer
+
+    def recurse(self, seed, state):
+        """
+        Return the outcome of a left-recursive run on the input of 'seed': the
+        outcome grown so far, or a failure if there's none yet.
+        """
+        seed.recursive = True
+        if seed.outcome is None:
+            return ParsingFailure(
+                state,
+                "Left recursion without a successful outcome",
+                error.LazyError.LEFT_RECURSION)
+        return seed.outcome
+
+    def grow(self, context, rule, seed, state):
+        """
+        Parse the state with the generated parser, yielding it to the caller
+        (see 'get_steps'). If it turns out to be left-recursive, parse it again
+        and again, each time with the outcome of the previous run as the
+        outcome of the recursive reference, as long as the outcome grows.
+        """
+        parser = self.build()
+        packrat = context.packrat
+        if rule.left_recursive:
+            # The outcomes of the parsers inside depend on the seed and can't
+            # be remembered.
+            context.packrat = None
+        try:
+            settled = None if context.sink is None else _anchored(self, state)
+            if settled is None:
+                after = yield parser, state
+            else:
+                after = yield from _anchored_steps(parser, state, settled)
+            if not seed.recursive:
+                return after
+            if packrat is not None and not rule.left_recursive:
+                # Some of the remembered outcomes depend on the seed.
+                packrat.clear()
+            rule.left_recursive = True
+            context.packrat = None
+            while not isinstance(after, ParsingFailure):
+                if (seed.outcome is not None
+                        and after.left_start <= seed.outcome.left_start):
+                    break
+                seed.outcome = after
+                after = yield parser, state
+        finally:
+            context.packrat = packrat
+        if seed.outcome is None:
+            return after
+        return seed.outcome
+
+    def build(self):
+        """
+        Return the parser built by the generator, calling it only if there's
+        no saved one.
+        """
+        cell = self.cell
+        if cell is None:
+            return self.generator(*self.args, **self.kwargs)
+        parser = cell.parser
+        if parser is None:
+            # Concurrent builds are harmless: all of them are usable, and
+            # only one is kept.
+            building = _CONTEXT.building
+            nested = cell in building
+            building.add(cell)
+            try:
+                parser = self.generator(*self.args, **self.kwargs)
+            finally:
+                if not nested:
+                    building.discard(cell)
+                _forget_provisional_scans(_CONTEXT, _BUILDING)
+            cell.parser = parser
+        return parser
+
+    @property
+    def lookahead(self):
+        """
+        Lookahead mode of the generated parser. The generator isn't called to
+        find it out before the first parse; until then, the lazy parser counts
+        as having no lookahead, and so do the combinators over it, without
+        saving it. A recursive reference met while working the mode out counts
+        as having the mode assumed so far, starting with none, until the
+        assumption holds.
+        """
+        if self.lookahead_mode is not _UNRESOLVED:
+            return self.lookahead_mode
+        context = _CONTEXT
+        if self.unbuilt(context):
+            if context.assumed_modes is not None:
+                context.assumed_modes.add(_DEFERRED)
+            return None
+        mode, settled = _resolve_lookahead(id(self.generator),
+                                           lambda: get_lookahead(self.build()))
+        if settled:
+            self.lookahead_mode = mode
+        return mode
+
+    def unbuilt(self, context):
+        """
+        Return True if the parser is yet to be built and no parse is in
+        progress to build it.
+        """
+        return not context.parsing and (self.cell is None
+                                        or self.cell.parser is None)
+
+    @property
+    def recipe(self):
+        """ The call that has built the parser (see 'dumps'). """
+        constructor = lazy if self.cell is not None else uncached_lazy
+        return constructor, (self.generator, *self.args), self.kwargs
+
+    @property
+    def scan_cursor(self):
+        """
+        Cursor-scanning form of the generated parser. Uncached lazy parsers
+        don't have one.
+        """
+        cell = self.cell
+        if cell is None:
+            return None
+        scan = cell.scan_mode
+        if scan is _UNRESOLVED:
+            scan = self.resolve_scan()
+        return None if scan is None else self.scan_lazy
+
+    def resolve_scan(self):
+        """
+        Find out the scanning form of the generated parser. A recursive
+        reference met while doing so is assumed to have one; the form is saved
+        unless it relies on such assumptions made by enclosing parsers.
+        """
+        cell = self.cell
+        context = _CONTEXT
+        if cell in context.building:
+            # Wrappers made by the generator can't have a scanning form that
+            # relies on the parser it's making.
+            context.lowest_assumption = _BUILDING
+            return _UNRESOLVED
+        if self.unbuilt(context):
+            # Neither can wrappers made before the first parse.
+            context.lowest_assumption = _DEFERRED
+            return _UNRESOLVED
+        scan, final = _resolve_scan(lambda: _get_scan(self.build()), cell)
+        if final:
+            cell.scan_mode = scan
+        return scan
+
+    def scan_lazy(self, cursor):
+        """
+        Scan the cursor with the generated parser, growing the seed of left
+        recursion like 'grow' does.
+        """
+        scan = self.cell.scan_mode
+        if scan is _UNRESOLVED:
+            scan = self.resolve_scan()
+        rule = self.cell
+        seeds = _CONTEXT.seeds
+        outer = seeds.get(rule)
+        if outer is not None and outer.matches(cursor):
+            outer.recursive = True
+            if outer.outcome is None:
+                return False
+            cursor.load(outer.outcome)
+            return True
+        seed = _Seed(cursor)
+        seeds[rule] = seed
         try:
-            return p(state)
-        except _GainedLookahead:
-            self.saved_parser = p
-            raise
+            start = cursor.state()
+            success = scan(cursor)
+            if not seed.recursive:
+                return success
+            rule.left_recursive = True
+            while success:
+                if (seed.outcome is not None
+                        and cursor.left_start <= seed.outcome.left_start):
+                    break
+                seed.outcome = cursor.state()
+                cursor.load(start)
+                success = scan(cursor)
+            if seed.outcome is None:
+                return False
+            cursor.load(seed.outcome)
+            return True
+        finally:
+            if outer is None:
+                del seeds[rule]
+            else:
+                seeds[rule] = outer
+
+
+class _Repeat():
+    """ A parser running another parser repeatedly. """
+
+    def __init__(self, parser, min_hits, max_hits, combine):
+        self.parser = parser
+        self.min_hits = min_hits
+        self.max_hits = max_hits
+        self.combine = combine
+        self.scan = _UNRESOLVED
+
+    def __call__(self, state):
+        after = self.quiet(state)
+        if isinstance(after, ParsingFailure):
+            raise after
+        return after
+
+    @property
+    def first_chars(self):
+        """
+        Characters the repeat's match may start with, if the parser describes
+        them (see 'get_first_chars').
+        """
+        first_chars = get_first_chars(self.parser)
+        if first_chars is None:
+            return None
+        test, nullable = first_chars
+        return test, nullable or self.min_hits == 0
+
+    @property
+    def lookahead(self):
+        """ Lookahead mode of the repeated parser. """
+        return get_lookahead(self.parser)
+
+    @property
+    def scan_cursor(self):
+        """ Cursor-scanning form of the repeat, if the parser has one. """
+        scan = self.scan
+        if scan is _UNRESOLVED:
+            scan, final = _resolve_scan(lambda: _get_scan(self.parser))
+            if final:
+                self.scan = scan
+        return None if scan is None else self.scan_repeat
+
+    @property
+    def steps(self):
+        """ Stepwise form of the repeat, if the parser has one. """
+        return None if get_steps(self.parser) is None else self.step_repeat
+
+    def scan_repeat(self, cursor):
+        """ Scan the cursor with the parser repeatedly. """
+        scan = self.scan
+        if scan is _UNRESOLVED:
+            scan = _get_scan(self.parser)
+        min_hits = self.min_hits
+        max_hits = self.max_hits
+        start = cursor.left_start
+        hits = 0
+        while max_hits == 0 or hits < max_hits:
+            left_start = cursor.left_start
+            parsed_start = cursor.parsed_start
+            parsed_end = cursor.parsed_end
+            if not scan(cursor):
+                if hits < min_hits:
+                    return False
+                cursor.left_start = left_start
+                cursor.parsed_start = parsed_start
+                cursor.parsed_end = parsed_end
+                break
+            hits += 1
+            if (max_hits == 0 and hits >= min_hits
+                    and cursor.left_start == left_start):
+                break
+        if self.combine:
+            cursor.parsed_start = start
+        return True
+
+    def prep_output_state(self, first_state, state, hits, tape):
+        """ Prepare output state: combine 'parsed's and effects. """
+        if hits == 0:
+            state = first_state
+        if self.combine:
+            return state._replace(effect=tape,
+                                  parsed_start=first_state.left_start)
+        return state._replace(effect=tape)
+
+    def quiet(self, state):
+        """ Parse the state, returning a ParsingFailure, not raising it. """
+        if _CONTEXT.packrat is None and self.scan_cursor is not None:
+            cursor = _Cursor(state)
+            if self.scan_repeat(cursor):
+                return cursor.state()
+            # Run the parser normally to find out how exactly it fails.
+        return _run_recursively(self.repeat(state))
+
+    def step_repeat(self, state):
+        """
+        Parse the state like 'quiet' does, yielding the parser to the caller
+        (see 'get_steps'). Repeats with lookahead are parsed as usual.
+        """
+        if self.lookahead is not None:
+            return self.quiet(state)
+        return (yield from self.repeat(state))
+
+    def repeat(self, state):
+        """
+        Run the parser on the state repeatedly, yielding it to the caller (see
+        'get_steps'), and return the outcome.
+        """
+        parser = self.parser
+        packrat = _CONTEXT.packrat
+        min_hits = self.min_hits
+        max_hits = self.max_hits
+        settled = None if _CONTEXT.sink is None else _anchored(self, state)
+        tape = None
+        hits = 0
+        current = state
+        while max_hits == 0 or hits < max_hits:
+            try:
+                if packrat is not None:
+                    after = yield from _packrat_steps(packrat, parser, current)
+                else:
+                    if (tape is not None and settled is not None
+                            and (settled or hits >= min_hits)):
+                        # Completed iterations can't be undone anymore.
+                        _CONTEXT.sink.apply(tape)
+                        tape = None
+                    after = yield parser, current
+            except ParsingEnd as end:
+                end.state = self.prep_output_state(state, current, hits, tape)
+                raise end
+            if isinstance(after, ParsingFailure):
+                if hits < min_hits or after.committed:
+                    return after
+                break
+            hits += 1
+            if after.effect is not None:
+                if tape is None:
+                    tape = _EffectTape(after.string)
+                tape.record(after, hits)
+            if (max_hits == 0 and hits >= min_hits
+                    and after.left_start == current.left_start):
+                current = after
+                break
+            current = after
+        return self.prep_output_state(state, current, hits, tape)
 
 
 class _RestrictedParser():
-    """ A parser that only operates on a restricted portion of input. """
+    """
+    A parser with lookahead, run on portions of input of different lengths.
+    Only the distinct outcomes it has on them are tried, one at a time, from
+    the longest portion to the shortest for greedy parsers and the other way
+    around for reluctant ones.
+
+    Branches that aren't strict only restrict the alternatives that have
+    lookahead (see _Branch.restricted_outcomes). Other parsers may enumerate
+    their outcomes themselves, providing a 'match_ends' method. It takes a
+    State and a flag telling to go from the longest portion of input, and
+    returns an iterator over the distinct states the parser would produce on
+    the portions of the State's input, with 'left_end' restored, in that
+    order. Otherwise, the parser is run on every portion.
+    """
 
     def __init__(self, parser, state):
         self.parser = parser
         self.lookahead = get_lookahead(parser)
-        self.delta = 0
         self.state_before = state
+        self.outcomes = None
+        self.outcome = None
 
     def __call__(self, state):
-        self.state_before = state
-        if self.lookahead is None:
-            return self.parser(state)
-        if self.lookahead is Lookahead.GREEDY:
-            return _partial_parse(state, self.parser, state.left_len - self.delta)
-        # is reluctant
-        return _partial_parse(state, self.parser, self.delta)
+        after = self.quiet(state)
+        if isinstance(after, ParsingFailure):
+            raise after
+        return after
+
+    def quiet(self, state):
+        """ Parse the state, returning a ParsingFailure, not raising it. """
+        if self.outcomes is None or state is not self.state_before:
+            self.state_before = state
+            self.outcomes = self.enumerate(state)
+            self.outcome = next(self.outcomes, None)
+        if self.outcome is not None:
+            return self.outcome
+        after = _run_quiet(self.parser, state)
+        if isinstance(after, ParsingFailure):
+            return after
+        return ParsingFailure(
+            state,
+            "No portion of input allows the parser to succeed",
+            error.ChainError.LOOKAHEAD_FAILED)
+
+    def enumerate(self, state):
+        """ Yield the distinct outcomes of the parser, in the order to try. """
+        if isinstance(self.parser, _Branch) and not self.parser.strictly_one:
+            yield from self.parser.restricted_outcomes(state)
+            return
+        greedy_mode = self.lookahead is Lookahead.GREEDY
+        match_ends = getattr(self.parser, "match_ends", None)
+        if match_ends is not None:
+            yield from match_ends(state, greedy_mode)
+            return
+        length = state.left_end - state.left_start
+        if greedy_mode:
+            portions = range(length, -1, -1)
+        else:
+            portions = range(length + 1)
+        previous = None
+        for at in portions:
+            after = _partial_parse(state, self.parser, at)
+            if isinstance(after, ParsingFailure):
+                continue
+            # The rest of the chain would only repeat what it did with the
+            # previous outcome.
+            if after.effect is None and after == previous:
+                continue
+            previous = after
+            yield after
 
     def overrestricted(self):
-        """
-        Return True if restrictions have reached their maximum - that is, if
-        either allowed input portion is shrinked into an empty string, or has
-        extended beyond the bounds of leftover input.
-        """
-        return self.delta > self.state_before.left_end - self.state_before.left_start
+        """ Return True if all outcomes of the parser have been tried. """
+        return self.outcome is None
 
     def reset(self):
         """ Reset restrictions. """
-        self.delta = 0
+        self.outcomes = None
+        self.outcome = None
         self.state_before = None
 
     def restrict_more(self):
-        """ Increase restriction level on the input. """
-        self.delta += 1
+        """ Move on to the next outcome. """
+        self.outcome = next(self.outcomes, None)
+
+
+class _ReusableIterator():
+    """ An iterable calling a generator for an iterator (see 'reuse_iter'). """
+
+    def __init__(self, generator, args, kwargs):
+        self.generator = generator
+        self.args = args
+        self.kwargs = kwargs
+
+    def __iter__(self):
+        return self.generator(*self.args, **self.kwargs)
+
+
+class _SavingIterable():
+    """
+    An iterable that saves the elements of another one as they are produced,
+    so that it can be iterated over several times, also concurrently or while
+    it's already being iterated over.
+    """
+
+    def __init__(self, iterable, on_exhausted=None):
+        self.source = iter(iterable)
+        self.saved = []
+        self.exhausted = False
+        self.lock = threading.Lock()
+        # Called with the tuple of all the elements once they are saved.
+        self.on_exhausted = on_exhausted
+
+    def __iter__(self):
+        if self.exhausted:
+            return iter(self.saved)
+        return self.replay()
+
+    def replay(self):
+        """ Yield the saved elements, pulling more of them as needed. """
+        saved = self.saved
+        i = 0
+        while True:
+            if i < len(saved):
+                yield saved[i]
+                i += 1
+                continue
+            with self.lock:
+                if self.exhausted:
+                    return
+                if i == len(saved):
+                    try:
+                        saved.append(next(self.source))
+                    except StopIteration:
+                        self.saved = tuple(saved)
+                        self.source = None
+                        self.exhausted = True
+                        if self.on_exhausted is not None:
+                            self.on_exhausted(self.saved)
+                        return
+
+
+class _Seed():
+    """
+    A run of a lazy parser in progress, on the input given by the 'left' window
+    of a State (or a cursor). If the parser is run on the same input again,
+    that is if it's left-recursive, it's given the outcome grown so far instead
+    of being run: a State (None if there's none yet, which is a failure).
+    """
+
+    __slots__ = ["left_end", "left_start", "outcome", "recursive", "string"]
+
+    def __init__(self, state):
+        self.left_end = state.left_end
+        self.left_start = state.left_start
+        self.outcome = None
+        # Whether the parser has been run on the same input again.
+        self.recursive = False
+        self.string = state.string
+
+    def matches(self, state):
+        """
+        Return True if a State (or a cursor) is at the same input. The 'parsed'
+        window doesn't count, as parsers that consume nothing may change it.
+        """
+        return (state.left_start == self.left_start
+                and state.left_end == self.left_end
+                and state.string is self.string)
 
 
-class _GainedLookahead(Exception):
+class _Step(namedtuple("_Step", "pre cond update records")):
     """
-    An internal signal to be used when lookahead mode of a chain has changed.
+    A parser compiled into a rule (see _Compiler): the lines of code to run
+    first ('pre'), the condition telling if the parser has succeeded (None if
+    it always does), the lines updating the local 'pos', 'ps' and 'pe'
+    variables after a success ('update'), and whether the parser may record
+    effects.
     """
-    pass
+
+    __slots__ = []
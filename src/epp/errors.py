@@ -27,6 +27,11 @@ class FailError(Enum):
     FAILED = auto()
 
 
+class LazyError(Enum):
+    """ Error codes for 'lazy' parsers. """
+    LEFT_RECURSION = auto()
+
+
 class SubparseError(Enum):
     """ Error codes for 'subparse' parsers. """
     FAILED = auto()
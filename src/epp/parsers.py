@@ -8,7 +8,9 @@ ones in the 'core' module.
 """
 
 from collections import deque
+import enum
 import itertools as itools
+import re
 
 import epp.core as core
 import epp.errors as error
@@ -17,6 +19,7 @@ import epp.errors as error
 #--------- single-character parsers ---------#
 
 
+@core.interned
 def alnum(ascii_only=False):
     """
     Return a parser that will match a single alphanumeric character.
@@ -26,29 +29,36 @@ def alnum(ascii_only=False):
     """
     def alnum_body(state):
         """ Match an alphanumeric character. """
-        try:
-            char = state.string[state.left_start]
-        except IndexError:
-            raise core.ParsingFailure(
+        if state.left_start >= state.left_end:
+            return core.ParsingFailure(
                 state,
                 "Expected an alphanumeric character, got the end of input",
                 error.AlnumError.EOI)
+        char = state.string[state.left_start]
         if ascii_only:
             if 'a' <= char <= 'z' or 'A' <= char <= 'Z' or '0' <= char <= '9':
                 return state.consume(1)
-            raise core.ParsingFailure(
+            return core.ParsingFailure(
                 state,
-                f"Expected an alphanumeric character, got '{char}'",
-                error.AlnumError.NON_ALNUM)
+                "Expected an alphanumeric character, got '{}'",
+                error.AlnumError.NON_ALNUM,
+                char)
         if char.isalnum():
             return state.consume(1)
-        raise core.ParsingFailure(
+        return core.ParsingFailure(
             state,
-            f"Expected an alphanumeric character, got '{char}'",
-            error.AlnumError.NON_ALNUM)
-    return alnum_body
-
-
+            "Expected an alphanumeric character, got '{}'",
+            error.AlnumError.NON_ALNUM,
+            char)
+    parser = core.loud(alnum_body)
+    parser.char_class = _ASCII_ALNUM if ascii_only else _ALNUM
+    parser.scan_cursor = parser.char_class.scan_one
+    parser.char_runs = parser.char_class.runs
+    parser.first_chars = parser.char_class.first_chars
+    return parser
+
+
+@core.interned
 def alpha(ascii_only=False):
     """
     Return a parser that will match a single alphabetic character.
@@ -58,44 +68,55 @@ def alpha(ascii_only=False):
     """
     def alpha_body(state):
         """ Match an alphabetic character. """
-        try:
-            char = state.string[state.left_start]
-        except IndexError:
-            raise core.ParsingFailure(
+        if state.left_start >= state.left_end:
+            return core.ParsingFailure(
                 state,
                 "Expected an alphabetic character, got the end of input",
                 error.AlphaError.EOI)
+        char = state.string[state.left_start]
         if ascii_only:
             if 'a' <= char <= 'z' or 'A' <= char <= 'Z':
                 return state.consume(1)
-            raise core.ParsingFailure(
+            return core.ParsingFailure(
                 state,
-                f"Expected an alphabetic character, got '{char}'",
-                error.AlphaError.NON_ALPHA)
+                "Expected an alphabetic character, got '{}'",
+                error.AlphaError.NON_ALPHA,
+                char)
         if char.isalpha():
             return state.consume(1)
-        raise core.ParsingFailure(
+        return core.ParsingFailure(
             state,
-            f"Expected an alphabetic character, got '{char}'",
-            error.AlphaError.NON_ALPHA)
-    return alpha_body
-
-
+            "Expected an alphabetic character, got '{}'",
+            error.AlphaError.NON_ALPHA,
+            char)
+    parser = core.loud(alpha_body)
+    parser.char_class = _ASCII_ALPHA if ascii_only else _ALPHA
+    parser.scan_cursor = parser.char_class.scan_one
+    parser.char_runs = parser.char_class.runs
+    parser.first_chars = parser.char_class.first_chars
+    return parser
+
+
+@core.interned
 def any_char():
     """ Return a parser that would match any character. """
     def any_char_body(state):
         """ Match a single character. """
-        try:
-            _ = state.string[state.left_start]
-        except IndexError:
-            raise core.ParsingFailure(
+        if state.left_start >= state.left_end:
+            return core.ParsingFailure(
                 state,
                 "Expected a character, got the end of input",
                 error.AnyCharError.EOI)
         return state.consume(1)
-    return any_char_body
+    parser = core.loud(any_char_body)
+    parser.char_class = _ANY_CHAR
+    parser.scan_cursor = parser.char_class.scan_one
+    parser.char_runs = parser.char_class.runs
+    parser.first_chars = parser.char_class.first_chars
+    return parser
 
 
+@core.interned
 def cond_char(condition):
     """
     Return a parser that will match a character such that 'condition(char)' is
@@ -107,66 +128,85 @@ def cond_char(condition):
         raise ValueError(f"{condition} is not callable")
     def cond_char_body(state):
         """ Match a character that passes a conditional check. """
-        try:
-            char = state.string[state.left_start]
-        except IndexError:
-            raise core.ParsingFailure(
+        if state.left_start >= state.left_end:
+            return core.ParsingFailure(
                 state,
                 "Expected a character, got the end of input",
                 error.CondCharError.EOI)
+        char = state.string[state.left_start]
         if condition(char):
             return state.consume(1)
-        raise core.ParsingFailure(
+        return core.ParsingFailure(
             state,
-            f"{char} did not pass the {condition} test",
-            error.CondCharError.DID_NOT_PASS)
-    return cond_char_body
-
-
+            "{} did not pass the {} test",
+            error.CondCharError.DID_NOT_PASS,
+            char,
+            condition)
+    parser = core.loud(cond_char_body)
+    parser.char_class = _CharClass(None, condition)
+    parser.scan_cursor = parser.char_class.scan_one
+    parser.char_runs = parser.char_class.runs
+    parser.first_chars = parser.char_class.first_chars
+    return parser
+
+
+@core.interned
 def digit():
     """
     Return a parser that would match a single decimal digit.
     """
     def digit_body(state):
         """ Parse a single decimal digit. """
-        try:
-            char = state.string[state.left_start]
-        except IndexError:
-            raise core.ParsingFailure(
+        if state.left_start >= state.left_end:
+            return core.ParsingFailure(
                 state,
                 "Expected a digit, got the end of input",
                 error.DigitError.EOI)
+        char = state.string[state.left_start]
         if '0' <= char <= '9':
             return state.consume(1)
-        raise core.ParsingFailure(
+        return core.ParsingFailure(
             state,
-            f"Expected a digit, got '{char}'",
-            error.DigitError.NOT_DIGIT)
-    return digit_body
-
-
+            "Expected a digit, got '{}'",
+            error.DigitError.NOT_DIGIT,
+            char)
+    parser = core.loud(digit_body)
+    parser.char_class = _DIGIT
+    parser.scan_cursor = parser.char_class.scan_one
+    parser.char_runs = parser.char_class.runs
+    parser.first_chars = parser.char_class.first_chars
+    return parser
+
+
+@core.interned
 def hex_digit():
     """
     Return a parser that matches a single hexadecimal digit.
     """
     def hex_digit_body(state):
         """ Parse a single hexadecimal digit. """
-        try:
-            char = state.string[state.left_start]
-        except IndexError:
-            raise core.ParsingFailure(
+        if state.left_start >= state.left_end:
+            return core.ParsingFailure(
                 state,
                 "Expected a hexadecimal digit, got the end of input",
                 error.HexDigitError.EOI)
+        char = state.string[state.left_start]
         if ('0' <= char <= '9') or ('a' <= char <= 'f') or ('A' <= char <= 'F'):
             return state.consume(1)
-        raise core.ParsingFailure(
+        return core.ParsingFailure(
             state,
-            f"Expected a hexadecimal digit, got '{char}'",
-            error.HexDigitError.NOT_DIGIT)
-    return hex_digit_body
-
-
+            "Expected a hexadecimal digit, got '{}'",
+            error.HexDigitError.NOT_DIGIT,
+            char)
+    parser = core.loud(hex_digit_body)
+    parser.char_class = _HEX_DIGIT
+    parser.scan_cursor = parser.char_class.scan_one
+    parser.char_runs = parser.char_class.runs
+    parser.first_chars = parser.char_class.first_chars
+    return parser
+
+
+@core.interned
 def newline():
     """
     Return a parser that will match a newline character.
@@ -175,42 +215,53 @@ def newline():
     """
     def newline_body(state):
         """ Parse a newline character. """
-        try:
-            char = state.string[state.left_start]
-        except IndexError:
-            raise core.ParsingFailure(
+        if state.left_start >= state.left_end:
+            return core.ParsingFailure(
                 state,
                 "Expected a newline, got the end of input",
                 error.NewlineError.EOI)
+        char = state.string[state.left_start]
         if ord(char) in _LINE_SEPARATORS:
             return state.consume(1)
-        raise core.ParsingFailure(
+        return core.ParsingFailure(
             state,
-            f"Expected a newline, got '{char}'",
-            error.NewlineError.NOT_NEWLINE)
-    return newline_body
-
-
+            "Expected a newline, got '{}'",
+            error.NewlineError.NOT_NEWLINE,
+            char)
+    parser = core.loud(newline_body)
+    parser.char_class = _NEWLINE
+    parser.scan_cursor = parser.char_class.scan_one
+    parser.char_runs = parser.char_class.runs
+    parser.first_chars = parser.char_class.first_chars
+    return parser
+
+
+@core.interned
 def nonwhite_char():
     """ Return a parser that will match a character of anything but whitespace. """
     def nonwhite_char_body(state):
         """ Match a non-whitespace character. """
-        try:
-            char = state.string[state.left_start]
-        except IndexError:
-            raise core.ParsingFailure(
+        if state.left_start >= state.left_end:
+            return core.ParsingFailure(
                 state,
                 "Expected a non-whitespace character, got the end of input",
                 error.NonwhiteError.EOI)
+        char = state.string[state.left_start]
         if char.isspace():
-            raise core.ParsingFailure(
+            return core.ParsingFailure(
                 state,
                 "Got a whitespace character when expecting a non-whitespace one",
                 error.NonwhiteError.WHITE)
         return state.consume(1)
-    return nonwhite_char_body
+    parser = core.loud(nonwhite_char_body)
+    parser.char_class = _NONWHITE
+    parser.scan_cursor = parser.char_class.scan_one
+    parser.char_runs = parser.char_class.runs
+    parser.first_chars = parser.char_class.first_chars
+    return parser
 
 
+@core.interned
 def white_char(accept_newlines=False):
     """
     Return a parser that will match a character of whitespace, optionally also
@@ -218,38 +269,47 @@ def white_char(accept_newlines=False):
     """
     def white_char_body(state):
         """ Match a character of whitespace. """
-        try:
-            char = state.string[state.left_start]
-        except IndexError:
-            raise core.ParsingFailure(
+        if state.left_start >= state.left_end:
+            return core.ParsingFailure(
                 state,
                 "Expected a whitespace character, got the end of input",
                 error.WhiteCharError.EOI)
+        char = state.string[state.left_start]
         if accept_newlines:
             if char.isspace():
                 return state.consume(1)
-            raise core.ParsingFailure(
+            return core.ParsingFailure(
                 state,
-                f"Expected a whitespace character, got '{char}'",
-                error.WhiteCharError.NON_WHITE)
+                "Expected a whitespace character, got '{}'",
+                error.WhiteCharError.NON_WHITE,
+                char)
         # not accepting newlines
         if char.isspace():
             if ord(char) in _LINE_SEPARATORS:
-                raise core.ParsingFailure(
+                return core.ParsingFailure(
                     state,
-                    f"Got a newline character {hex(ord(char))} when not accepting newlines",
-                    error.WhiteCharError.NEWLINE)
+                    "Got a newline character {:#x} when not accepting "
+                    "newlines",
+                    error.WhiteCharError.NEWLINE,
+                    ord(char))
             return state.consume(1)
-        raise core.ParsingFailure(
+        return core.ParsingFailure(
             state,
-            f"Expected a whitespace character, got '{char}'",
-            error.WhiteCharError.NON_WHITE)
-    return white_char_body
+            "Expected a whitespace character, got '{}'",
+            error.WhiteCharError.NON_WHITE,
+            char)
+    parser = core.loud(white_char_body)
+    parser.char_class = _WHITE_OR_NEWLINE if accept_newlines else _WHITE
+    parser.scan_cursor = parser.char_class.scan_one
+    parser.char_runs = parser.char_class.runs
+    parser.first_chars = parser.char_class.first_chars
+    return parser
 
 
 #--------- aggregates and variations of the above ---------#
 
 
+@core.interned
 def alnum_word(ascii_only=False):
     """
     Return a parser that will match a non-empty sequence of alphanumeric
@@ -266,6 +326,7 @@ def alnum_word(ascii_only=False):
     return core.modify_error(many(alnum(ascii_only), 1), error_transformer)
 
 
+@core.interned
 def alpha_word(ascii_only=False):
     """
     Return a parser that will match a non-empty sequence of alphabetic
@@ -282,6 +343,7 @@ def alpha_word(ascii_only=False):
     return core.modify_error(many(alpha(ascii_only), 1), error_transformer)
 
 
+@core.interned
 def any_word():
     """
     Return a parser that will match a non-empty sequence of non-whitespace
@@ -295,6 +357,7 @@ def any_word():
     return core.modify_error(many(nonwhite_char(), 1), error_transformer)
 
 
+@core.interned
 def hex_int(must_have_prefix=False):
     """
     Return a parser that will match integers in base 16 (with or without '0x'
@@ -306,8 +369,9 @@ def hex_int(must_have_prefix=False):
         """ Transform the error message about the missing prefix. """
         return core.ParsingFailure(
             exc.state,
-            f"Required prefix '0x' is not found in {repr(exc.state.left[:20])}",
-            error.HexIntError.NO_PREFIX)
+            "Required prefix '0x' is not found in {!r}",
+            error.HexIntError.NO_PREFIX,
+            core.left_preview(exc.state))
     primary_error_transformer = _mk_aggregate_transformer(
         error.HexDigitError.EOI,
         error.HexIntError.EOI,
@@ -320,6 +384,7 @@ def hex_int(must_have_prefix=False):
     return core.chain([prefix, primary])
 
 
+@core.interned
 def integer():
     """
     Return a parser that will match integers in base 10.
@@ -332,6 +397,7 @@ def integer():
     return core.modify_error(many(digit(), 1), error_transformer)
 
 
+@core.interned
 def line(include_newline=False):
     """
     Return a parser that will match a line terminated by a newline.
@@ -344,7 +410,7 @@ def line(include_newline=False):
         pos = 0
         length = state.left_len
         if length == 0:
-            raise core.ParsingFailure(
+            return core.ParsingFailure(
                 state,
                 "Expected a line, got an end of input",
                 error.LineError.EOI)
@@ -359,14 +425,19 @@ def line(include_newline=False):
                     parsed_end=state.left_start + pos)
             pos += 1
         return state.consume(length)
-    return line_body
+    return core.loud(line_body)
 
 
+@core.interned
 def whitespace(min_num=1, accept_newlines=False):
     """
     Return a parser that will consume at least 'min_num' whitespace characters,
     optionally with newlines as well.
     """
+    if accept_newlines:
+        kind = "and maybe newlines"
+    else:
+        kind = "not newlines"
     def error_transformer(exc):
         """ Transform the error message. """
         if exc.code == error.WhiteCharError.EOI:
@@ -374,20 +445,20 @@ def whitespace(min_num=1, accept_newlines=False):
                 exc.state,
                 "Expected whitespace, got the end of input",
                 error.WhitespaceError.EOI)
-        if accept_newlines:
-            msg = f"Expected at least {min_num} characters of whitespace (and maybe newlines)"
-        else:
-            msg = f"Expected at least {min_num} characters of whitespace (not newlines)"
         return core.ParsingFailure(
             exc.state,
-            f"{msg}, got {repr(exc.state.left[:20])}",
-            error.WhitespaceError.NOT_ENOUGH)
+            "Expected at least {} characters of whitespace ({}), got {!r}",
+            error.WhitespaceError.NOT_ENOUGH,
+            min_num,
+            kind,
+            core.left_preview(exc.state))
     return core.modify_error(many(white_char(accept_newlines), min_num), error_transformer)
 
 
 #--------- various ---------#
 
 
+@core.interned
 def balanced(opening, closing, include_outer_pair=False):
     """
     Return a parser that will parse everything between an 'opening' string and
@@ -406,10 +477,12 @@ def balanced(opening, closing, include_outer_pair=False):
         open_len = len(opening)
         closing_len = len(closing)
         if state.string[state.left_start:state.left_start + open_len] != opening:
-            raise core.ParsingFailure(
+            return core.ParsingFailure(
                 state,
-                f"{repr(state.left[0:20])} doesn't start with '{opening}'",
-                error.BalancedError.DOESNT_START)
+                "{!r} doesn't start with '{}'",
+                error.BalancedError.DOESNT_START,
+                core.left_preview(state),
+                opening)
         pos = state.left_start + open_len
         balance = 1
         while pos < state.left_end and balance != 0:
@@ -424,10 +497,12 @@ def balanced(opening, closing, include_outer_pair=False):
                 continue
             pos += 1
         if balance != 0:
-            raise core.ParsingFailure(
+            return core.ParsingFailure(
                 state,
-                f"Failed to find a balanced pair of '{opening}' and '{closing}'",
-                error.BalancedError.NO_PAIR)
+                "Failed to find a balanced pair of '{}' and '{}'",
+                error.BalancedError.NO_PAIR,
+                opening,
+                closing)
         if include_outer_pair:
             return state._replace(
                 left_start=pos,
@@ -437,22 +512,27 @@ def balanced(opening, closing, include_outer_pair=False):
             left_start=pos,
             parsed_start=state.left_start + open_len,
             parsed_end=pos - closing_len)
-    return balanced_body
+    return core.loud(balanced_body)
 
 
+@core.interned
 def end_of_input():
     """ Return a parser that matches only if there is no input left. """
     def end_of_input_body(state):
         """ Match the end of input. """
         if state.left_start == state.left_end:
             return state._replace()
-        raise core.ParsingFailure(
+        return core.ParsingFailure(
             state,
-            f"Expected the end of input, got {repr(state.left[0:20])}",
-            error.EndOfInputError.NOT_END)
-    return end_of_input_body
+            "Expected the end of input, got {!r}",
+            error.EndOfInputError.NOT_END,
+            core.left_preview(state))
+    parser = core.loud(end_of_input_body)
+    parser.scan_cursor = lambda cursor: cursor.left_start == cursor.left_end
+    return parser
 
 
+@core.interned
 def everything():
     """ Return a parser that consumes all remaining input. """
     def everything_body(state):
@@ -461,49 +541,120 @@ def everything():
             parsed_start=state.left_start,
             parsed_end=state.left_end,
             left_start=state.left_end)
-    return everything_body
-
-
-def literal(lit):
+    def everything_scan(cursor):
+        """ Consume all remaining input on a cursor. """
+        cursor.parsed_start = cursor.left_start
+        cursor.parsed_end = cursor.left_start = cursor.left_end
+        return True
+    parser = core.loud(everything_body)
+    parser.scan_cursor = everything_scan
+    return parser
+
+
+@core.interned
+def literal(lit, ignore_case=False):
     """
     Return a parser that will match a given literal and remove it from input.
+
+    If 'ignore_case' is truthy, match as many characters as there are in the
+    literal if they are the same as the literal when casefolded.
     """
+    length = len(lit)
+    folded = lit.casefold()
     def literal_body(state):
         """ Match a literal. """
-        if state.left_len < len(lit):
-            raise core.ParsingFailure(
+        pos = state.left_start
+        if state.left_end - pos < length:
+            return core.ParsingFailure(
                 state,
-                f"{repr(state.left[:20])} doesn't start with {lit}",
-                error.LiteralError.SHORTER)
-        i = -1
-        for i, char in enumerate(lit):
-            if char != state.string[state.left_start + i]:
-                raise core.ParsingFailure(
-                    state,
-                    f"'{repr(state.left[:20])} doesn't start with {lit}",
-                    error.LiteralError.DOESNT_START)
-        return state.consume(i + 1)
-    return literal_body
+                "{!r} doesn't start with {}",
+                error.LiteralError.SHORTER,
+                core.left_preview(state),
+                lit)
+        if ignore_case:
+            matched = state.string[pos:pos + length].casefold() == folded
+        else:
+            matched = state.string.startswith(lit, pos)
+        if not matched:
+            return core.ParsingFailure(
+                state,
+                "'{!r} doesn't start with {}",
+                error.LiteralError.DOESNT_START,
+                core.left_preview(state),
+                lit)
+        return state.consume(length)
+    def literal_scan(cursor):
+        """ Match a literal on a cursor. """
+        pos = cursor.left_start
+        if ignore_case:
+            end = pos + length
+            if (end > cursor.left_end
+                    or cursor.string[pos:end].casefold() != folded):
+                return False
+        elif not cursor.string.startswith(lit, pos, cursor.left_end):
+            return False
+        cursor.parsed_start = pos
+        cursor.left_start = cursor.parsed_end = pos + length
+        return True
+    parser = core.loud(literal_body)
+    parser.scan_cursor = literal_scan
+    if ignore_case:
+        if lit:
+            parser.first_chars = (
+                lambda char: folded.startswith(char.casefold()), False)
+    else:
+        parser.literal_string = lit
+        parser.char_runs = tuple((char.__eq__, 1, 1) for char in lit)
+        if lit:
+            parser.first_chars = (lit[0].__eq__, False)
+    return parser
 
 
+@core.interned
 def maybe(parser):
     """
     Return a parser that will match whatever 'parser' matches, and if 'parser'
     fails, matches and consumes nothing.
     """
+    quiet_parser = core.quiet(parser)
+    def recovered(after, state):
+        """ Turn a failure to parse 'state' into matching nothing. """
+        if isinstance(after, core.ParsingFailure):
+            if after.committed:
+                return after
+            return state._replace(
+                parsed_start=state.left_start,
+                parsed_end=state.left_start)
+        return after
     def maybe_body(state):
         """
         Match whatever another parser matches, or consume no input if it fails.
         """
-        try:
-            return parser(state)
-        except core.ParsingFailure:
-            return state._replace(
-                parsed_start=state.left_start,
-                parsed_end=state.left_start)
-    return core.copy_lookahead(parser, maybe_body)
-
-
+        return recovered(quiet_parser(state), state)
+    def maybe_steps(state):
+        """ Run another parser stepwise, or consume no input if it fails. """
+        return recovered((yield parser, state), state)
+    res = core.copy_lookahead(parser, core.loud(maybe_body))
+    res.optional_parser = parser
+    if core.get_steps(parser) is not None:
+        res.steps = maybe_steps
+    first_chars = core.get_first_chars(parser)
+    if first_chars is not None:
+        res.first_chars = (first_chars[0], True)
+    scan = core.get_scan(parser)
+    if scan is not None:
+        def maybe_scan(cursor):
+            """ Scan with another parser, or consume no input if it fails. """
+            left_start = cursor.left_start
+            if not scan(cursor):
+                cursor.left_start = left_start
+                cursor.parsed_start = cursor.parsed_end = left_start
+            return True
+        res.scan_cursor = maybe_scan
+    return res
+
+
+@core.interned
 def many(parser, min_hits=0, max_hits=0, combine=True):
     """
     Return a parser that will run 'parser' on input repeatedly until it fails.
@@ -518,6 +669,10 @@ def many(parser, min_hits=0, max_hits=0, combine=True):
     concatenation of individually matched strings, otherwise set it to the last
     matched string.
 
+    If 'parser' is one of the built-in single-character parsers, the resulting
+    parser scans the input in one go instead of running 'parser' on every
+    character. Otherwise, this is the same as 'core.repeat'.
+
     Raise ValueError if 'max_hits' is above zero and is less than 'min_hits'.
     """
     if min_hits < 0:
@@ -526,34 +681,220 @@ def many(parser, min_hits=0, max_hits=0, combine=True):
         max_hits = 0
     if max_hits > 0 and max_hits < min_hits:
         raise ValueError("'max_hits' is less than 'min_hits'")
-    if min_hits > 0:
-        must = core.chain(itools.repeat(parser, min_hits), combine)
-    else:
-        must = None
-    if max_hits > 0:
-        might = core.chain(itools.repeat(parser, max_hits - min_hits),
-                           combine=combine,
-                           stop_on_failure=True)
-    else:
-        might = core.chain(itools.repeat(parser), combine, True)
-    if must is None:
-        return might
-    return core.chain([must, might], combine)
+    char_class = getattr(parser, "char_class", None)
+    if char_class is not None and core.no_lookahead(parser):
+        return _scan_many(parser, char_class, min_hits, max_hits, combine)
+    return core.repeat(parser, min_hits, max_hits, combine)
 
 
-def multi(literals):
+@core.interned
+def multi(literals, longest=False, ignore_case=False):
     """
     Return a parser that will match any of given literals.
+
+    If several literals match, the one listed first wins, unless 'longest' is
+    truthy, in which case the longest one does.
+
+    If 'ignore_case' is truthy, match literals like 'literal' does with
+    'ignore_case'.
+
+    The literals are looked up in a table, so the time a match takes depends
+    on the number of distinct lengths of the literals rather than on the
+    number of literals.
     """
-    def error_transformer(exc):
-        """ Transform the error message. """
-        return core.ParsingFailure(
-            exc.state,
-            f"None of the literals matched the input: {repr(exc.state.left[:20])}'",
-            error.MultiError.ALL_FAILED)
-    return core.modify_error(core.branch(map(literal, literals)), error_transformer)
+    table = _LiteralTable(literals, longest, ignore_case)
+    def multi_body(state):
+        """ Match any of the literals. """
+        pos = state.left_start
+        length = table.match(state.string, pos, state.left_end)
+        if length < 0:
+            return core.ParsingFailure(
+                state,
+                "None of the literals matched the input: {!r}'",
+                error.MultiError.ALL_FAILED,
+                core.left_preview(state))
+        return state.consume(length)
+    def multi_scan(cursor):
+        """ Match any of the literals on a cursor. """
+        pos = cursor.left_start
+        length = table.match(cursor.string, pos, cursor.left_end)
+        if length < 0:
+            return False
+        cursor.parsed_start = pos
+        cursor.left_start = cursor.parsed_end = pos + length
+        return True
+    parser = core.loud(multi_body)
+    parser.scan_cursor = multi_scan
+    parser.first_chars = table.first_chars()
+    return parser
+
+
+class Fixity(enum.Enum):
+    """ Kinds of operators in an 'operator_table'. """
+    PREFIX = enum.auto()
+    POSTFIX = enum.auto()
+    INFIX_LEFT = enum.auto()
+    INFIX_RIGHT = enum.auto()
+
+
+@core.interned
+def operator_table(atom, levels, spacing=None, ignore_case=False):
+    """
+    Return a parser that will match expressions made of operands matched by
+    'atom' and operators described by 'levels'.
+
+    'levels' is an iterable of pairs (fixity, operators), from the loosest
+    binding level to the tightest one. 'fixity' is a member of Fixity telling
+    whether the operators of the level are prefix, postfix, or infix ones
+    associating to the left or to the right. 'operators' is a dictionary from
+    operator literals to their effects (None for operators without one).
+
+    The effect of an operator is registered with the State of the operator
+    itself, after the effects of its operands, so that the effects of an
+    expression come in reverse Polish order. A prefix operator applies to
+    everything up to the next operator that binds looser than it does.
+
+    If 'spacing' is not None, it's run before and after every operator - say,
+    'maybe(whitespace())'. Its effects are ignored.
 
+    Operators are matched like 'multi' does with 'longest', and with
+    'ignore_case' if 'ignore_case' is truthy.
 
+    If an infix operator isn't followed by an operand, the expression ends
+    before the operator. If there's no operand at all, fail like 'atom' does.
+
+    Unlike a grammar with a lazy parser for every level, the resulting parser
+    parses a whole expression in a single loop, without recursion.
+
+    Raise ValueError if an operator is empty, or is listed twice among prefix
+    operators or among the others.
+    """
+    prefixes = {}
+    suffixes = {}
+    prefix_literals = []
+    suffix_literals = []
+    for precedence, (fixity, operators) in enumerate(levels):
+        if fixity is Fixity.PREFIX:
+            entries, literals = prefixes, prefix_literals
+        else:
+            entries, literals = suffixes, suffix_literals
+        for lit, eff in operators.items():
+            if not lit:
+                raise ValueError("An empty operator")
+            key = lit.casefold() if ignore_case else lit
+            if key in entries:
+                raise ValueError(f"Operator {lit!r} is listed twice")
+            entries[key] = (precedence, fixity, eff)
+            literals.append(lit)
+    prefix_table = _LiteralTable(prefix_literals, True, ignore_case)
+    suffix_table = _LiteralTable(suffix_literals, True, ignore_case)
+    quiet_atom = core.quiet(atom)
+    quiet_spacing = None if spacing is None else core.quiet(spacing)
+    def space(state):
+        """ Skip the spacing, if there's any. """
+        if quiet_spacing is None:
+            return state
+        after = quiet_spacing(state)
+        if isinstance(after, core.ParsingFailure):
+            return state
+        return after
+    def operator_at(state, table, entries):
+        """
+        Return the entry of the operator at the start of the 'left' window of
+        'state' and the State after it, or None if there's no operator.
+        """
+        pos = state.left_start
+        length = table.match(state.string, pos, state.left_end)
+        if length < 0:
+            return None
+        key = state.string[pos:pos + length]
+        if ignore_case:
+            key = key.casefold()
+        return entries[key], state._replace(
+            left_start=pos + length, parsed_start=pos, parsed_end=pos + length)
+    def operand(state, pending):
+        """
+        Match an operand: prefix operators followed by an atom. Add the
+        operators to 'pending' and return the State after the atom, or the
+        failure of the atom.
+        """
+        found = []
+        current = state
+        while True:
+            match = operator_at(current, prefix_table, prefixes)
+            if match is None:
+                break
+            found.append((current, match))
+            current = space(match[1])
+        after = quiet_atom(current)
+        while (isinstance(after, core.ParsingFailure) and found
+               and not after.committed):
+            # Maybe the atom starts like a prefix operator does.
+            current, _ = found.pop()
+            after = quiet_atom(current)
+        if not isinstance(after, core.ParsingFailure):
+            for _, ((precedence, _, eff), op_state) in found:
+                pending.append((precedence, _operator_effect(op_state, eff)))
+        return after
+    def reduce(stack, effects, precedence):
+        """ Apply the pending operators binding tighter than 'precedence'. """
+        while stack and stack[-1][0] >= precedence:
+            _, op_state = stack.pop()
+            if op_state is not None:
+                effects.append(op_state)
+    def operator_table_body(state):
+        """ Match an expression. """
+        stack = []
+        effects = []
+        current = operand(state, stack)
+        if isinstance(current, core.ParsingFailure):
+            return current
+        if current.effect is not None:
+            effects.append(current)
+        prefixed = []
+        while True:
+            match = operator_at(space(current), suffix_table, suffixes)
+            if match is None:
+                break
+            (precedence, fixity, eff), op_state = match
+            if fixity is Fixity.POSTFIX:
+                reduce(stack, effects, precedence + 1)
+                if eff is not None:
+                    effects.append(_operator_effect(op_state, eff))
+                current = op_state
+                continue
+            after = operand(space(op_state), prefixed)
+            if isinstance(after, core.ParsingFailure):
+                if after.committed:
+                    return after
+                break
+            if fixity is Fixity.INFIX_LEFT:
+                reduce(stack, effects, precedence)
+            else:
+                reduce(stack, effects, precedence + 1)
+            stack.append((precedence, _operator_effect(op_state, eff)))
+            stack.extend(prefixed)
+            prefixed.clear()
+            if after.effect is not None:
+                effects.append(after)
+            current = after
+        reduce(stack, effects, 0)
+        return current._replace(effect=_effect_sequence(effects),
+                                parsed_start=state.left_start)
+    parser = core.loud(operator_table_body)
+    first_chars = core.get_first_chars(atom)
+    if first_chars is not None:
+        test, nullable = first_chars
+        if prefix_literals:
+            prefix_test = prefix_table.first_chars()[0]
+            parser.first_chars = (
+                lambda char: prefix_test(char) or test(char), nullable)
+        else:
+            parser.first_chars = first_chars
+    return parser
+
+
+@core.interned
 def repeat_while(cond, window_size=1, min_repetitions=0, combine=True):
     """
     Return a parser that will call
@@ -583,8 +924,12 @@ def repeat_while(cond, window_size=1, min_repetitions=0, combine=True):
                 continue
             if rep < min_repetitions:
                 msg = "Failed to achieve required minimum of repetitions " \
-                      f"on input: {repr(state.left[:20])}'"
-                raise core.ParsingFailure(state, msg, error.RepeatWhileError.NOT_ENOUGH)
+                      "on input: {!r}'"
+                return core.ParsingFailure(
+                    state,
+                    msg,
+                    error.RepeatWhileError.NOT_ENOUGH,
+                    core.left_preview(state))
             if combine:
                 return state._replace(
                     left_start=window_start,
@@ -594,9 +939,10 @@ def repeat_while(cond, window_size=1, min_repetitions=0, combine=True):
                 left_start=window_start,
                 parsed_start=window_start - window_size,
                 parsed_end=window_start)
-    return repeat_while_body
+    return core.loud(repeat_while_body)
 
 
+@core.interned
 def take(num, fail_on_fewer=True):
     """
     Return a parser that will consume exactly 'num' characters.
@@ -612,12 +958,28 @@ def take(num, fail_on_fewer=True):
         """ Consume a fixed number of characters. """
         if fail_on_fewer and state.left_len < num:
             msg = "Less than requested number of characters received on input: " \
-                  f"{repr(state.left[:20])}'"
-            raise core.ParsingFailure(state, msg, error.TakeError.NOT_ENOUGH)
+                  "{!r}'"
+            return core.ParsingFailure(
+                state,
+                msg,
+                error.TakeError.NOT_ENOUGH,
+                core.left_preview(state))
         return state.consume(min(num, state.left_len))
-    return take_body
-
-
+    def take_scan(cursor):
+        """ Consume a fixed number of characters on a cursor. """
+        pos = cursor.left_start
+        left = cursor.left_end - pos
+        if fail_on_fewer and left < num:
+            return False
+        cursor.parsed_start = pos
+        cursor.left_start = cursor.parsed_end = pos + min(num, left)
+        return True
+    parser = core.loud(take_body)
+    parser.scan_cursor = take_scan
+    return parser
+
+
+@core.interned
 def weave(parsers, separator, trailing=None, stop_on_failure=False):
     """
     Return a chain where each parser in 'parsers' is separated by 'separator'
@@ -649,21 +1011,243 @@ def weave(parsers, separator, trailing=None, stop_on_failure=False):
 _LINE_SEPARATORS = [0x000a, 0x000d, 0x001c, 0x001d, 0x001e, 0x0085, 0x2028, 0x2029]
 
 
+class _CharClass():
+    """
+    A description of characters accepted by a single-character parser: a
+    regular expression character class matching exactly these characters (or
+    None if there is no such class) and a predicate on a single character.
+    'runs' and 'first_chars' are the 'char_runs' (see 'core.chain') and
+    'first_chars' (see 'core.get_first_chars') descriptions of such a parser.
+    """
+
+    def __init__(self, regex, test):
+        self.regex = regex
+        self.test = test
+        self.runs = ((test, 1, 1),)
+        self.first_chars = (test, False)
+        if regex is None:
+            self.run = None
+        else:
+            self.run = re.compile(regex + "*").match
+
+    def scan_one(self, cursor):
+        """ Scan a single character of the class on a cursor. """
+        pos = cursor.left_start
+        if pos >= cursor.left_end or not self.test(cursor.string[pos]):
+            return False
+        cursor.parsed_start = pos
+        cursor.left_start = cursor.parsed_end = pos + 1
+        return True
+
+    def scan(self, string, start, end):
+        """
+        Return the position of the first character not in the class in
+        'string[start:end]', or 'end' if there is no such character.
+        """
+        if self.run is not None:
+            return self.run(string, start, end).end()
+        test = self.test
+        while start < end and test(string[start]):
+            start += 1
+        return start
+
+
+_NEWLINES = "".join(map(chr, _LINE_SEPARATORS))
+_ALNUM = _CharClass(r"[^\W_]", str.isalnum)
+_ALPHA = _CharClass(None, str.isalpha)
+_ANY_CHAR = _CharClass(r"[\s\S]", lambda char: True)
+_ASCII_ALNUM = _CharClass(
+    "[a-zA-Z0-9]",
+    lambda char: ('a' <= char <= 'z' or 'A' <= char <= 'Z'
+                  or '0' <= char <= '9'))
+_ASCII_ALPHA = _CharClass(
+    "[a-zA-Z]",
+    lambda char: 'a' <= char <= 'z' or 'A' <= char <= 'Z')
+_DIGIT = _CharClass("[0-9]", lambda char: '0' <= char <= '9')
+_HEX_DIGIT = _CharClass(
+    "[0-9a-fA-F]",
+    lambda char: ('0' <= char <= '9' or 'a' <= char <= 'f'
+                  or 'A' <= char <= 'F'))
+_NEWLINE = _CharClass(f"[{_NEWLINES}]", lambda char: char in _NEWLINES)
+_NONWHITE = _CharClass(r"\S", lambda char: not char.isspace())
+_WHITE = _CharClass(
+    f"[^\\S{_NEWLINES}]",
+    lambda char: char.isspace() and char not in _NEWLINES)
+_WHITE_OR_NEWLINE = _CharClass(r"\s", str.isspace)
+
+
+class _LiteralTable():
+    """
+    A table of literals for 'multi': for every distinct length of the
+    literals, a dictionary from the literals of this length (casefolded, if
+    case is ignored) to their positions in the original list.
+    """
+
+    def __init__(self, literals, longest, ignore_case):
+        self.ignore_case = ignore_case
+        self.longest = longest
+        self.buckets = {}
+        for i, lit in enumerate(literals):
+            key = lit.casefold() if ignore_case else lit
+            self.buckets.setdefault(len(lit), {}).setdefault(key, i)
+        # Lengths in the order to try them.
+        self.lengths = sorted(self.buckets, reverse=longest)
+
+    def first_chars(self):
+        """ Return the 'first_chars' description of the literals. """
+        keys = [key for bucket in self.buckets.values() for key in bucket]
+        nullable = "" in keys
+        firsts = frozenset(key[0] for key in keys if key)
+        if not self.ignore_case:
+            return firsts.__contains__, nullable
+        def test(char):
+            """ Check if a literal may start with a character, in any case. """
+            char = char.casefold()
+            if len(char) == 1:
+                return char in firsts
+            return any(key.startswith(char) for key in keys)
+        return test, nullable
+
+    def match(self, string, start, end):
+        """
+        Return the length of the literal matching at 'start', or -1 if none
+        does.
+        """
+        ignore_case = self.ignore_case
+        buckets = self.buckets
+        found = -1
+        found_at = None
+        for length in self.lengths:
+            if start + length > end:
+                if self.longest:
+                    continue
+                break
+            key = string[start:start + length]
+            if ignore_case:
+                key = key.casefold()
+            at = buckets[length].get(key)
+            if at is None:
+                continue
+            if self.longest:
+                return length
+            if found_at is None or at < found_at:
+                found = length
+                found_at = at
+        return found
+
+
+def _scan_many(parser, char_class, min_hits, max_hits, combine):
+    """
+    Return an equivalent of 'many' over a single-character parser that matches
+    a whole run of characters from its class at once.
+    """
+    quiet_parser = core.quiet(parser)
+    def scan_many_body(state):
+        """ Match a run of characters from a single character class. """
+        start = state.left_start
+        end = state.left_end
+        if max_hits > 0 and start + max_hits < end:
+            end = start + max_hits
+        stop = char_class.scan(state.string, start, end)
+        if stop - start < min_hits:
+            # Let the single-character parser itself report the failure.
+            if stop == start:
+                return quiet_parser(state)
+            return quiet_parser(
+                state._replace(left_start=stop, parsed_start=stop - 1,
+                               parsed_end=stop))
+        if stop == start:
+            if combine:
+                return state._replace(parsed_start=start)
+            return state._replace()
+        if combine:
+            return state._replace(left_start=stop, parsed_start=start,
+                                  parsed_end=stop)
+        return state._replace(left_start=stop, parsed_start=stop - 1,
+                              parsed_end=stop)
+    def scan_many_scan(cursor):
+        """ Match a run of characters of a single class on a cursor. """
+        start = cursor.left_start
+        end = cursor.left_end
+        if max_hits > 0 and start + max_hits < end:
+            end = start + max_hits
+        stop = char_class.scan(cursor.string, start, end)
+        if stop - start < min_hits:
+            return False
+        if stop != start:
+            cursor.left_start = cursor.parsed_end = stop
+            cursor.parsed_start = start if combine else stop - 1
+        elif combine:
+            cursor.parsed_start = start
+        return True
+    def scan_many_ends(state, longest_first):
+        """ Yield the outcomes on every portion of input, scanning it once. """
+        start = state.left_start
+        end = state.left_end
+        if max_hits > 0 and start + max_hits < end:
+            end = start + max_hits
+        stop = char_class.scan(state.string, start, end)
+        ends = range(start + min_hits, stop + 1)
+        if longest_first:
+            ends = reversed(ends)
+        for pos in ends:
+            if pos == start:
+                yield state._replace(parsed_start=start, parsed_end=start)
+            elif combine:
+                yield state._replace(left_start=pos, parsed_start=start,
+                                     parsed_end=pos)
+            else:
+                yield state._replace(left_start=pos, parsed_start=pos - 1,
+                                     parsed_end=pos)
+    res = core.loud(scan_many_body)
+    res.scan_cursor = scan_many_scan
+    res.match_ends = scan_many_ends
+    res.char_runs = ((char_class.test, min_hits, max_hits),)
+    res.char_many = (char_class, min_hits, max_hits, combine)
+    res.first_chars = (char_class.test, min_hits == 0)
+    return res
+
+
+def _effect_sequence(states):
+    """
+    Return an effect applying the effects of 'states' in turn, each with its
+    own State, or None if there are none.
+    """
+    if not states:
+        return None
+    def effect_sequence(value, _):
+        """ Apply the effects in turn. """
+        for state in states:
+            value = state.effect(value, state)
+        return value
+    return effect_sequence
+
+
 def _mk_aggregate_transformer(
         eoi_code_in,
         eoi_code_out,
         generic_code_out,
         msg):
     """ Create an error transformer for aggregate functions. """
+    eoi_msg = f"{msg}, got the end of input"
     def transformer(exc):
         """ Transform the error message. """
         if exc.code == eoi_code_in:
-            return core.ParsingFailure(
-                exc.state,
-                f"{msg}, got the end of input",
-                eoi_code_out)
+            return core.ParsingFailure(exc.state, eoi_msg, eoi_code_out)
         return core.ParsingFailure(
             exc.state,
-            f"{msg}, got {repr(exc.state.left[:20])}",
-            generic_code_out)
+            "{}, got {!r}",
+            generic_code_out,
+            msg,
+            core.left_preview(exc.state))
     return transformer
+
+
+def _operator_effect(state, eff):
+    """
+    Return the State of an operator in an 'operator_table' with its effect,
+    or None if it has none.
+    """
+    if eff is None:
+        return None
+    return state._replace(effect=eff)
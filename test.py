@@ -5,12 +5,36 @@ Unit tests for epp library.
 """
 
 import collections as coll
+import gc
+import io
 import itertools as it
+import pickle
+import sys
+import threading
 import unittest
+import weakref
 
 import epp
 
 
+def append_parsed(value, state):
+    """
+    Append the 'parsed' window of the state to the value. Defined at the top
+    level, so that the grammars using it can be pickled.
+    """
+    return value + state.parsed
+
+
+def sums():
+    """
+    Return a parser of sums with parentheses. Defined at the top level, so
+    that the grammars using it can be pickled.
+    """
+    term = epp.branch([epp.integer(),
+                       epp.chain([epp.literal("("), epp.lazy(sums), epp.literal(")")])])
+    return epp.chain([term, epp.many(epp.chain([epp.literal("+"), term]))])
+
+
 class TestState(unittest.TestCase):
     """ Test State class. """
 
@@ -70,6 +94,26 @@ class TestState(unittest.TestCase):
         self.assertIsNone(b.effect)
 
 
+class TestParsingFailure(unittest.TestCase):
+    """ Test ParsingFailure class. """
+
+    def test_plain_message(self):
+        """ Test a failure with a ready message. """
+        failure = epp.ParsingFailure(epp.State("foo"), "a {message}", 1)
+        self.assertEqual(str(failure), "a {message}")
+        self.assertEqual(failure.args, ("a {message}",))
+
+    def test_template_message(self):
+        """ Test a failure with a deferred message. """
+        state = epp.State("foobar" * 10, start=3)
+        failure = epp.ParsingFailure(
+            state, "{} and {!r}", 2, 12, epp.left_preview(state, 5))
+        self.assertEqual(failure.template_args[0], 12)
+        self.assertEqual(str(failure), "12 and 'barfo'")
+        self.assertEqual(failure.args, ("12 and 'barfo'",))
+        self.assertEqual(failure.code, 2)
+
+
 class TestCore(unittest.TestCase):
     """ Test core parsers and functions. """
 
@@ -172,6 +216,37 @@ class TestCore(unittest.TestCase):
         self.assertIsNotNone(output2)
         self.assertEqual(output1, output2)
 
+    def test_branch_dispatch(self):
+        """
+        Test that branches skip the parsers that can't match the next
+        character, keeping the order and 'strictly_one' semantics.
+        """
+        calls = []
+        def counted(state):
+            """ Record the call and match 'a'. """
+            calls.append(state.string)
+            return epp.literal("a")(state)
+        counted.first_chars = ("a".__eq__, False)
+        signed = epp.chain([epp.maybe(epp.literal("-")), epp.integer()])
+        parser = epp.branch([epp.literal("b"), counted, signed, epp.many(epp.alpha(), 1)])
+        self.assertEqual(epp.parse(None, "-12", parser)[1].parsed, "-12")
+        self.assertEqual(epp.parse(None, "ab", parser)[1].parsed, "a")
+        self.assertEqual(epp.parse(None, "xy", parser)[1].parsed, "xy")
+        self.assertEqual(epp.parse(None, "bb", parser)[1].parsed, "b")
+        self.assertEqual(calls, ["ab"])
+        self.assertIsNone(epp.parse(None, "", parser))
+        wide = epp.branch([epp.literal("я"), epp.literal("一"), epp.many(epp.alpha(), 1),
+                           epp.end_of_input()])
+        for string, parsed in [("яa", "я"), ("一я", "一"), ("丁一", "丁一"),
+                               ("бя", "бя"), ("", "")]:
+            self.assertEqual(epp.parse(None, string, wide)[1].parsed, parsed)
+        self.assertIsNone(epp.parse(None, "　", wide))
+        strict = epp.branch([epp.literal("a"), epp.digit(), epp.alpha()], strictly_one=True)
+        self.assertIsNone(epp.parse(None, "a", strict))
+        self.assertEqual(epp.parse(None, "1", strict)[1].parsed, "1")
+        failure = epp.parse(None, "a", strict, verbose=True)
+        self.assertEqual(failure.code, epp.BranchError.MORE_THAN_ONE_SUCCEEDED)
+
     def test_catch_negative_1(self):
         """ Test 'catch' parser generator, negative check #1. """
         def inner_parser(state):
@@ -304,6 +379,334 @@ class TestCore(unittest.TestCase):
         self.assertEqual(after.left, "3")
         self.assertEqual(after.parsed, "12")
 
+    def test_commit_negative_1(self):
+        """
+        Test 'commit' parser generator, negative check #1.
+
+        Test that failures after a commit point are not recovered from.
+        """
+        item = epp.chain([epp.literal("("), epp.commit(), epp.digit(), epp.literal(")")])
+        parsers = [
+            epp.branch([item, epp.literal("(x)")]),
+            epp.many(item),
+            epp.maybe(item),
+            epp.chain([item], stop_on_failure=True)]
+        for parser in parsers:
+            output = epp.parse(None, "(x)", parser, verbose=True)
+            self.assertIsInstance(output, epp.ParsingFailure)
+            self.assertTrue(output.committed)
+            self.assertEqual(output.code, epp.DigitError.NOT_DIGIT)
+            self.assertEqual(output.state.left, "x)")
+
+    def test_commit_negative_2(self):
+        """
+        Test 'commit' parser generator, negative check #2.
+
+        Test that chains don't backtrack over commit points.
+        """
+        string = "ab;1;x"
+        parser = epp.chain([epp.greedy(epp.many(epp.any_char())), epp.literal(";"), epp.commit(),
+                            epp.digit()])
+        output = epp.parse(None, string, parser, verbose=True)
+        self.assertIsInstance(output, epp.ParsingFailure)
+        self.assertTrue(output.committed)
+        self.assertEqual(output.state.left, "x")
+        parser = epp.chain([epp.literal("<"), epp.commit(), epp.greedy(epp.many(epp.any_char())),
+                            epp.literal(">")])
+        output = epp.parse(None, "<ab", parser, verbose=True)
+        self.assertTrue(output.committed)
+        self.assertEqual(output.code, epp.ChainError.LOOKAHEAD_FAILED)
+
+    def test_commit_positive_1(self):
+        """
+        Test 'commit' parser generator, positive check #1.
+
+        Test that failures before a commit point and outside of the chain with
+        it are recovered from.
+        """
+        push = lambda val, st: val + [st.parsed]
+        item = epp.chain([epp.literal("("), epp.commit(), epp.digit(), epp.effect(push),
+                          epp.literal(")")])
+        parser = epp.chain([epp.many(item), epp.maybe(epp.literal("!"))])
+        value, after = epp.parse([], "(1)(2)!", parser)
+        self.assertEqual(value, ["1", "2"])
+        self.assertEqual(after.left, "")
+        parser = epp.branch([epp.chain([item, epp.literal("?")]), epp.chain([item, epp.literal("!")])])
+        value, after = epp.parse([], "(1)!", parser)
+        self.assertEqual(value, ["1"])
+        self.assertEqual(after.parsed, "(1)!")
+        parser = epp.branch([epp.chain([epp.literal("ab"), epp.commit()]), epp.literal("a")])
+        value, after = epp.parse([], "ac", parser)
+        self.assertEqual(after.parsed, "a")
+        output = epp.parse(None, "ab", epp.commit())
+        self.assertIsNotNone(output)
+        self.assertEqual(output[1].left, "ab")
+
+    def test_commit_positive_2(self):
+        """
+        Test 'commit' parser generator, positive check #2.
+
+        Test backtracking over parsers after a commit point.
+        """
+        parser = epp.chain([epp.literal("<"), epp.commit(), epp.greedy(epp.many(epp.any_char())),
+                            epp.literal(">")])
+        value, after = epp.parse(None, "<a>b>c", parser)
+        self.assertEqual(after.parsed, "<a>b>")
+        self.assertEqual(after.left, "c")
+
+    def test_compile_negative_1(self):
+        """
+        Test 'compile', negative check #1.
+
+        Test that failures are reported like the original parser does.
+        """
+        parser = epp.chain([epp.literal("("), epp.many(epp.digit(), 1), epp.literal(")")])
+        compiled = epp.compile(parser)
+        for string in ["", "(", "()", "(12", "(1a)"]:
+            expected = epp.parse(None, string, parser, verbose=True)
+            output = epp.parse(None, string, compiled, verbose=True)
+            self.assertIsInstance(output, epp.ParsingFailure)
+            self.assertEqual(output.code, expected.code)
+            self.assertEqual(output.state.left_start, expected.state.left_start)
+        stopper = epp.chain([epp.literal("a"), epp.stop(), epp.literal("b")])
+        parser = epp.branch([stopper, epp.literal("ab")])
+        expected = epp.parse(None, "ab", parser)
+        output = epp.parse(None, "ab", epp.compile(parser))
+        self.assertEqual(output[1]._replace(), expected[1]._replace())
+
+    def test_compile_negative_2(self):
+        """
+        Test 'compile', negative check #2.
+
+        Test that failures are reported without parsing the input again.
+        """
+        calls = []
+        def counter(state):
+            calls.append(state)
+            return state
+        item = epp.branch([epp.many(epp.digit(), 1), epp.literal("-")])
+        parser = epp.chain([counter, item, epp.many(epp.chain([epp.literal(","), item])),
+                            epp.end_of_input()])
+        compiled = epp.compile(parser)
+        for string in ["1,2,x", "1,2,-!", "1,,"]:
+            expected = epp.parse(None, string, parser, verbose=True)
+            del calls[:]
+            output = epp.parse(None, string, compiled, verbose=True)
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(output.code, expected.code)
+            self.assertEqual(output.state, expected.state)
+        inner = epp.modify_error(epp.chain([epp.literal("a"), epp.literal("b")]),
+                                 lambda error: epp.ParsingFailure("no ab", error.state))
+        for parser in [inner, epp.chain([epp.literal("("), inner, epp.literal(")")])]:
+            compiled = epp.compile(parser)
+            for string in ["ax", "(ax)"]:
+                expected = epp.parse(None, string, parser, verbose=True)
+                output = epp.parse(None, string, compiled, verbose=True)
+                self.assertEqual(output.args, expected.args)
+                self.assertEqual(output.state, expected.state)
+
+    def test_compile_positive_1(self):
+        """
+        Test 'compile', positive check #1.
+
+        Test that compiled parsers return the same values and states.
+        """
+        push = epp.effect(lambda val, st: val + [st.parsed])
+        number = epp.chain([epp.many(epp.digit(), 1), push])
+        name = epp.chain([epp.alpha_word(), push])
+        item = epp.branch([number, name, epp.chain([epp.literal("-"), epp.maybe(number)])])
+        parser = epp.chain([item, epp.many(epp.chain([epp.literal(","), item]))])
+        compiled = epp.compile(parser)
+        self.assertIn("def ", compiled.source)
+        for string in ["12,ab,-,-3", "ab", "1,", "x,y,z!"]:
+            expected = epp.parse([], string, parser)
+            output = epp.parse([], string, compiled)
+            self.assertEqual(output[0], expected[0])
+            self.assertEqual(output[1].parsed, expected[1].parsed)
+            self.assertEqual(output[1].left, expected[1].left)
+
+    def test_compile_positive_2(self):
+        """
+        Test 'compile', positive check #2.
+
+        Test parsers that the compiled code hands over to the original.
+        """
+        push = epp.effect(lambda val, st: val + [st.parsed])
+        cell = [None]
+        expr = epp.lazy(lambda: cell[0])
+        cell[0] = epp.branch([epp.chain([expr, epp.literal("+"), epp.digit(), push]), epp.digit()])
+        compiled = epp.compile(expr)
+        value, after = epp.parse([], "1+2+3", compiled)
+        self.assertEqual(value, ["2", "3"])
+        self.assertEqual(after.left, "")
+        custom = lambda state: state.consume(1)
+        parser = epp.chain([epp.literal("<"), custom, epp.noconsume(epp.literal(">")),
+                            epp.commit(), epp.literal(">"), push])
+        compiled = epp.compile(parser)
+        value, after = epp.parse([], "<a>", compiled)
+        self.assertEqual(value, epp.parse([], "<a>", parser)[0])
+        output = epp.parse([], "<ab", compiled, verbose=True)
+        self.assertIsInstance(output, epp.ParsingFailure)
+        value, after = epp.parse([], "<a>", compiled, packrat=epp.PackratCache())
+        self.assertEqual(value, [">"])
+
+    def test_dumps_negative_1(self):
+        """
+        Test 'dumps' function, negative check #1.
+
+        Test that grammars with lambdas and one-shot iterators can't be
+        pickled.
+        """
+        # Depending on the Python version, local objects fail either way.
+        with self.assertRaises((AttributeError, pickle.PicklingError)):
+            epp.dumps(epp.chain([epp.literal("a"), epp.effect(lambda val, st: val)]))
+        with self.assertRaises(pickle.PicklingError):
+            epp.dumps(epp.branch(iter([epp.literal("a"), epp.literal("b")])))
+
+    def test_dumps_positive_1(self):
+        """
+        Test 'dumps' function, positive check #1.
+
+        Test that loaded grammars parse like the original ones and share the
+        parsers that are already built.
+        """
+        digit = epp.digit()
+        self.assertIs(pickle.loads(epp.dumps(digit)), digit)
+        parser = epp.chain([epp.lazy(sums), epp.maybe(epp.whitespace()),
+                            epp.weave((epp.alpha_word(), epp.integer()), epp.literal(",")),
+                            epp.multi(["if", "else"]), epp.commit(), epp.hex_int()])
+        loaded = pickle.loads(epp.dumps(parser))
+        self.assertIsNot(loaded, parser)
+        for string in ["(1+(2+3))+4 ab,12else0x1f", "1+2 a,1if0x", "1+ a,1if"]:
+            with self.subTest(string=string):
+                expected = epp.parse(None, string, parser, True)
+                output = epp.parse(None, string, loaded, True)
+                if isinstance(expected, epp.ParsingFailure):
+                    self.assertIsInstance(output, epp.ParsingFailure)
+                    self.assertEqual(output.code, expected.code)
+                else:
+                    self.assertEqual(output[1], expected[1])
+
+    def test_dumps_positive_2(self):
+        """
+        Test 'dumps' function, positive check #2.
+
+        Test that wrapped, optimized and compiled grammars, and grammars with
+        effects and reusable iterators, are pickled as what they were made
+        from.
+        """
+        items = epp.chain(epp.reuse_iter(it.repeat, epp.literal("a"), 2))
+        for make in [epp.greedy, epp.optimize, epp.compile, epp.iterative]:
+            with self.subTest(make=make.__name__):
+                parser = make(epp.chain([epp.greedy(epp.many(epp.any_char())), items,
+                                         epp.effect(append_parsed), epp.lazy(sums)]))
+                buffer = io.BytesIO()
+                epp.dump(parser, buffer)
+                buffer.seek(0)
+                loaded = pickle.load(buffer)
+                self.assertEqual(type(loaded), type(parser))
+                self.assertEqual(epp.is_greedy(loaded), epp.is_greedy(parser))
+                self.assertEqual(epp.parse("", "xyaa1+2", loaded)[0], "aa")
+                for string in ["xyaa1+2", "aa1", "a1"]:
+                    expected = epp.parse("", string, parser)
+                    output = epp.parse("", string, loaded)
+                    if expected is None:
+                        self.assertIsNone(output)
+                    else:
+                        self.assertEqual(output[0], expected[0])
+                        self.assertEqual(output[1].parsed, expected[1].parsed)
+
+    def test_eager_negative_1(self):
+        """
+        Test eager application of effects, negative check #1.
+
+        Test that effects that could still be undone are not applied.
+        """
+        seed = []
+        push = epp.effect(lambda val, st: val.append(st.parsed) or val)
+        item = epp.chain([epp.digit(), push, epp.digit()])
+        parser = epp.chain([epp.many(item), epp.branch([epp.chain([epp.digit(), push, epp.literal("!")]),
+                                                        epp.digit()])])
+        value, after = epp.parse(seed, "1234567", parser, eager=True)
+        self.assertIs(value, seed)
+        self.assertEqual(value, ["1", "3", "5"])
+        self.assertEqual(after.left, "")
+        seed = []
+        output = epp.parse(seed, "12345", epp.many(item, 3), eager=True)
+        self.assertIsNone(output)
+
+    def test_eager_positive_1(self):
+        """
+        Test eager application of effects, positive check #1.
+
+        Test that effects are applied after every iteration of a repeat.
+        """
+        seed = []
+        log = []
+        watch = epp.test(lambda st: log.append(len(seed)) or True)
+        push = epp.effect(lambda val, st: val.append(st.parsed) or val)
+        parser = epp.many(epp.chain([watch, epp.digit(), push]))
+        value, _ = epp.parse(seed, "1234", parser, eager=True)
+        self.assertEqual(value, ["1", "2", "3", "4"])
+        self.assertEqual(log, [0, 1, 2, 3, 4])
+        seed = []
+        log.clear()
+        value, _ = epp.parse(seed, "1234", parser)
+        self.assertEqual(value, ["1", "2", "3", "4"])
+        self.assertEqual(log, [0, 0, 0, 0, 0])
+
+    def test_eager_positive_2(self):
+        """
+        Test eager application of effects, positive check #2.
+
+        Test that effects are applied at commit points, in order.
+        """
+        seed = []
+        log = []
+        watch = epp.test(lambda st: log.append(list(seed)) or True)
+        push = epp.effect(lambda val, st: val.append(st.parsed) or val)
+        item = epp.chain([epp.alpha(), push, epp.literal("("), push, epp.commit(), watch,
+                          epp.digit(), push, epp.literal(")")], all_or_nothing=False)
+        parser = epp.lazy(lambda: epp.branch([item, epp.digit()]))
+        value, _ = epp.parse(seed, "a(1)", parser, eager=True)
+        self.assertEqual(value, ["a", "(", "1"])
+        self.assertEqual(log, [["a", "("]])
+
+    def test_eager_negative_2(self):
+        """
+        Test eager application of effects, negative check #2.
+
+        Test that grammars that stop parsing have the same outcomes as with
+        effects applied at the end.
+        """
+        push = epp.effect(lambda val, st: val + [st.parsed])
+        word = epp.chain([epp.alpha(), push])
+        parsers = [
+            epp.chain([epp.literal("a"), push, epp.stop(), epp.literal("b")]),
+            epp.chain([epp.chain([epp.commit(), epp.many(epp.alpha()),
+                                  epp.chain([push, epp.stop(True)], stop_on_failure=True)]),
+                       epp.commit()]),
+            epp.chain([epp.literal("a"), push, epp.commit(), epp.stop()], all_or_nothing=False),
+            epp.chain([word, epp.commit(), epp.many(word), epp.stop()], all_or_nothing=False),
+            epp.many(epp.chain([word, epp.stop()], all_or_nothing=False), 2),
+            epp.many(epp.chain([epp.many(word, 0, 2),
+                                epp.maybe(epp.chain([epp.digit(), epp.stop()]))]), 1),
+            epp.chain([epp.many(word), epp.stop()]),
+            epp.lazy(lambda: epp.branch([epp.chain([epp.alpha(), push, epp.stop()],
+                                                   all_or_nothing=False),
+                                         epp.digit()])),
+            ]
+        for parser in parsers:
+            for string in ["abc", "a1b", "ab12", "1"]:
+                expected = epp.parse([], string, parser)
+                output = epp.parse([], string, parser, eager=True)
+                if expected is None:
+                    self.assertIsNone(output)
+                else:
+                    self.assertEqual(output[0], expected[0])
+                    self.assertEqual(output[1]._replace(effect=None),
+                                     expected[1]._replace(effect=None))
+
     def test_fail(self):
         """ Test 'fail' parser generator. """
         string = "irrelevant"
@@ -312,6 +715,24 @@ class TestCore(unittest.TestCase):
         output = epp.parse(None, state, parser)
         self.assertIsNone(output)
 
+    def test_first_chars(self):
+        """ Test finding out the characters a match may start with. """
+        def describe(parser, chars="-1a "):
+            """ Return the characters passing the test and the nullable flag. """
+            test, nullable = epp.get_first_chars(parser)
+            return "".join(char for char in chars if test(char)), nullable
+        self.assertEqual(describe(epp.integer()), ("1", False))
+        self.assertEqual(describe(epp.many(epp.digit())), ("1", True))
+        self.assertEqual(describe(epp.maybe(epp.literal("-"))), ("-", True))
+        self.assertEqual(describe(epp.multi(["-x", "ab"])), ("-a", False))
+        self.assertEqual(
+            describe(epp.chain([epp.maybe(epp.literal("-")), epp.integer(), epp.alpha()])),
+            ("-1", False))
+        self.assertEqual(describe(epp.chain([epp.effect(None), epp.maybe(epp.digit())])),
+                         ("1", True))
+        self.assertIsNone(epp.get_first_chars(epp.chain([epp.test(bool), epp.digit()])))
+        self.assertIsNone(epp.get_first_chars(epp.chain(iter([epp.digit()]))))
+
     def test_identity(self):
         """ Test 'identity' parser generator. """
         string = "foobar"
@@ -323,6 +744,165 @@ class TestCore(unittest.TestCase):
         self.assertIsNone(value)
         self.assertEqual(after, state)
 
+    def test_interned_negative_1(self):
+        """
+        Test 'interned' parser generator decorator, negative check #1.
+
+        Test that calls with different or unhashable arguments get different
+        parsers.
+        """
+        self.assertIsNot(epp.literal("a"), epp.literal("b"))
+        self.assertIsNot(epp.literal("a"), epp.literal("a", True))
+        self.assertIsNot(epp.many(epp.digit(), 1), epp.many(epp.digit(), True))
+        self.assertIsNot(epp.chain([epp.digit()]), epp.chain([epp.digit()]))
+        self.assertIsNot(epp.literal.__wrapped__("a"), epp.literal("a"))
+        ref = weakref.ref(epp.literal("not kept"))
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_interned_negative_2(self):
+        """
+        Test 'interned' parser generator decorator, negative check #2.
+
+        Test that giving a shared parser lookahead leaves the other uses of it
+        alone.
+        """
+        comma = epp.literal(",")
+        greedy_comma = epp.copy_lookahead(epp.greedy(epp.digit()), epp.literal(","))
+        self.assertTrue(epp.is_greedy(greedy_comma))
+        self.assertFalse(epp.has_lookahead(comma))
+        self.assertFalse(epp.has_lookahead(epp.literal(",")))
+        self.assertIs(epp.copy_lookahead(epp.digit(), comma), comma)
+        self.assertTrue(epp.is_reluctant(
+            epp.copy_lookahead(epp.reluctant(epp.digit()), epp.literal(","))))
+        self.assertFalse(epp.has_lookahead(comma))
+        comma_scan = epp.get_scan(comma)
+        digit_scan = epp.get_scan(epp.digit())
+        scanned = epp.copy_scan(epp.digit(), comma)
+        self.assertIsNot(scanned, comma)
+        self.assertIs(epp.get_scan(scanned), digit_scan)
+        self.assertIs(epp.get_scan(comma), comma_scan)
+        self.assertEqual(epp.parse(None, ",", scanned)[1].left_start, 1)
+
+    def test_interned_positive_1(self):
+        """
+        Test 'interned' parser generator decorator, positive check #1.
+
+        Test that equal parsers are shared, and so are their packrat entries.
+        """
+        self.assertIs(epp.digit(), epp.digit())
+        self.assertIs(epp.literal(",", ignore_case=True), epp.literal(",", ignore_case=True))
+        self.assertIs(epp.maybe(epp.white_char()), epp.maybe(epp.white_char()))
+        self.assertIs(epp.chain((epp.digit(), epp.alpha())), epp.chain((epp.digit(), epp.alpha())))
+        transformer = lambda failure: failure
+        self.assertIs(epp.modify_error(epp.integer(), transformer),
+                      epp.modify_error(epp.integer(), transformer))
+        made = []
+        @epp.interned
+        def pair(left, right):
+            """ Return a chain of two literals. """
+            made.append(None)
+            return epp.chain([epp.literal(left), epp.literal(right)])
+        self.assertIs(pair("a", "b"), pair("a", "b"))
+        self.assertEqual(len(made), 1)
+        self.assertEqual(pair.__doc__, " Return a chain of two literals. ")
+        def alternatives(literal):
+            """ Return a branch of two chains starting with the same literal. """
+            return epp.branch([epp.chain([literal("a"), literal("b")]),
+                               epp.chain([literal("a"), literal("c")])])
+        sizes = []
+        for literal in [epp.literal.__wrapped__, epp.literal]:
+            cache = epp.PackratCache()
+            output = epp.parse(None, "ac", alternatives(literal), packrat=cache)
+            self.assertEqual(output[1].parsed, "ac")
+            sizes.append(len(cache))
+        self.assertLess(sizes[1], sizes[0])
+
+    def test_interned_positive_2(self):
+        """
+        Test 'interned' parser generator decorator, positive check #2.
+
+        Test that parsers that aren't shared get lookahead in place.
+        """
+        def own(state):
+            return state
+        self.assertIs(epp.copy_lookahead(epp.greedy(epp.digit()), own), own)
+        self.assertTrue(epp.is_greedy(own))
+
+    def test_iterative_negative_1(self):
+        """
+        Test 'iterative', negative check #1.
+
+        Test that failures are reported like the original parser does.
+        """
+        cell = [None]
+        nested = epp.lazy(lambda: cell[0])
+        cell[0] = epp.branch([
+            epp.chain([epp.literal("("), epp.commit(), epp.maybe(nested), epp.literal(")")]),
+            epp.digit()])
+        parser = epp.iterative(nested)
+        for string in ["", "x", "(1", "((1)", "(()"]:
+            expected = epp.parse(None, string, nested, verbose=True)
+            output = epp.parse(None, string, parser, verbose=True)
+            self.assertIsInstance(output, epp.ParsingFailure)
+            self.assertEqual(output.code, expected.code)
+            self.assertEqual(output.committed, expected.committed)
+            self.assertEqual(output.state._replace(), expected.state._replace())
+        output = epp.parse(None, "(" * 5000 + "1" + ")" * 4999, parser, verbose=True)
+        self.assertIsInstance(output, epp.ParsingFailure)
+        self.assertTrue(output.committed)
+        self.assertEqual(output.state.left_start, 10000)
+
+    def test_iterative_positive_1(self):
+        """
+        Test 'iterative', positive check #1.
+
+        Test parsing input nested deeper than the recursion limit allows.
+        """
+        cell = [None]
+        nested = epp.lazy(lambda: cell[0])
+        depth = epp.effect(lambda val, st: val + 1)
+        cell[0] = epp.branch([
+            epp.chain([epp.literal("["), epp.maybe(nested), epp.literal("]"), depth]),
+            epp.modify_error(epp.digit(), lambda failure: failure)])
+        string = "[" * 5000 + "1" + "]" * 5000 + "!"
+        with self.assertRaises(RecursionError):
+            epp.parse(0, string, nested)
+        value, after = epp.parse(0, string, epp.iterative(nested))
+        self.assertEqual(value, 5000)
+        self.assertEqual(after.parsed, string[:-1])
+        self.assertEqual(after.left, "!")
+        value, after = epp.parse(0, string, epp.iterative(nested), eager=True)
+        self.assertEqual(value, 5000)
+        value, after = epp.parse(0, "[[]]", epp.iterative(nested), packrat=epp.PackratCache())
+        self.assertEqual(value, 2)
+
+    def test_iterative_positive_2(self):
+        """
+        Test 'iterative', positive check #2.
+
+        Test that iterative parsers return the same values and states.
+        """
+        push = epp.effect(lambda val, st: val + [st.parsed])
+        cell = [None]
+        expr = epp.lazy(lambda: cell[0])
+        item = epp.branch([epp.chain([epp.integer(), push]),
+                           epp.chain([epp.literal("("), expr, epp.literal(")")])])
+        cell[0] = epp.branch([epp.chain([expr, epp.literal("+"), item, push]),
+                              epp.chain([item, epp.noconsume(epp.literal(";")), epp.stop()]),
+                              item])
+        parser = epp.iterative(expr)
+        for string in ["1+2", "(1+(2+3))+4", "1;+2", "(1)+2;", "1+"]:
+            expected = epp.parse([], string, expr)
+            output = epp.parse([], string, parser)
+            self.assertEqual(output[0], expected[0])
+            self.assertEqual(output[1]._replace(), expected[1]._replace())
+        greedy = epp.chain([epp.greedy(epp.many(epp.any_char())), epp.literal("+"), expr])
+        value, after = epp.parse([], "1+2", epp.iterative(greedy))
+        self.assertEqual(value, ["2"])
+        self.assertIsNone(epp.get_steps(epp.literal("a")))
+        self.assertIsNotNone(epp.get_steps(expr))
+
     def test_lazy(self):
         """ Test 'lazy' parser generator. """
         def generator():
@@ -339,6 +919,137 @@ class TestCore(unittest.TestCase):
         self.assertEqual(after.left, "")
         self.assertEqual(after.parsed, string)
 
+    def test_lazy_caching(self):
+        """ Test that 'lazy' reuses the parsers its generator builds. """
+        calls = []
+        def generator():
+            """ Return a recursive parser, counting the calls. """
+            calls.append(None)
+            inner = epp.maybe(epp.lazy(generator))
+            return epp.chain([epp.literal("("), inner, epp.literal(")")])
+        parser = epp.lazy(generator)
+        string = "((()))"
+        output = epp.parse(None, string, parser)
+        self.assertIsNotNone(output)
+        self.assertEqual(output[1].parsed, string)
+        num_calls = len(calls)
+        self.assertIsNone(epp.parse(None, "(()", parser))
+        self.assertIsNone(epp.parse(None, "(()())", parser))
+        self.assertIsNotNone(epp.parse(None, "(((())))", parser))
+        self.assertIsNotNone(epp.parse(None, "()", parser))
+        self.assertEqual(len(calls), num_calls)
+
+    def test_lazy_uncached(self):
+        """ Test 'uncached_lazy' parser generator. """
+        calls = []
+        def generator():
+            """ Return a parser, counting the calls. """
+            calls.append(None)
+            return epp.literal("a")
+        parser = epp.uncached_lazy(generator)
+        for _ in range(3):
+            self.assertIsNotNone(epp.parse(None, "a", parser))
+        self.assertEqual(len(calls), 3)
+
+    def test_left_recursion_negative_1(self):
+        """ Test left-recursive lazy parsers, negative check #1. """
+        def loop():
+            """ Return a parser that never gets anywhere. """
+            return epp.chain([epp.lazy(loop), epp.literal("a")])
+        output = epp.parse(None, "aaa", epp.lazy(loop), verbose=True)
+        self.assertIsInstance(output, epp.ParsingFailure)
+        self.assertEqual(output.code, epp.LazyError.LEFT_RECURSION)
+
+    def test_left_recursion_negative_2(self):
+        """
+        Test left-recursive lazy parsers, negative check #2.
+
+        Test that left recursion is detected behind a prefix that consumes
+        nothing but changes the 'parsed' window.
+        """
+        def loop():
+            """ Return a parser that never gets anywhere. """
+            return epp.chain([epp.maybe(epp.literal(" ")), epp.lazy(loop), epp.literal("a")])
+        parser = epp.chain([epp.literal("b"), epp.lazy(loop)])
+        output = epp.parse(None, "baaa", parser, verbose=True)
+        self.assertIsInstance(output, epp.ParsingFailure)
+        self.assertEqual(output.code, epp.LazyError.LEFT_RECURSION)
+
+    def test_left_recursion_positive_1(self):
+        """
+        Test left-recursive lazy parsers, positive check #1.
+
+        Test left associativity of a directly left-recursive parser.
+        """
+        def subtract(val, st):
+            """ Subtract the parsed number from the last value. """
+            return val[:-1] + [val[-1] - int(st.parsed)]
+        def expr():
+            """ Return a parser of differences. """
+            number = epp.chain([epp.integer(), epp.effect(lambda val, st: val + [int(st.parsed)])])
+            return epp.branch([
+                epp.chain([epp.lazy(expr), epp.literal("-"), epp.integer(), epp.effect(subtract)]),
+                number])
+        parser = epp.lazy(expr)
+        for packrat in [None, epp.PackratCache()]:
+            value, after = epp.parse([], "10-3-2x", parser, packrat=packrat)
+            self.assertEqual(value, [5])
+            self.assertEqual(after.parsed, "10-3-2")
+            self.assertEqual(after.left, "x")
+        string = "-".join(str(i) for i in range(2000))
+        value, after = epp.parse([], string, parser)
+        self.assertEqual(value, [-sum(range(2000))])
+        self.assertEqual(after.left, "")
+
+    def test_left_recursion_positive_2(self):
+        """
+        Test left-recursive lazy parsers, positive check #2.
+
+        Test indirect left recursion, scanning and packrat mode.
+        """
+        def rule_a():
+            """ Return a parser of A := B 'a' | 'x'. """
+            return epp.branch([epp.chain([epp.lazy(rule_b), epp.literal("a")]), epp.literal("x")])
+        def rule_b():
+            """ Return a parser of B := A 'b' | 'y'. """
+            return epp.branch([epp.chain([epp.lazy(rule_a), epp.literal("b")]), epp.literal("y")])
+        parser = epp.lazy(rule_a)
+        for packrat in [None, epp.PackratCache()]:
+            for string, parsed in [("x", "x"), ("xbaba", "xbaba"), ("yaba", "yaba"), ("xbab", "xba")]:
+                _, after = epp.parse(None, string, parser, packrat=packrat)
+                self.assertEqual(after.parsed, parsed)
+            self.assertIsNone(epp.parse(None, "b", parser, packrat=packrat))
+        self.assertIsNotNone(epp.get_scan(parser))
+
+    def test_left_recursion_positive_3(self):
+        """
+        Test left-recursive lazy parsers, positive check #3.
+
+        Test that the seed grows behind a prefix that consumes nothing but
+        changes the 'parsed' window.
+        """
+        def expr():
+            """ Return a parser of E := ' '? E 'a' | 'x'. """
+            return epp.branch([
+                epp.chain([epp.maybe(epp.literal(" ")), epp.lazy(expr), epp.literal("a")]),
+                epp.literal("x")])
+        parser = epp.chain([epp.literal("b"), epp.lazy(expr)])
+        for packrat in [None, epp.PackratCache()]:
+            _, after = epp.parse(None, "bxaa", parser, packrat=packrat)
+            self.assertEqual(after.parsed, "bxaa")
+
+    def test_loud_negative_1(self):
+        """ Test 'loud' function, negative check #1. """
+        def quiet_body(state):
+            """ A quiet parser that always fails. """
+            return epp.ParsingFailure(state, "quiet failure")
+        parser = epp.loud(quiet_body)
+        self.assertIs(parser.quiet, quiet_body)
+        with self.assertRaises(epp.ParsingFailure):
+            _ = parser(epp.State("foo"))
+        output = epp.parse(None, "foo", parser, verbose=True)
+        self.assertTrue(isinstance(output, epp.ParsingFailure))
+
     def test_modify_error(self):
         """ Test 'modify_error' parser generator. """
         string = "irrelevant"
@@ -347,6 +1058,20 @@ class TestCore(unittest.TestCase):
         output = epp.parse(None, state, parser, verbose=True)
         self.assertEqual(output.args, ("!",))
 
+    def test_modify_error_negative_1(self):
+        """
+        Test 'modify_error' parser generator, negative check #1.
+
+        Test that exceptions other than ParsingFailure returned by the
+        transformer are raised.
+        """
+        parser = epp.chain([epp.modify_error(epp.fail(), lambda err: ValueError("!")),
+                            epp.literal("a")])
+        with self.assertRaises(ValueError):
+            epp.parse(None, "a", parser)
+        with self.assertRaises(ValueError):
+            epp.parse(None, "a", epp.iterative(epp.chain([parser])), packrat=epp.PackratCache())
+
     def test_noconsume(self):
         """ Test 'noconsume' parser generator. """
         string = "foo"
@@ -359,6 +1084,353 @@ class TestCore(unittest.TestCase):
         self.assertEqual(after.parsed, string)
         self.assertEqual(after.left, string)
 
+    def test_optimize_negative_1(self):
+        """
+        Test 'optimize', negative check #1.
+
+        Test that failures keep their codes.
+        """
+        parser = epp.chain([epp.literal("ab"), epp.chain([epp.literal("cd"), epp.digit()])])
+        optimized = epp.optimize(parser)
+        for string in ["x", "abx", "abcdx", "abc"]:
+            expected = epp.parse(None, string, parser, verbose=True)
+            output = epp.parse(None, string, optimized, verbose=True)
+            self.assertEqual(output.code, expected.code)
+
+    def test_optimize_positive_1(self):
+        """
+        Test 'optimize', positive check #1.
+
+        Test factoring out the common start of alternatives.
+        """
+        calls = []
+        def keyword(state):
+            """ Record the call and match 'let'. """
+            calls.append(state.left_start)
+            return epp.literal("let")(state)
+        push = lambda val, st: val + [st.parsed]
+        name = epp.chain([epp.alpha_word(), epp.effect(push)])
+        parser = epp.branch([
+            epp.chain([keyword, epp.literal(" "), name, epp.literal("=")]),
+            epp.chain([keyword, epp.literal(" "), name, epp.literal(":")]),
+            epp.literal("let")])
+        optimized = epp.optimize(parser)
+        for string in ["let x:", "let x=", "let", "foo"]:
+            expected = epp.parse([], string, parser)
+            output = epp.parse([], string, optimized)
+            if expected is None:
+                self.assertIsNone(output)
+            else:
+                self.assertEqual(output[0], expected[0])
+                self.assertEqual(output[1]._replace(), expected[1]._replace())
+        calls.clear()
+        value, after = epp.parse([], "let x:", optimized)
+        self.assertEqual(value, ["x"])
+        self.assertEqual(after.parsed, "let x:")
+        self.assertEqual(calls, [0])
+        cut = epp.commit()
+        parser = epp.branch([
+            epp.chain([epp.literal("a"), cut, epp.literal("b")]),
+            epp.chain([epp.literal("a"), cut, epp.literal("c")])])
+        optimized = epp.optimize(parser)
+        output = epp.parse(None, "ac", optimized, verbose=True)
+        self.assertIsInstance(output, epp.ParsingFailure)
+        self.assertTrue(output.committed)
+
+    def test_optimize_positive_3(self):
+        """
+        Test 'optimize', positive check #3.
+
+        Test that the common start of alternatives made of literals is
+        factored out before the literals are fused.
+        """
+        parser = epp.branch([epp.chain([epp.literal("ab"), epp.literal("c")]),
+                             epp.chain([epp.literal("ab"), epp.literal("d")]),
+                             epp.chain([epp.literal("a"), epp.literal("bde")])])
+        optimized = epp.optimize(parser)
+        self.assertEqual(len(optimized.funcs), 2)
+        factored = optimized.funcs[0]
+        self.assertEqual(factored.funcs[0].literal_string, "ab")
+        rest = factored.funcs[1].funcs
+        self.assertEqual([alt.funcs[0].literal_string for alt in rest], ["c", "d"])
+        self.assertEqual(optimized.funcs[1].funcs[0].literal_string, "abde")
+        for string in ["abc", "abd", "abde", "ab", "ax"]:
+            expected = epp.parse(None, string, parser, verbose=True)
+            output = epp.parse(None, string, optimized, verbose=True)
+            if isinstance(expected, epp.ParsingFailure):
+                self.assertEqual(output.code, expected.code)
+            else:
+                self.assertEqual(output[1]._replace(), expected[1]._replace())
+
+    def test_optimize_positive_2(self):
+        """
+        Test 'optimize', positive check #2.
+
+        Test that stopping inside factored alternatives works the same.
+        """
+        stop = epp.chain([epp.literal("!"), epp.stop()])
+        for all_or_nothing in [True, False]:
+            parser = epp.branch([
+                epp.chain([epp.literal("a"), epp.literal("b"), stop],
+                          all_or_nothing=all_or_nothing),
+                epp.chain([epp.literal("a"), epp.literal("c")], all_or_nothing=all_or_nothing)])
+            parser = epp.chain([parser, epp.literal("?")])
+            optimized = epp.optimize(parser)
+            for string in ["ab!?", "ab!", "ac?"]:
+                expected = epp.parse(None, string, parser)
+                output = epp.parse(None, string, optimized)
+                if expected is None:
+                    self.assertIsNone(output)
+                else:
+                    self.assertEqual(output[1]._replace(), expected[1]._replace())
+
+    def test_packrat_negative_1(self):
+        """
+        Test packrat mode, negative check #1.
+
+        Test that remembered failures are reported the same way as fresh ones.
+        """
+        prefix = epp.chain([epp.literal("let"), epp.whitespace()])
+        parser = epp.branch(
+            [epp.chain([prefix, epp.literal("x")]),
+             epp.chain([prefix, epp.literal("y")])])
+        cache = epp.PackratCache()
+        output = epp.parse(None, "let z", parser, verbose=True, packrat=cache)
+        self.assertTrue(isinstance(output, epp.ParsingFailure))
+        self.assertEqual(output.code, epp.BranchError.ALL_FAILED)
+
+    def test_packrat_negative_2(self):
+        """ Test packrat mode, negative check #2. """
+        with self.assertRaises(ValueError):
+            _ = epp.PackratCache(0)
+
+    def test_packrat_positive_1(self):
+        """
+        Test packrat mode, positive check #1.
+
+        Test that a shared prefix is only parsed once per position.
+        """
+        prefix = epp.chain([epp.literal("let"), epp.whitespace()])
+        parser = epp.branch(
+            [epp.chain([prefix, epp.literal("x")]),
+             epp.chain([prefix, epp.literal("y")])])
+        cache = epp.PackratCache()
+        output = epp.parse(None, "let y", parser, packrat=cache)
+        self.assertIsNotNone(output)
+        _, after = output
+        self.assertEqual(after.parsed, "let y")
+        self.assertEqual(after.left, "")
+        self.assertEqual(cache.hits, 1)
+        _, uncached = epp.parse(None, "let y", parser)
+        self.assertEqual(after[2:], uncached[2:])
+
+    def test_packrat_positive_2(self):
+        """
+        Test packrat mode, positive check #2.
+
+        Test that the cache doesn't grow beyond its maximum size.
+        """
+        elem = epp.chain([epp.digit(), epp.effect(lambda val, st: val + 1)])
+        parser = epp.chain([epp.many(elem), epp.end_of_input()])
+        cache = epp.PackratCache(maxsize=4)
+        output = epp.parse(0, "1234567890", parser, packrat=cache)
+        self.assertIsNotNone(output)
+        value, _ = output
+        self.assertEqual(value, 10)
+        self.assertLessEqual(len(cache), 4)
+        self.assertGreater(cache.misses, 0)
+
+    def test_quiet_negative_1(self):
+        """
+        Test 'quiet' function, negative check #1.
+
+        Test that failures raised by a user-written parser are returned.
+        """
+        def raising(state):
+            """ A parser that always raises. """
+            raise epp.ParsingFailure(state, "loud failure", 42)
+        output = epp.quiet(raising)(epp.State("foo"))
+        self.assertTrue(isinstance(output, epp.ParsingFailure))
+        self.assertEqual(output.code, 42)
+        parser = epp.branch([raising, epp.literal("f")])
+        self.assertIsNotNone(epp.parse(None, "foo", parser))
+
+    def test_quiet_positive_1(self):
+        """ Test 'quiet' function, positive check #1. """
+        output = epp.quiet(epp.literal("f"))(epp.State("foo"))
+        self.assertFalse(isinstance(output, epp.ParsingFailure))
+        self.assertEqual(output.left, "oo")
+        output = epp.quiet(epp.literal("x"))(epp.State("foo"))
+        self.assertTrue(isinstance(output, epp.ParsingFailure))
+        self.assertEqual(output.code, epp.LiteralError.DOESNT_START)
+
+    def test_repeat_negative_1(self):
+        """ Test 'repeat' parser generator, negative check #1. """
+        parser = epp.repeat(epp.literal("ab"), 3)
+        output = epp.parse(None, "ababa", parser, verbose=True)
+        self.assertTrue(isinstance(output, epp.ParsingFailure))
+        self.assertEqual(output.state.left, "a")
+
+    def test_repeat_positive_1(self):
+        """
+        Test 'repeat' parser generator, positive check #1.
+
+        Test that a parser that consumes nothing is not repeated forever.
+        """
+        parser = epp.repeat(epp.maybe(epp.literal("a")))
+        output = epp.parse(None, "aab", parser)
+        self.assertIsNotNone(output)
+        _, after = output
+        self.assertEqual(after.parsed, "aa")
+        self.assertEqual(after.left, "b")
+
+    def test_repeat_positive_2(self):
+        """
+        Test 'repeat' parser generator, positive check #2.
+
+        Test that stopping inside the loop keeps the matches made before it.
+        """
+        end = epp.chain([epp.literal(";"), epp.stop()], all_or_nothing=False)
+        body = epp.chain([epp.literal("ab"), epp.maybe(end)])
+        output = epp.parse(None, "abab;c", epp.repeat(body))
+        self.assertIsNotNone(output)
+        _, after = output
+        self.assertEqual(after.parsed, "ab")
+        self.assertEqual(after.left, "ab;c")
+
+    def test_repeat_positive_3(self):
+        """
+        Test 'repeat' parser generator, positive check #3.
+
+        Test that a stopped branch, which consumes nothing, ends the loop.
+        """
+        body = epp.branch([epp.chain([epp.literal(";"), epp.stop()]),
+                           epp.literal("ab")])
+        output = epp.parse(None, "abab;c", epp.repeat(body))
+        self.assertIsNotNone(output)
+        _, after = output
+        self.assertEqual(after.parsed, "abab")
+        self.assertEqual(after.left, ";c")
+
+    def test_scan_negative_1(self):
+        """
+        Test cursor-scanning forms, negative check #1.
+
+        Test that parsers with effects, lookahead or strict branches have none.
+        """
+        effect = epp.effect(lambda val, st: val)
+        self.assertIsNone(epp.get_scan(epp.chain([epp.literal("a"), effect])))
+        self.assertIsNone(epp.get_scan(epp.many(epp.chain([epp.literal("a"), effect]))))
+        self.assertIsNone(epp.get_scan(epp.chain([epp.greedy(epp.many(epp.digit()))])))
+        self.assertIsNone(epp.get_scan(epp.branch([epp.literal("a")], strictly_one=True)))
+        self.assertIsNone(epp.get_scan(epp.uncached_lazy(epp.literal, "a")))
+        self.assertIsNone(epp.get_scan(epp.chain(iter([epp.literal("a")]))))
+
+    def test_scan_positive_1(self):
+        """
+        Test cursor-scanning forms, positive check #1.
+
+        Test that scanning gives the same results and failures as the usual
+        parsing, which is what packrat mode uses.
+        """
+        parsers = [
+            epp.chain([epp.integer(), epp.maybe(epp.literal("+")), epp.alpha_word()],
+                      stop_on_failure=True),
+            epp.chain([epp.many(epp.digit(), 1, 2, combine=False),
+                       epp.noconsume(epp.literal("a")), epp.take(2)]),
+            epp.many(epp.branch([epp.literal("ab"), epp.literal("a"), epp.identity()]), 0, 3),
+            epp.chain([epp.multi(["a", "ab", "("]), epp.everything()], combine=False),
+            epp.chain([epp.branch([epp.alpha(), epp.digit()]), epp.end_of_input()]),
+            epp.many(epp.chain([epp.whitespace(0), epp.hex_int()]), 1)]
+        for parser in parsers:
+            self.assertIsNotNone(epp.get_scan(parser))
+        strings = ["", "a", "ab", "1a", "12ab", "12+ab", "(1", "abab", "0x1f 2", " 3 g"]
+        for parser, string in it.product(parsers, strings):
+            scanned = epp.parse(None, string, parser, True)
+            parsed = epp.parse(None, string, parser, True, epp.PackratCache())
+            if isinstance(parsed, epp.ParsingFailure):
+                self.assertIsInstance(scanned, epp.ParsingFailure)
+                self.assertEqual(scanned.code, parsed.code)
+                self.assertEqual(scanned.state.left_start, parsed.state.left_start)
+            else:
+                self.assertEqual(scanned[1].parsed, parsed[1].parsed)
+                self.assertEqual(scanned[1].left, parsed[1].left)
+
+    def test_scan_positive_2(self):
+        """
+        Test cursor-scanning forms, positive check #2.
+
+        Test that recursive grammars have them.
+        """
+        def expr():
+            """ Return a parser of sums with parentheses. """
+            term = epp.branch([epp.integer(),
+                               epp.chain([epp.literal("("), epp.lazy(expr), epp.literal(")")])])
+            return epp.chain([term, epp.many(epp.chain([epp.literal("+"), term]))])
+        parser = epp.lazy(expr)
+        output = epp.parse(None, "(1+(2+3))+4-", parser)
+        self.assertIsNotNone(output)
+        self.assertEqual(output[1].parsed, "(1+(2+3))+4")
+        self.assertEqual(output[1].left, "-")
+        self.assertIsNotNone(epp.get_scan(parser))
+        failure = epp.parse(None, "(1+(2+", parser, True)
+        self.assertIsInstance(failure, epp.ParsingFailure)
+
+    def test_seal_positive_1(self):
+        """
+        Test 'seal' parser generator, positive check #1.
+
+        Test that chains over reusable iterators seal themselves once they
+        have run out of parsers.
+        """
+        calls = []
+        def gen():
+            """ Yield the parsers of the chain. """
+            calls.append(None)
+            yield epp.literal("a")
+            yield epp.literal("b")
+        parser = epp.chain(epp.reuse_iter(gen))
+        self.assertNotIsInstance(parser.parsers, tuple)
+        output = epp.parse(None, "abc", parser)
+        self.assertIsNotNone(output)
+        self.assertEqual(output[1].left, "c")
+        self.assertIsInstance(parser.parsers, tuple)
+        count = len(calls)
+        for string in ["ab", "ax", "abab"]:
+            epp.parse(None, string, parser, True)
+        self.assertIsNotNone(epp.get_first_chars(parser))
+        self.assertEqual(len(calls), count)
+
+    def test_seal_positive_2(self):
+        """
+        Test 'seal' parser generator, positive check #2.
+
+        Test that 'seal' reaches into lazy parsers and wrappers, keeps the
+        results and leaves one-shot iterators alone.
+        """
+        def expr():
+            """ Return a parser of sums with parentheses. """
+            term = epp.branch(epp.reuse_iter(lambda: iter(
+                [epp.integer(),
+                 epp.chain([epp.literal("("), epp.lazy(expr), epp.literal(")")])])))
+            return epp.chain([term, epp.many(epp.maybe(epp.chain([epp.literal("+"), term])))])
+        sealed = epp.lazy(expr)
+        self.assertIs(epp.seal(sealed), sealed)
+        branch = sealed.build().parsers[0]
+        self.assertIsInstance(branch.parsers, tuple)
+        for string in ["1+2", "(1+(2+3))+4-", "(1+(2+", "x"]:
+            with self.subTest(string=string):
+                expected = epp.parse(None, string, epp.lazy(expr), True)
+                output = epp.parse(None, string, sealed, True)
+                if isinstance(expected, epp.ParsingFailure):
+                    self.assertIsInstance(output, epp.ParsingFailure)
+                else:
+                    self.assertEqual(output[1].parsed, expected[1].parsed)
+                    self.assertEqual(output[1].left, expected[1].left)
+        parsers = iter([epp.literal("a"), epp.literal("b")])
+        parser = epp.seal(epp.chain(parsers))
+        self.assertEqual(next(parsers).literal_string, "a")
+
     def test_stop(self):
         """ Test 'stop' parser generator. """
         string = "123"
@@ -1084,6 +2156,21 @@ class TestParsers(unittest.TestCase):
         self.assertEqual(after.left, "o")
         self.assertEqual(after.parsed, "fo")
 
+    def test_literal_positive_2(self):
+        """
+        Test 'literal' parser generator, positive check #2.
+
+        Test ignoring case.
+        """
+        parser = epp.literal("Straße", ignore_case=True)
+        output = epp.parse(None, "STRASSE", parser)
+        self.assertIsNone(output)
+        output = epp.parse(None, "strASSe!", epp.literal("STRAsse", ignore_case=True))
+        self.assertIsNotNone(output)
+        _, after = output
+        self.assertEqual(after.parsed, "strASSe")
+        self.assertEqual(after.left, "!")
+
     def test_maybe_positive_1(self):
         """ Test 'maybe' parser generator, negative check #1. """
         string = "foo"
@@ -1145,6 +2232,45 @@ class TestParsers(unittest.TestCase):
         self.assertEqual(after.parsed, "foofoo")
         self.assertEqual(after.left, "foo")
 
+    def test_many_negative_3(self):
+        """
+        Test 'many' parser generator, negative check #3.
+
+        Test that a run of single characters reports the failure of the
+        underlying parser.
+        """
+        parser = epp.many(epp.digit(), 3)
+        output = epp.parse(None, "12a", parser, verbose=True)
+        self.assertTrue(isinstance(output, epp.ParsingFailure))
+        self.assertEqual(output.code, epp.DigitError.NOT_DIGIT)
+        self.assertEqual(output.state.left, "a")
+
+    def test_many_negative_4(self):
+        """
+        Test 'many' parser generator, negative check #4.
+
+        Test that a parser with lookahead reports the failure of the underlying
+        parser, not a failed lookahead.
+        """
+        parser = epp.many(epp.reluctant(epp.digit()), 1, 3)
+        output = epp.parse(None, "a", parser, verbose=True)
+        self.assertTrue(isinstance(output, epp.ParsingFailure))
+        self.assertEqual(output.code, epp.DigitError.NOT_DIGIT)
+
+    def test_many_positive_3(self):
+        """
+        Test 'many' parser generator, positive check #3.
+
+        Test a run of single characters with an upper bound.
+        """
+        string = "12345"
+        parser = epp.many(epp.digit(), 1, 3, combine=False)
+        output = epp.parse(None, string, parser)
+        self.assertIsNotNone(output)
+        _, after = output
+        self.assertEqual(after.parsed, "3")
+        self.assertEqual(after.left, "45")
+
     def test_multi_negative_1(self):
         """ Test 'multi' parser generator, negative check #1. """
         string = "d"
@@ -1165,6 +2291,128 @@ class TestParsers(unittest.TestCase):
         self.assertEqual(after.left, "d")
         self.assertEqual(after.parsed, "b")
 
+    def test_multi_positive_2(self):
+        """
+        Test 'multi' parser generator, positive check #2.
+
+        Test which of several matching literals wins.
+        """
+        literals = ["ab", "abc", "a", "abc"]
+        _, after = epp.parse(None, "abcd", epp.multi(literals))
+        self.assertEqual(after.parsed, "ab")
+        _, after = epp.parse(None, "abcd", epp.multi(literals, longest=True))
+        self.assertEqual(after.parsed, "abc")
+        _, after = epp.parse(None, "ab", epp.multi(literals, longest=True))
+        self.assertEqual(after.parsed, "ab")
+        _, after = epp.parse(None, "x", epp.multi(["y", ""]))
+        self.assertEqual(after.parsed, "")
+
+    def test_multi_positive_3(self):
+        """
+        Test 'multi' parser generator, positive check #3.
+
+        Test ignoring case.
+        """
+        parser = epp.multi(["GET", "Post"], ignore_case=True)
+        _, after = epp.parse(None, "post /", parser)
+        self.assertEqual(after.parsed, "post")
+        _, after = epp.parse(None, "get /", parser)
+        self.assertEqual(after.parsed, "get")
+        self.assertIsNone(epp.parse(None, "put /", parser))
+
+    def test_operator_table_negative_1(self):
+        """ Test 'operator_table' parser generator, negative check #1. """
+        atom = epp.integer()
+        with self.assertRaises(ValueError):
+            _ = epp.operator_table(atom, [(epp.Fixity.INFIX_LEFT, {"": None})])
+        with self.assertRaises(ValueError):
+            _ = epp.operator_table(atom, [(epp.Fixity.INFIX_LEFT, {"+": None}),
+                                          (epp.Fixity.POSTFIX, {"+": None})])
+        with self.assertRaises(ValueError):
+            _ = epp.operator_table(atom, [(epp.Fixity.PREFIX, {"not": None}),
+                                          (epp.Fixity.PREFIX, {"NOT": None})],
+                                   ignore_case=True)
+        parser = epp.operator_table(atom, [(epp.Fixity.PREFIX, {"-": None}),
+                                           (epp.Fixity.INFIX_LEFT, {"+": None})])
+        output = epp.parse(None, "-+1", parser, verbose=True)
+        self.assertIsInstance(output, epp.ParsingFailure)
+        self.assertIs(output.code, epp.IntegerError.NON_INT)
+        self.assertIsNone(epp.parse(None, "", parser))
+
+    def test_operator_table_positive_1(self):
+        """
+        Test 'operator_table' parser generator, positive check #1.
+
+        Test precedence and associativity of infix operators.
+        """
+        def binary(val, state):
+            right = val.pop()
+            return val.append(f"({val.pop()}{state.parsed}{right})")
+        number = epp.chain([epp.integer(),
+                            epp.effect(lambda val, state: val.append(state.parsed))])
+        parser = epp.operator_table(number, [
+            (epp.Fixity.INFIX_LEFT, {"+": binary, "-": binary}),
+            (epp.Fixity.INFIX_LEFT, {"*": binary}),
+            (epp.Fixity.INFIX_RIGHT, {"**": binary})])
+        cases = [
+            ("1+2*3", "(1+(2*3))"),
+            ("1*2+3", "((1*2)+3)"),
+            ("10-3-2", "((10-3)-2)"),
+            ("2**3**2", "(2**(3**2))"),
+            ("1*2**3*4", "((1*(2**3))*4)"),
+            ("7", "7")]
+        for string, expected in cases:
+            value, after = epp.parse(epp.SRList(), string, parser)
+            self.assertEqual(value, [expected])
+            self.assertEqual(after.parsed, string)
+            self.assertEqual(after.left, "")
+        # A long expression doesn't recurse.
+        string = "-".join(["1"] * 5000)
+        value, after = epp.parse(epp.SRList(), string, parser)
+        self.assertEqual(after.left, "")
+        self.assertEqual(value[0].count("("), 4999)
+
+    def test_operator_table_positive_2(self):
+        """
+        Test 'operator_table' parser generator, positive check #2.
+
+        Test prefix and postfix operators, spacing and incomplete expressions.
+        """
+        def binary(val, state):
+            right = val.pop()
+            return val.append(f"({val.pop()} {state.parsed} {right})")
+        def prefix(val, state):
+            return val.append(f"({state.parsed} {val.pop()})")
+        def postfix(val, state):
+            return val.append(f"({val.pop()} {state.parsed})")
+        name = epp.chain([epp.alpha_word(),
+                          epp.effect(lambda val, state: val.append(state.parsed))])
+        parser = epp.operator_table(name, [
+            (epp.Fixity.INFIX_LEFT, {"or": binary}),
+            (epp.Fixity.INFIX_LEFT, {"and": binary}),
+            (epp.Fixity.PREFIX, {"not": prefix}),
+            (epp.Fixity.INFIX_LEFT, {"==": binary, "=": binary}),
+            (epp.Fixity.POSTFIX, {"?": postfix, "!": None})],
+            spacing=epp.maybe(epp.whitespace()),
+            ignore_case=True)
+        cases = [
+            ("not a and b", "((not a) and b)", ""),
+            ("a and not b == c or d", "((a and (not (b == c))) or d)", ""),
+            ("NOT not a?", "(NOT (not (a ?)))", ""),
+            ("a == b!", "(a == b)", ""),
+            ("a = b == c ", "((a = b) == c)", " "),
+            ("a or ", "a", " or "),
+            ("a or not 1", "(a or not)", " 1"),
+            ("a or b and 1", "(a or b)", " and 1")]
+        for string, expected, left in cases:
+            value, after = epp.parse(epp.SRList(), string, parser)
+            self.assertEqual(value, [expected])
+            self.assertEqual(after.left, left)
+        # A prefix operator may be a part of the atom.
+        parser = epp.operator_table(epp.integer(), [(epp.Fixity.PREFIX, {"1": None})])
+        _, after = epp.parse(None, "1x", parser)
+        self.assertEqual(after.parsed, "1")
+
     def test_repeat_while_negative_1(self):
         """ Test 'repeat_while' parser generator, negative check #1. """
         with self.assertRaises(ValueError):
@@ -1330,6 +2578,59 @@ class TestParsers(unittest.TestCase):
 class TestLookahead(unittest.TestCase):
     """ Test lookahead mechanism. """
 
+    def test_backtracking_memo(self):
+        """
+        Test that backtracking runs a parser at most once on every input
+        window.
+        """
+        calls = []
+        def rest(state):
+            """ Fail, recording the input. """
+            calls.append((state.left_start, state.parsed_start))
+            return epp.fail()(state)
+        field = epp.greedy(epp.many(epp.any_char()))
+        dash = epp.literal("-")
+        parser = epp.chain([field, dash, field, dash, field, rest])
+        self.assertIsNone(epp.parse(None, "ab-" * 5, parser))
+        self.assertEqual(len(calls), len(set(calls)))
+
+    def test_automaton(self):
+        """
+        Test that chains simulated by an automaton have the same outcomes as
+        backtracking ones.
+        """
+        word = epp.greedy(epp.many(epp.alpha()))
+        lazy_word = epp.reluctant(epp.many(epp.alpha(), 1))
+        chains = [
+            [epp.greedy(epp.many(epp.any_char())), epp.literal("x"), epp.many(epp.digit())],
+            [lazy_word, epp.literal("b"), word, epp.literal("1")],
+            [epp.literal("a"), word, epp.reluctant(epp.many(epp.alpha(), 0, 3)), epp.literal("ab")],
+            [word, epp.literal("-"), epp.greedy(epp.integer()), epp.literal("0")],
+            ]
+        strings = ["a" * 60 + "b" * 60 + "1", "ab" * 50 + "x12", "a" * 100 + "-10", "a" * 100]
+        for parsers in chains:
+            for string in strings:
+                simulated = epp.chain(parsers)
+                backtracking = epp.chain(iter(parsers))
+                expected = epp.parse(None, string, backtracking, verbose=True)
+                output = epp.parse(None, string, simulated, verbose=True)
+                if isinstance(expected, epp.ParsingFailure):
+                    self.assertIsInstance(output, epp.ParsingFailure)
+                    self.assertEqual(output.code, expected.code)
+                    self.assertEqual(output.state, expected.state)
+                else:
+                    self.assertEqual(output, expected)
+
+    def test_automaton_many_fields(self):
+        """ Test failing to split input into many greedy fields. """
+        field = epp.greedy(epp.many(epp.any_char()))
+        dash = epp.literal("-")
+        parser = epp.chain([field, dash] * 10 + [epp.literal("!")])
+        output = epp.parse(None, "a-" * 500, parser, verbose=True)
+        self.assertIsInstance(output, epp.ParsingFailure)
+        self.assertEqual(output.code, epp.ChainError.LOOKAHEAD_FAILED)
+        self.assertEqual(output.state.left_start, 1000)
+
     def test_branch_positive_1(self):
         """ Test lookahead in branches. """
         string = "2b"
@@ -1344,6 +2645,35 @@ class TestLookahead(unittest.TestCase):
         self.assertEqual(after.left, "")
         self.assertEqual(after.parsed, string)
 
+    def test_branch_positive_2(self):
+        """
+        Test that a chain only restricts the alternatives of a branch that
+        have lookahead.
+        """
+        parser = epp.chain(
+            [epp.branch([epp.many(epp.alpha()), epp.reluctant(epp.literal("a"))])])
+        output = epp.parse(None, "bb", parser)
+        self.assertIsNotNone(output)
+        self.assertEqual(output[1].parsed, "bb")
+        parser = epp.chain(
+            [epp.branch([epp.many(epp.digit(), 0, 2), epp.reluctant(epp.literal("x"))])])
+        output = epp.parse(None, "1bba", parser)
+        self.assertIsNotNone(output)
+        self.assertEqual(output[1].parsed, "1")
+
+    def test_branch_negative_1(self):
+        """
+        Test that wrapping restricted parsers in a chain doesn't skip the
+        parsers after them.
+        """
+        inner = epp.chain(
+            [epp.reluctant(epp.noconsume(epp.many(epp.digit(), 0, 2))),
+             epp.chain([epp.reluctant(epp.chain([epp.literal("a")]))]),
+             epp.literal("a")],
+            combine=False)
+        self.assertIsNone(epp.parse(None, "a1aa", inner))
+        self.assertIsNone(epp.parse(None, "a1aa", epp.chain([inner])))
+
     def test_greediness_in_the_middle(self):
         """ Test what happens if a greedy parser is bracketed. """
         string = "foo bar baz"
@@ -1394,6 +2724,20 @@ class TestLookahead(unittest.TestCase):
         self.assertEqual(after.parsed, string)
         self.assertEqual(after.left, "")
 
+    def test_greedy_positive_3(self):
+        """
+        Test 'greedy' lookahead mode, positive check #3.
+
+        Test a greedy run of single characters.
+        """
+        string = "12345"
+        parser = epp.chain([epp.greedy(epp.many(epp.digit())), epp.digit()])
+        output = epp.parse(None, string, parser)
+        self.assertIsNotNone(output)
+        _, after = output
+        self.assertEqual(after.parsed, string)
+        self.assertEqual(after.left, "")
+
     def test_interplay_negative_1(self):
         """ Test 'greedy' and 'reluctant' interplay, negative check 1. """
         string = "aabbd"
@@ -1460,6 +2804,124 @@ class TestLookahead(unittest.TestCase):
         value, after = output
         self.assertEqual(value, -1)
 
+    def test_lookahead_resolution(self):
+        """
+        Test that lookahead mode of combinators is known before they are run,
+        once the lazy parsers in them can be built.
+        """
+        def expr():
+            return epp.chain([epp.literal("("), epp.maybe(epp.lazy(expr)),
+                              epp.greedy(epp.many(epp.alpha())), epp.literal(")")])
+        parser = epp.lazy(expr)
+        string = "(" * 6 + "a)" * 6
+        output = epp.parse(None, string, parser)
+        self.assertIsNotNone(output)
+        self.assertEqual(output[1].parsed, string)
+        self.assertTrue(epp.is_greedy(parser))
+        self.assertTrue(epp.is_greedy(epp.branch([epp.literal("a"), parser])))
+        self.assertTrue(epp.is_greedy(epp.chain(epp.reuse_iter(iter, [parser]))))
+        self.assertFalse(epp.has_lookahead(epp.chain([epp.literal("a")])))
+
+    def test_lookahead_resolution_forward_reference(self):
+        """
+        Test that lazy parsers don't call their generators before the first
+        parse, so that generators may refer to names defined later.
+        """
+        calls = []
+        def sentence():
+            calls.append(None)
+            return epp.chain([word(), epp.literal("!")])
+        parser = epp.chain([epp.maybe(epp.lazy(sentence)), epp.greedy(epp.lazy(sentence)),
+                            epp.noconsume(epp.lazy(sentence)),
+                            epp.modify_error(epp.lazy(sentence), lambda err: err)])
+        self.assertFalse(epp.is_greedy(epp.lazy(sentence)))
+        self.assertIsNone(epp.get_scan(epp.lazy(sentence)))
+        self.assertEqual(calls, [])
+        def word():
+            return epp.greedy(epp.many(epp.alpha()))
+        output = epp.parse(None, "ab!cd!ef!", parser)
+        self.assertIsNotNone(output)
+        self.assertEqual(output[1].parsed, "ab!cd!ef!")
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(epp.is_greedy(epp.lazy(sentence)))
+
+    def test_lookahead_resolution_recursive(self):
+        """
+        Test that combinators over recursive references to a lazy parser get
+        the lookahead mode the parser turns out to have.
+        """
+        nested = []
+        def expr():
+            inner = epp.chain([epp.literal("("), epp.lazy(expr), epp.literal(")")])
+            nested.append(inner)
+            return epp.branch([inner, epp.greedy(epp.many(epp.alpha()))])
+        parser = epp.lazy(expr)
+        output = epp.parse(None, "((ab))", parser)
+        self.assertIsNotNone(output)
+        self.assertEqual(output[1].parsed, "((ab))")
+        self.assertTrue(epp.is_greedy(parser))
+        self.assertTrue(epp.is_greedy(nested[0]))
+
+    def test_lookahead_one_shot(self):
+        """
+        Test that chains and branches over one-shot iterators pick up
+        lookahead mode from the parsers they have run.
+        """
+        parser = epp.chain(iter([epp.literal("a"), epp.greedy(epp.everything())]))
+        self.assertFalse(epp.has_lookahead(parser))
+        output = epp.parse(None, "abc", parser)
+        self.assertIsNotNone(output)
+        self.assertTrue(epp.is_greedy(parser))
+        parser = epp.branch(iter([epp.literal("a"), epp.reluctant(epp.everything())]))
+        self.assertFalse(epp.has_lookahead(parser))
+        self.assertIsNotNone(epp.parse(None, "a", parser))
+        self.assertFalse(epp.has_lookahead(parser))
+        self.assertIsNotNone(epp.parse(None, "b", parser))
+        self.assertTrue(epp.is_reluctant(parser))
+
+    def test_match_ends(self):
+        """
+        Test that a parser enumerating its outcomes is not run on portions of
+        input, and that the outcomes are tried in the right order.
+        """
+        calls = []
+        def body(state):
+            """ Consume everything, counting the calls. """
+            calls.append(None)
+            return state.consume(state.left_len)
+        def match_ends(state, longest_first):
+            """ Yield the outcomes on every portion of input. """
+            ends = range(state.left_len + 1)
+            for end in reversed(ends) if longest_first else ends:
+                yield state.consume(end)
+        body.match_ends = match_ends
+        for make, parsed in ((epp.greedy, "aaab"), (epp.reluctant, "a")):
+            parser = epp.chain([make(body), epp.literal("a")], combine=False)
+            output = epp.parse(None, "aaaba", epp.chain([parser, epp.many(epp.any_char())]))
+            self.assertIsNotNone(output)
+            self.assertEqual(output[1].parsed, "aaaba")
+            self.assertEqual(parser.funcs[0].match_ends, match_ends)
+        self.assertEqual(calls, [])
+        self.assertIsNotNone(epp.greedy(epp.integer()).match_ends)
+
+    def test_match_ends_distinct(self):
+        """
+        Test that the rest of a chain is only tried once for every distinct
+        outcome of a parser with lookahead.
+        """
+        calls = []
+        def rest(state):
+            """ Fail, counting the calls. """
+            calls.append(state.left_start)
+            return epp.fail()(state)
+        parser = epp.chain([epp.greedy(epp.chain([epp.literal("ab")])), rest])
+        self.assertIsNone(epp.parse(None, "abcdef", parser))
+        self.assertEqual(calls, [2])
+        calls.clear()
+        parser = epp.chain([epp.reluctant(epp.many(epp.alpha())), rest])
+        self.assertIsNone(epp.parse(None, "abc1", parser))
+        self.assertEqual(calls, [0, 1, 2, 3])
+
     def test_nested_positive_1(self):
         """ Test lookahead in nested chains, positive check #1. """
         string = "ab"
@@ -1622,6 +3084,27 @@ class TestEffects(unittest.TestCase):
         value, _ = output
         self.assertEqual(value, 111)
 
+    def test_lookahead_3(self):
+        """
+        Test effects interaction with lookahead, check #3.
+
+        Test that effects recorded by a lookahead parser are dropped on retry
+        along with the input it gives away.
+        """
+        push = epp.effect(lambda val, st: val + [st.parsed])
+        elem = epp.chain([epp.any_char(), push], combine=False)
+        parser = epp.chain(
+            [
+                epp.greedy(epp.many(elem)),
+                epp.literal("x"),
+                push,
+                epp.literal("y")
+            ])
+        output = epp.parse([], "abxcxy", parser)
+        self.assertIsNotNone(output)
+        value, _ = output
+        self.assertEqual(value, ["a", "b", "x", "c", "x"])
+
     def test_many(self):
         """ Test 'many's interaction with effects. """
         string = "11111111"
@@ -1633,6 +3116,19 @@ class TestEffects(unittest.TestCase):
         value, _ = output
         self.assertEqual(value, len(string))
 
+    def test_many_nested(self):
+        """
+        Test the order of effects from nested repetitions, both small and large.
+        """
+        push = epp.effect(lambda val, st: val + [st.parsed])
+        digits = epp.many(epp.chain([epp.digit(), push], combine=False))
+        group = epp.chain([digits, epp.literal(";"), push])
+        string = "12;" + "".join(str(i % 10) for i in range(100)) + ";345;"
+        output = epp.parse([], string, epp.many(group))
+        self.assertIsNotNone(output)
+        value, _ = output
+        self.assertEqual("".join(value), string)
+
     def test_monoeffect(self):
         """ Test an effect without a chain. """
         string = "foobar"
@@ -1663,6 +3159,76 @@ class TestEffects(unittest.TestCase):
         self.assertEqual(value, ["1", "2"])
 
 
+class TestConcurrency(unittest.TestCase):
+    """ Test sharing parsers between threads and recursion levels. """
+
+    @staticmethod
+    def grammar():
+        """
+        Return a recursive grammar with lookahead, effects and saved iterators,
+        summing up integers in nested parenthesized lists.
+        """
+        def number():
+            """ Parse an integer, pushing it onto the value. """
+            return epp.chain(
+                (p for p in [epp.integer(),
+                             epp.effect(lambda val, st: val + [int(st.parsed)])]),
+                combine=False)
+        def group():
+            """ Parse a parenthesized list, replacing it with its sum. """
+            def close(val, _):
+                mark = len(val) - val[::-1].index("(") - 1
+                return val[:mark] + [sum(val[mark + 1:])]
+            return epp.chain([
+                epp.literal("("), epp.effect(lambda val, st: val + ["("]),
+                epp.greedy(epp.many(epp.white_char())),
+                epp.maybe(epp.chain([epp.lazy(item), epp.many(epp.chain(
+                    [epp.literal(","), epp.lazy(item)]))])),
+                epp.literal(")"), epp.effect(close)])
+        def item():
+            """ Parse a number or a group. """
+            return epp.branch(p for p in [number(), epp.lazy(group)])
+        return epp.chain([epp.lazy(item), epp.end_of_input()])
+
+    @staticmethod
+    def sample(seed):
+        """ Return a nested list string determined by 'seed' and its sum. """
+        if seed < 10:
+            return str(seed), seed
+        parts = [TestConcurrency.sample(seed // 3 - i) for i in range(3)]
+        string = "( " + ",".join(p[0] for p in parts) + ")"
+        return string, sum(p[1] for p in parts)
+
+    def test_threads(self):
+        """ Test one grammar used by several threads at once. """
+        parser = self.grammar()
+        samples = [self.sample(seed) for seed in range(50, 150)]
+        for string, total in samples[:5]:
+            value, _ = epp.parse([], string, parser)
+            self.assertEqual(value, [total])
+        errors = []
+        barrier = threading.Barrier(8)
+        def work(offset):
+            """ Parse all samples, starting with a given one. """
+            barrier.wait()
+            for i in range(len(samples)):
+                string, total = samples[(i + offset) % len(samples)]
+                output = epp.parse([], string, parser)
+                if output is None or output[0] != [total]:
+                    errors.append((string, total, output))
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=work, args=(i * 12,)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors, [])
+
+
 class ExploratoryTesting(unittest.TestCase):
     """
     Exploratory tests.